@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import uuid
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from transactions.redis_scripts import DEDUP_ENQUEUE_LUA
+from transactions.dedup import DedupStore
+
+
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+N          = int(os.getenv("BENCH_N", "20000"))
+CHUNKS     = [int(x) for x in os.getenv("BENCH_CHUNKS", "100,200,500,5000").split(",")]
+TTL_SEC    = int(os.getenv("TX_DEDUP_TTL", "86400"))
+PREFIX     = f"bench_enqueue:{uuid.uuid4().hex[:8]}"
+
+
+def make_args(store, stream_count, records):
+    args = [store.expire_at(), 1, 1, store.mode, store.k, stream_count]
+    for i, rec in enumerate(records):
+        toks = [x for t in rec["tokens"] for x in store.encode(t)]
+        args += [0, i % stream_count + 1, len(toks), *toks, 4]
+        args += ["transaction_id", rec["txid"], "amount", "1.00", "sender_account", "A", "p", "x" * 200]
+    return args
+
+
+def run(client, script, store, streams, chunk):
+    records = [{"txid": f"{PREFIX}:{chunk}:{i}",
+                "tokens": [f"transaction_id:{PREFIX}:{chunk}:{i}", f"correlation_id:{PREFIX}:{chunk}:{i}"]}
+               for i in range(N)]
+    keys = streams + store.bucket_keys()
+    timings = []
+    for i in range(0, N, chunk):
+        args = make_args(store, len(streams), records[i:i + chunk])
+        t0 = time.perf_counter()
+        script(keys=keys, args=args)
+        timings.append((time.perf_counter() - t0) * 1000.0)
+    timings.sort()
+    return timings
+
+
+def main():
+    client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+    script = client.register_script(DEDUP_ENQUEUE_LUA)
+    streams = [f"{PREFIX}:stream:{p}" for p in range(4)]
+    store = DedupStore(client, f"{PREFIX}:seen", TTL_SEC)
+    # худший случай для скрипта: все токены новые, каждый проверяется во всех корзинах
+    calls_per_record = 2 * store.n_buckets * store.k + 1
+    print(f"buckets         : {store.n_buckets} x {store.bucket_sec}s, mode={store.mode}")
+    try:
+        for chunk in CHUNKS:
+            t = run(client, script, store, streams, chunk)
+            p99 = t[min(len(t) - 1, int(len(t) * 0.99))]
+            print(f"chunk {chunk:6d}    : ~{chunk * calls_per_record:7d} redis.call/script, "
+                  f"p50={t[len(t) // 2]:8.2f} ms p99={p99:8.2f} ms max={t[-1]:8.2f} ms")
+    finally:
+        client.delete(*streams, *store.bucket_keys())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+import uuid
+import random
+import django
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+django.setup()
+
+from django.db import connection
+from django.db import transaction as db_tx
+from transactions.models import Transaction
+from transactions import persistence
+
+
+N       = int(os.getenv("BENCH_N", "50000"))
+CHUNK   = int(os.getenv("TX_BULK_CHUNK", "5000"))
+ALERTED = int(os.getenv("BENCH_ALERTED_EVERY", "10"))
+
+
+def make_rows(n: int, prefix: str) -> list:
+    rnd = random.Random(7)
+    base = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+    rows = []
+    for i in range(n):
+        rows.append({
+            "transaction_id": f"{prefix}{i:08d}",
+            "correlation_id": f"C{i:08d}",
+            "timestamp": base + timedelta(seconds=rnd.randint(0, 86400 * 300)),
+            "sender_account": f"ACC{rnd.randint(1, 99999)}",
+            "receiver_account": f"ACC{rnd.randint(1, 99999)}",
+            "amount": round(rnd.uniform(1, 5000), 2),
+            "transaction_type": rnd.choice(["withdrawal", "deposit", "transfer", "payment"]),
+            "merchant_category": rnd.choice(["grocery", "travel", "online", ""]),
+            "location": rnd.choice(["Moscow", "Kazan", "Tokyo"]),
+            "device_used": rnd.choice(["mobile", "atm", "pos", "web"]),
+            "ip_address": f"10.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}",
+            "time_since_last_transaction": rnd.uniform(1, 5000),
+            "spending_deviation_score": round(rnd.uniform(-3, 3), 2),
+            "velocity_score": float(rnd.randint(1, 20)),
+            "geo_anomaly_score": round(rnd.random(), 2),
+            "payment_channel": rnd.choice(["card", "wire_transfer", "ACH"]),
+            "device_hash": f"D{rnd.randint(0, 10**6)}",
+            "status": Transaction.STATUS_PROCESSED,
+        })
+    return rows
+
+
+def resend(rows: list) -> list:
+    # повторная доставка тех же транзакций: каждая ALERTED-я после пересчёта стала alerted
+    out = []
+    for i, row in enumerate(rows):
+        row = dict(row)
+        if i % ALERTED == 0:
+            row["status"] = Transaction.STATUS_ALERTED
+        out.append(row)
+    return out
+
+
+def run_orm(rows):
+    objs = [Transaction(**d) for d in rows]
+    for i in range(0, len(objs), CHUNK):
+        with db_tx.atomic():
+            with connection.cursor() as c:
+                c.execute("SET LOCAL lock_timeout = '5s'")
+                c.execute("SET LOCAL statement_timeout = '30s'")
+            Transaction.objects.bulk_create(objs[i:i + CHUNK], ignore_conflicts=True)
+    # прежний путь повышения статуса: отдельный UPDATE ... WHERE transaction_id IN (...)
+    alerted = [d["transaction_id"] for d in rows if d["status"] == Transaction.STATUS_ALERTED]
+    if alerted:
+        with db_tx.atomic():
+            Transaction.objects.filter(transaction_id__in=alerted).exclude(
+                status=Transaction.STATUS_ALERTED
+            ).update(status=Transaction.STATUS_ALERTED)
+
+
+def run_upsert(backend):
+    def run(rows):
+        persistence.PERSIST_BACKEND = backend
+        size = len(rows) if backend == "copy" else CHUNK
+        for i in range(0, len(rows), size):
+            persistence.upsert_rows(rows[i:i + size])
+    return run
+
+
+def timed(fn, rows):
+    t0 = time.perf_counter()
+    fn(rows)
+    return time.perf_counter() - t0
+
+
+def main():
+    results, resent = {}, {}
+    runs = (
+        ("orm_bulk_create", run_orm),
+        ("values_upsert", run_upsert("insert")),
+        ("copy_upsert", run_upsert("copy")),
+    )
+    for name, fn in runs:
+        prefix = f"B{uuid.uuid4().hex[:6]}"
+        rows = make_rows(N, prefix)
+        try:
+            results[name] = timed(fn, rows)
+            resent[name] = timed(fn, resend(rows))
+            qs = Transaction.objects.filter(transaction_id__startswith=prefix)
+            stored = qs.count()
+            alerted = qs.filter(status=Transaction.STATUS_ALERTED).count()
+        finally:
+            Transaction.objects.filter(transaction_id__startswith=prefix).delete()
+        print(f"{name:16}: {N / results[name]:12.0f} rows/s  ({results[name] * 1000:.0f} ms, stored={stored})")
+        print(f"{'  resend':16}: {N / resent[name]:12.0f} rows/s  ({resent[name] * 1000:.0f} ms, alerted={alerted})")
+    for name in ("values_upsert", "copy_upsert"):
+        print(f"speedup {name:8}: {results['orm_bulk_create'] / results[name]:12.1f}x, "
+              f"resend {resent['orm_bulk_create'] / resent[name]:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
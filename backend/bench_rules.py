@@ -0,0 +1,206 @@
+import os
+import sys
+import time
+import random
+import django
+from types import SimpleNamespace
+
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+django.setup()
+
+from transactions.rule_compiler import compile_rule, reference_eval
+from transactions.rule_vector import np, batch_verdicts, compile_vector
+from transactions.rule_index import ThresholdIndex
+
+
+N       = int(os.getenv("BENCH_N", "20000"))
+N_RULES = int(os.getenv("BENCH_RULES", "60"))
+SEED    = int(os.getenv("BENCH_SEED", "1"))
+N_INDEX = int(os.getenv("BENCH_INDEX_RULES", "2000"))
+
+COLUMNS = [
+    "amount", "velocity_score", "geo_anomaly_score", "spending_deviation_score",
+    "time_since_last_transaction", "transaction_type", "device_used", "location", "missing",
+]
+OPERATORS = [">", ">=", "<", "<=", "==", "!=", "=~"]
+VALUES = [0, 1, 0.5, 100, 2500.0, "100", "abc", "mobile", "transfer", None, ""]
+
+
+def random_leaf(rnd):
+    return {"column": rnd.choice(COLUMNS), "operator": rnd.choice(OPERATORS), "value": rnd.choice(VALUES)}
+
+
+def random_node(rnd, depth=0):
+    if depth >= 3 or rnd.random() < 0.4:
+        leaf = random_leaf(rnd)
+        if rnd.random() < 0.02:
+            leaf.pop(rnd.choice(["operator", "value"]))
+        return leaf
+    node = {"logic": rnd.choice(["AND", "or", "NOT", "XOR"]) if rnd.random() < 0.9 else None}
+    if node["logic"] is None:
+        node.pop("logic")
+    n = rnd.choice([0, 1, 1, 2, 3, 4])
+    node["conditions"] = [random_node(rnd, depth + 1) for _ in range(n)]
+    return node
+
+
+def make_rules(rnd, n):
+    rules = []
+    for i in range(n):
+        if i % 2:
+            rule = SimpleNamespace(rule=random_node(rnd))
+            rules.append(("composite", rule))
+        else:
+            rule = SimpleNamespace(
+                column_name=rnd.choice(COLUMNS),
+                operator=rnd.choice(OPERATORS[:6] * 5 + OPERATORS[6:]),
+                value=float(rnd.choice([0, 1, 0.5, 100, 2500])),
+            )
+            rules.append(("threshold", rule))
+    return rules
+
+
+def make_transactions(rnd, n):
+    out = []
+    for i in range(n):
+        out.append({
+            "transaction_id": f"T{i:08d}",
+            "amount": rnd.choice([round(rnd.uniform(1, 5000), 2), 0, None, "12.5", "bad"]),
+            "velocity_score": rnd.choice([float(rnd.randint(0, 20)), None, ""]),
+            "geo_anomaly_score": round(rnd.random(), 2),
+            "spending_deviation_score": round(rnd.uniform(-3, 3), 2),
+            "time_since_last_transaction": rnd.choice([rnd.uniform(1, 5000), None]),
+            "transaction_type": rnd.choice(["withdrawal", "deposit", "transfer", "payment", "100"]),
+            "device_used": rnd.choice(["mobile", "atm", "pos", "web", ""]),
+            "location": rnd.choice(["Moscow", "Kazan", "Tokyo", None]),
+        })
+    return out
+
+
+def snapshot_of(rules, compiled):
+    out = []
+    for j, ((kind, rule), c) in enumerate(zip(rules, compiled)):
+        c.vector = compile_vector(kind, rule)
+        out.append((kind, None, None, j, "low", rule, c))
+    return out
+
+
+def run_vector(snapshot, txs):
+    verdicts = batch_verdicts(txs, snapshot)
+    for i, tx in enumerate(txs):
+        for j, hit in verdicts.row(i):
+            c = snapshot[j][6]
+            try:
+                if hit or c.test(tx):
+                    c.explain(tx)
+            except Exception:
+                pass
+
+
+def make_threshold_rules(rnd, n):
+    rules = []
+    for _ in range(n):
+        op = rnd.choice([">", ">", ">", ">=", ">=", "<", "<=", "=="] * 4 + ["!="])
+        limit = rnd.uniform(4000, 50000) if op[0] != "<" else rnd.uniform(-50, -2)
+        rules.append(("threshold", SimpleNamespace(
+            column_name=rnd.choice(COLUMNS[:5] + ["missing"]),
+            operator=op,
+            value=round(limit, 2),
+        )))
+    return rules
+
+
+def run_index(index, compiled, txs):
+    for tx in txs:
+        for j, hit in index.candidates(tx):
+            c = compiled[j]
+            try:
+                if hit or c.test(tx):
+                    c.explain(tx)
+            except Exception:
+                pass
+
+
+def make_clean_transactions(rnd, n):
+    return [{
+        "transaction_id": f"C{i:08d}",
+        "amount": round(rnd.expovariate(1 / 800), 2),
+        "velocity_score": float(rnd.randint(0, 20)),
+        "geo_anomaly_score": round(rnd.random(), 2),
+        "spending_deviation_score": round(rnd.uniform(-3, 3), 2),
+        "time_since_last_transaction": rnd.uniform(1, 5000),
+    } for i in range(n)]
+
+
+def bench_index(rnd, txs):
+    rules = make_threshold_rules(rnd, N_INDEX)
+    compiled = [compile_rule(kind, rule) for kind, rule in rules]
+    index = ThresholdIndex([(kind, None, None, j, "low", rule) for j, (kind, rule) in enumerate(rules)])
+    txs = make_clean_transactions(rnd, len(txs))
+
+    t0 = time.perf_counter()
+    run_compiled(compiled, txs)
+    t_cmp = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    run_index(index, compiled, txs)
+    t_idx = time.perf_counter() - t0
+    print(f"index rules     : {N_INDEX:12d}")
+    print(f"clean compiled  : {len(txs) * N_INDEX / t_cmp:12.0f} evals/s")
+    print(f"index           : {len(txs) * N_INDEX / t_idx:12.0f} evals/s")
+    print(f"speedup index   : {t_cmp / t_idx:12.1f}x vs compiled")
+
+
+def run_reference(rules, txs):
+    for tx in txs:
+        for kind, rule in rules:
+            try:
+                reference_eval(kind, rule, tx)
+            except Exception:
+                pass
+
+
+def run_compiled(compiled, txs):
+    for tx in txs:
+        for c in compiled:
+            try:
+                if c.test(tx):
+                    c.explain(tx)
+            except Exception:
+                pass
+
+
+def main():
+    rnd = random.Random(SEED)
+    rules = make_rules(rnd, N_RULES)
+    txs = make_transactions(rnd, N)
+    t0 = time.perf_counter()
+    compiled = [compile_rule(kind, rule) for kind, rule in rules]
+    compile_ms = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    run_reference(rules, txs)
+    t_ref = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    run_compiled(compiled, txs)
+    t_cmp = time.perf_counter() - t0
+
+    print(f"compile         : {compile_ms:12.2f} ms")
+    print(f"reference       : {N * N_RULES / t_ref:12.0f} evals/s")
+    print(f"compiled        : {N * N_RULES / t_cmp:12.0f} evals/s")
+    print(f"speedup         : {t_ref / t_cmp:12.1f}x")
+
+    if np is not None:
+        snapshot = snapshot_of(rules, compiled)
+        t0 = time.perf_counter()
+        run_vector(snapshot, txs)
+        t_vec = time.perf_counter() - t0
+        print(f"vector          : {N * N_RULES / t_vec:12.0f} evals/s")
+        print(f"speedup vector  : {t_ref / t_vec:12.1f}x")
+
+    bench_index(rnd, txs[:2000])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
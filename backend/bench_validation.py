@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import random
+import django
+from datetime import datetime, timedelta
+
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+django.setup()
+
+from transactions.serializers import TransactionSerializer, sanitize_record
+from transactions.validation import transaction_validator
+
+
+N      = int(os.getenv("BENCH_N", "50000"))
+CHUNK  = int(os.getenv("TX_VALIDATE_CHUNK", "10000"))
+BAD_PCT = float(os.getenv("BENCH_BAD_PCT", "0"))
+FORMATS = ["%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%d.%m.%Y %H:%M"]
+
+
+def make_records(n: int) -> list:
+    rnd = random.Random(42)
+    base = datetime(2024, 1, 1)
+    out = []
+    for i in range(n):
+        ts = base + timedelta(seconds=rnd.randint(0, 86400 * 300), microseconds=rnd.randint(0, 999999))
+        rec = {
+            "transaction_id": f"T{i:08d}",
+            "correlation_id": f"C{i:08d}",
+            "timestamp": ts.strftime(rnd.choice(FORMATS)),
+            "sender_account": f"ACC{rnd.randint(1, 99999)}",
+            "receiver_account": f"ACC{rnd.randint(1, 99999)}",
+            "amount": round(rnd.uniform(1, 5000), 2),
+            "transaction_type": rnd.choice(["withdrawal", "deposit", "transfer", "payment"]),
+            "merchant_category": rnd.choice(["grocery", "travel", "<b>online</b>", ""]),
+            "location": rnd.choice(["Moscow", "Kazan", "Tokyo"]),
+            "device_used": rnd.choice(["mobile", "atm", "pos", "web"]),
+            "ip_address": f"10.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}",
+            "time_since_last_transaction": rnd.choice([0.0, rnd.uniform(1, 5000)]),
+            "spending_deviation_score": round(rnd.uniform(-3, 3), 2),
+            "velocity_score": rnd.randint(1, 20),
+            "geo_anomaly_score": round(rnd.random(), 2),
+            "payment_channel": rnd.choice(["card", "wire_transfer", "ACH"]),
+            "device_hash": f"D{rnd.randint(0, 10**6)}",
+        }
+        if rnd.random() * 100 < BAD_PCT:
+            rec[rnd.choice(["sender_account", "amount", "timestamp", "device_used"])] = "bad"
+        out.append(rec)
+    return out
+
+
+def run_drf(items):
+    cleaned, errors = [], []
+    for start in range(0, len(items), CHUNK):
+        for it in items[start:start + CHUNK]:
+            ser = TransactionSerializer(data=it)
+            if ser.is_valid():
+                cleaned.append(sanitize_record(ser.validated_data))
+                errors.append({})
+            else:
+                errors.append(ser.errors)
+    return cleaned, errors
+
+
+def run_drf_many(items):
+    for start in range(0, len(items), CHUNK):
+        ser = TransactionSerializer(data=items[start:start + CHUNK], many=True)
+        if ser.is_valid():
+            [sanitize_record(o) for o in ser.validated_data]
+
+
+def run_compiled(items):
+    cleaned, errors = [], []
+    for start in range(0, len(items), CHUNK):
+        c, e = transaction_validator.validate_many(items[start:start + CHUNK])
+        cleaned.extend(c)
+        errors.extend(e)
+    return cleaned, errors
+
+
+def timed(fn, items):
+    t0 = time.perf_counter()
+    res = fn(items)
+    return res, time.perf_counter() - t0
+
+
+def main():
+    items = make_records(N)
+    _, t_many = timed(run_drf_many, [dict(x) for x in items])
+    (ref_cleaned, ref_errors), _ = timed(run_drf, [dict(x) for x in items])
+    (cleaned, errors), t_fast = timed(run_compiled, [dict(x) for x in items])
+
+    same = (cleaned == ref_cleaned
+            and [bool(e) for e in errors] == [bool(e) for e in ref_errors]
+            and all(dict(a) == dict(b) for a, b in zip(errors, ref_errors) if a))
+
+    print(f"records={N} chunk={CHUNK} bad_pct={BAD_PCT}")
+    print(f"drf_many+sanitize : {N / t_many:12.0f} rec/s  ({t_many * 1000:.0f} ms)")
+    print(f"compiled          : {N / t_fast:12.0f} rec/s  ({t_fast * 1000:.0f} ms)")
+    print(f"speedup           : {t_many / t_fast:12.1f}x")
+    print(f"identical output  : {same}")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+import os
+import sys
+import time
+import redis
+import signal
+import socket
+import logging
+import subprocess
+from dotenv import load_dotenv
+from transactions.admission import read_group_state
+from transactions.partitions import partition_streams
+
+
+load_dotenv()
+
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+STREAM     = os.getenv("TX_STREAM", "transactions_stream")
+GROUP      = os.getenv("TX_GROUP", "1")
+STREAMS    = partition_streams(STREAM)
+
+CPUS         = os.cpu_count() or 1
+WORKERS_MIN  = max(1, int(os.getenv("TX_WORKERS_MIN", "1")))
+WORKERS_MAX  = max(WORKERS_MIN, int(os.getenv("TX_WORKERS_MAX", str(CPUS))))
+if len(STREAMS) > 1:
+    WORKERS_MAX = max(WORKERS_MIN, min(WORKERS_MAX, len(STREAMS)))
+WORKERS_START = min(WORKERS_MAX, max(WORKERS_MIN, int(os.getenv("TX_WORKERS", str(CPUS)))))
+
+AUTOSCALE           = os.getenv("TX_AUTOSCALE", "1") == "1"
+SCALE_INTERVAL_SEC  = float(os.getenv("TX_SCALE_INTERVAL_SEC", "15"))
+SCALE_COOLDOWN_SEC  = float(os.getenv("TX_SCALE_COOLDOWN_SEC", "60"))
+SCALE_UP_BACKLOG    = int(os.getenv("TX_SCALE_UP_BACKLOG", "50000"))
+SCALE_UP_LATENCY_MS = float(os.getenv("TX_SCALE_UP_LATENCY_MS", "5000"))
+SCALE_DOWN_BACKLOG  = int(os.getenv("TX_SCALE_DOWN_BACKLOG", "1000"))
+SCALE_DOWN_CHECKS   = int(os.getenv("TX_SCALE_DOWN_CHECKS", "4"))
+RESTART_BACKOFF_MAX = float(os.getenv("TX_RESTART_BACKOFF_MAX", "30"))
+STOP_TIMEOUT_SEC    = float(os.getenv("TX_STOP_TIMEOUT_SEC", "60"))
+
+WORKER_PATH     = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fraud_worker.py")
+CONSUMER_PREFIX = os.getenv("TX_CONSUMER_PREFIX", f"worker-{socket.gethostname()}")
+BATCH_STATS_KEY = f"{STREAM}:batch_ms"
+
+logger = logging.getLogger("fraud_supervisor")
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+logger.addHandler(handler)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+
+
+class Slot:
+    def __init__(self, index: int):
+        self.index = index
+        self.consumer = f"{CONSUMER_PREFIX}-{index}"
+        self.proc = None
+        self.failures = 0
+        self.restart_at = 0.0
+
+    def start(self):
+        env = dict(os.environ, TX_CONSUMER=self.consumer)
+        self.proc = subprocess.Popen([sys.executable, WORKER_PATH], env=env)
+        logger.warning({"event": "worker_spawned", "slot": self.index, "consumer": self.consumer, "pid": self.proc.pid})
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self):
+        if self.alive():
+            self.proc.send_signal(signal.SIGTERM)
+
+
+class Supervisor:
+    def __init__(self):
+        self.slots = []
+        self.retiring = []
+        self.running = True
+        self.last_scale = 0.0
+        self.low_checks = 0
+        self.prev_backlog = None
+
+    def resize(self, n: int, reason: str):
+        n = max(WORKERS_MIN, min(WORKERS_MAX, n))
+        if n == len(self.slots):
+            return
+        logger.warning({"event": "workers_resize", "from": len(self.slots), "to": n, "reason": reason})
+        while len(self.slots) < n:
+            slot = Slot(len(self.slots))
+            slot.start()
+            self.slots.append(slot)
+        while len(self.slots) > n:
+            slot = self.slots.pop()
+            slot.stop()
+            self.retiring.append(slot)
+        self.last_scale = time.monotonic()
+
+    def reap(self):
+        now = time.monotonic()
+        self.retiring = [s for s in self.retiring if s.alive()]
+        for slot in self.slots:
+            if slot.alive():
+                if slot.failures and now - slot.restart_at > RESTART_BACKOFF_MAX:
+                    slot.failures = 0
+                continue
+            if slot.restart_at > now:
+                continue
+            if slot.proc is not None:
+                code = slot.proc.returncode
+                slot.failures += 1
+                delay = min(RESTART_BACKOFF_MAX, 2 ** (slot.failures - 1))
+                logger.error({"event": "worker_exited", "slot": slot.index, "code": code, "restart_in_sec": delay})
+                slot.proc = None
+                slot.restart_at = now + delay
+                continue
+            slot.start()
+            slot.restart_at = now
+
+    def batch_latency_ms(self):
+        vals = r.hmget(BATCH_STATS_KEY, [s.consumer for s in self.slots])
+        vals = [float(v) for v in vals if v is not None]
+        return sum(vals) / len(vals) if vals else None
+
+    def autoscale(self):
+        if time.monotonic() - self.last_scale < SCALE_COOLDOWN_SEC:
+            return
+        try:
+            backlog = sum(read_group_state(r, STREAMS, GROUP)["backlogs"])
+            latency = self.batch_latency_ms()
+        except redis.RedisError as e:
+            logger.warning({"event": "autoscale_state_failed", "error": str(e)})
+            return
+        growing = self.prev_backlog is not None and backlog >= self.prev_backlog
+        self.prev_backlog = backlog
+        n = len(self.slots)
+
+        if backlog > SCALE_UP_BACKLOG and (growing or (latency or 0) > SCALE_UP_LATENCY_MS):
+            self.low_checks = 0
+            self.resize(n + 1, f"backlog={backlog} latency_ms={latency}")
+            return
+        if backlog < SCALE_DOWN_BACKLOG:
+            self.low_checks += 1
+            if self.low_checks >= SCALE_DOWN_CHECKS:
+                self.low_checks = 0
+                self.resize(n - 1, f"backlog={backlog} latency_ms={latency}")
+        else:
+            self.low_checks = 0
+
+    def shutdown(self, signum=None, frame=None):
+        self.running = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.shutdown)
+        signal.signal(signal.SIGINT, self.shutdown)
+        logger.warning({
+            "event": "supervisor_start",
+            "workers": WORKERS_START,
+            "min": WORKERS_MIN,
+            "max": WORKERS_MAX,
+            "autoscale": AUTOSCALE,
+        })
+        self.resize(WORKERS_START, "start")
+        last_check = time.monotonic()
+        while self.running:
+            self.reap()
+            now = time.monotonic()
+            if AUTOSCALE and now - last_check >= SCALE_INTERVAL_SEC:
+                self.autoscale()
+                last_check = now
+            time.sleep(1.0)
+
+        for slot in self.slots:
+            slot.stop()
+        deadline = time.monotonic() + STOP_TIMEOUT_SEC
+        for slot in self.slots + self.retiring:
+            if slot.proc is None:
+                continue
+            try:
+                slot.proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                slot.proc.kill()
+        logger.warning({"event": "supervisor_stopped"})
+
+
+if __name__ == "__main__":
+    Supervisor().run()
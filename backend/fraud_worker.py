@@ -1,6 +1,10 @@
 import os
-import time
 import json
+import time
+import queue
+import signal
+import socket
+import threading
 import redis
 import django
 import logging
@@ -8,16 +12,25 @@ from datetime import timedelta
 from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
 from django.db import connection
-from django.db import transaction as db_tx
 from django.db.models import Count, Sum, Max
-from django.db.utils import OperationalError
+from django.db.utils import DatabaseError, InterfaceError, OperationalError
 from django.utils import timezone
-from django.utils.dateparse import parse_datetime
 from transactions.models import (Transaction,ThresholdRule,CompositeRule,PatternRule,MLRule,)
-from transactions.rules import (threshold as thr_eval,composite as comp_eval,pattern as patt_eval,ml_eval,)
+from transactions.rules import (pattern as patt_eval,ml_eval,)
+from transactions.rule_compiler import compile_rule, reference_eval
+from transactions.rule_snapshot import RuleSnapshot
+from transactions.rule_stats import RuleStats
+from transactions.rule_events import OP_UPSERT, RULES_CHANNEL, current_version, parse_event
+from transactions.rule_vector import VECTOR_ON, VECTOR_MIN_BATCH, HIT, SCALAR, batch_verdicts, compile_vector
 from transactions.constrants import crit_to_level
-from transactions.webhook import send_alert_webhook
+from transactions.webhook import send_alerts_bulk
 from transactions.ml_engine import MLEngine
+from transactions.partitions import DEAD_MAXLEN, PartitionAssigner, dead_stream, partition_streams
+from transactions.codec import decode_fields
+from transactions.txrecord import TxRecord
+from transactions.txindex import TXINDEX_ON, TxIdIndex
+from transactions.persistence import PERSIST_BACKEND, upsert_rows
+from transactions.windows import make_window_store, pattern_windowed
 
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
@@ -28,21 +41,37 @@ REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 STREAM     = os.getenv("TX_STREAM", "transactions_stream")
 GROUP      = os.getenv("TX_GROUP", "1")
-CONSUMER   = os.getenv("TX_CONSUMER", f"worker-{os.getpid()}")
+CONSUMER   = os.getenv("TX_CONSUMER", f"worker-{socket.gethostname()}-{os.getpid()}")
+STREAMS    = partition_streams(STREAM)
+# после включения партиций непрочитанные записи остаются в базовом потоке: дочитываем его
+LEGACY_STREAMS = [STREAM] if STREAMS != [STREAM] else []
 
 READ_COUNT         = int(os.getenv("TX_READ_COUNT", "8000"))      
 BLOCK_MS           = int(os.getenv("TX_BLOCK_MS", "5000"))
 CLAIM_EVERY_SEC    = int(os.getenv("TX_CLAIM_INTERVAL", "10"))
 MIN_IDLE_MS        = int(os.getenv("TX_MIN_IDLE_MS", "300000"))
 BULK_INSERT_CHUNK  = int(os.getenv("TX_BULK_CHUNK", "5000"))     
-RULES_TTL_SEC      = float(os.getenv("TX_RULES_TTL_SEC", "30")) 
-
-_RULES_CACHE = {"items": [], "loaded_at": 0.0}
+RULES_TTL_SEC      = float(os.getenv("TX_RULES_TTL_SEC", "600")) 
+RULES_CHECK_SEC    = float(os.getenv("TX_RULES_VERSION_CHECK_SEC", "5"))
+TXINDEX_CHECK_SEC  = float(os.getenv("TX_TXINDEX_CHECK_SEC", "60"))
+BATCH_STATS_KEY    = f"{STREAM}:batch_ms"
+PIPELINE_ON        = os.getenv("TX_PIPELINE", "1") == "1"
+PIPELINE_DEPTH     = int(os.getenv("TX_PIPELINE_DEPTH", "2"))
+PROGRESS_EVERY_SEC = float(os.getenv("TX_PROGRESS_EVERY_SEC", "30"))
+RULES_VERIFY       = os.getenv("TX_RULES_VERIFY", "0") == "1"
+STAGE_RETRIES      = int(os.getenv("TX_STAGE_RETRIES", "3"))
+STAGE_RETRY_SEC    = float(os.getenv("TX_STAGE_RETRY_SEC", "1"))
+STAGE_RETRY_MAX    = float(os.getenv("TX_STAGE_RETRY_MAX_SEC", "30"))
+DEAD_STREAM        = dead_stream(STREAM)
+
+_RULES_CACHE = {"snapshot": RuleSnapshot(()), "loaded_at": 0.0, "checked_at": 0.0, "behind": None}
 _RULES_NEEDS_RELOAD = False
+_RULE_EVENTS = queue.SimpleQueue()
 
 STOP_MODE = os.getenv("TX_STOP_MODE")    
 STOP_CRIT = os.getenv("TX_STOP_CRITICALITY") 
 STOP_CRIT_L = crit_to_level(STOP_CRIT)
+RULE_ORDER  = os.getenv("TX_RULE_ORDER", "adaptive")
 
 LOG_DIR  = os.getenv("LOG_DIR", "/app/logs")
 LOG_FILE = os.getenv("LOG_FILE", os.path.join(LOG_DIR, "worker.log"))
@@ -81,6 +110,7 @@ system_logger.addHandler(sh_sys)
 system_logger.addHandler(fh_sys)
 
 r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+r_raw = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=False)
 try:
     r.ping()
     logger.warning({"event": "redis_connect_ok", "host": REDIS_HOST, "port": REDIS_PORT, "stream": STREAM, "group": GROUP})
@@ -88,32 +118,31 @@ except Exception as e:
     logger.error({"event": "redis_connect_fail", "error": str(e)})
     raise
 
-try:
-    r.xgroup_create(STREAM, GROUP, mkstream=True)
-    logger.info({"event": "xgroup_create", "stream": STREAM, "group": GROUP})
-except redis.ResponseError as e:
-    if "BUSYGROUP" in str(e):
-        logger.info({"event": "xgroup_exists", "stream": STREAM, "group": GROUP})
-    else:
-        logger.error({"event": "xgroup_error", "error": str(e)})
-        raise
-
+for _stream in STREAMS:
+    try:
+        r.xgroup_create(_stream, GROUP, mkstream=True)
+        logger.info({"event": "xgroup_create", "stream": _stream, "group": GROUP})
+    except redis.ResponseError as e:
+        if "BUSYGROUP" in str(e):
+            logger.info({"event": "xgroup_exists", "stream": _stream, "group": GROUP})
+        else:
+            logger.error({"event": "xgroup_error", "error": str(e)})
+            raise
 
-def _aware(dt):
-    if dt is None:
-        return timezone.now()
-    return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+assigner = PartitionAssigner(r, STREAM, CONSUMER) if len(STREAMS) > 1 else None
+txid_index = TxIdIndex(r) if TXINDEX_ON else None
+window_store = make_window_store(r, owner=CONSUMER)
+rule_stats = RuleStats(STOP_CRIT_L) if STOP_MODE == "critical" and RULE_ORDER == "adaptive" else None
 
 
-def _warm_ml_models(rules_merged):
+def _warm_ml_models(ml_rules):
     engine = MLEngine.get_instance()
     model_names = []
 
-    for kind, _c, _u, _id, _crit, rule in rules_merged:
-        if kind == "ml":
-            mn = getattr(rule, "model_name", None)
-            if mn:
-                model_names.append(mn)
+    for _kind, _c, _u, _id, _crit, rule, _compiled in ml_rules:
+        mn = getattr(rule, "model_name", None)
+        if mn:
+            model_names.append(mn)
 
     for model_name in set(model_names):
         try:
@@ -131,79 +160,198 @@ def _warm_ml_models(rules_merged):
             })
 
 
-def _load_all_active_rules_from_db() -> list:
-    thr = ThresholdRule.objects.filter(is_active=True).only(
+_RULE_SOURCES = {
+    "threshold": (ThresholdRule, (
         "id","title","column_name","operator","value","criticality","created_at","updated_at"
-    )
-    comp = CompositeRule.objects.filter(is_active=True).only(
+    )),
+    "composite": (CompositeRule, (
         "id","title","rule","criticality","created_at","updated_at"
-    )
-    patt = PatternRule.objects.filter(is_active=True).only(
+    )),
+    "pattern": (PatternRule, (
         "id","title","window_seconds","min_count",
         "total_amount_limit","min_amount_limit","group_mode","criticality",
         "created_at","updated_at"
-    )
-    ml = MLRule.objects.filter(is_active=True).only(
+    )),
+    "ml": (MLRule, (
         "id","title","threshold","model_name","input_template","criticality","created_at","updated_at"
-    )
+    )),
+}
+
 
+def _rule_tuple(kind, r):
+    return (kind, r.created_at, r.updated_at, r.id, r.criticality, r)
+
+
+def _load_all_active_rules_from_db() -> list:
     merged = []
-    for r in thr:  merged.append(("threshold", r.created_at, r.updated_at, r.id, r.criticality, r))
-    for r in comp: merged.append(("composite", r.created_at, r.updated_at, r.id, r.criticality, r))
-    for r in patt: merged.append(("pattern",   r.created_at, r.updated_at, r.id, r.criticality, r))
-    for r in ml:   merged.append(("ml",        r.created_at, r.updated_at, r.id, r.criticality, r))  # 👈
-    merged.sort(key=lambda x: (_aware(x[2]), x[3]))
+    for kind, (Model, fields) in _RULE_SOURCES.items():
+        for r in Model.objects.filter(is_active=True).only(*fields):
+            merged.append(_rule_tuple(kind, r))
     return merged
 
 
+def _load_rule_from_db(kind, rule_id):
+    Model, fields = _RULE_SOURCES[kind]
+    r = Model.objects.filter(id=rule_id, is_active=True).only(*fields).first()
+    return _rule_tuple(kind, r) if r is not None else None
+
+
 def _pubsub_listener():
     global _RULES_NEEDS_RELOAD
-    ps = r.pubsub()
-    ps.subscribe("rules_reload")
-    system_logger.warning("👂 Подписались на канал обновления правил (rules_reload)")
-    for msg in ps.listen():
-        if msg.get("type") == "message":
+    while not _STOP:
+        try:
+            ps = r.pubsub(ignore_subscribe_messages=True)
+            ps.subscribe(RULES_CHANNEL)
+            system_logger.warning(f"👂 Подписались на канал обновления правил ({RULES_CHANNEL})")
+            for msg in ps.listen():
+                if msg.get("type") != "message":
+                    continue
+                ev = parse_event(msg.get("data"))
+                if ev is None:
+                    _RULES_NEEDS_RELOAD = True
+                    system_logger.warning("📢 Получен сигнал обновления правил — кэш помечен на перезагрузку")
+                else:
+                    _RULE_EVENTS.put(ev)
+        except redis.RedisError as e:
+            system_logger.warning({"event": "rules_pubsub_error", "error": str(e)})
             _RULES_NEEDS_RELOAD = True
-            system_logger.warning("📢 Получен сигнал обновления правил — кэш помечен на перезагрузку")
+            time.sleep(1.0)
+
+
+def _compile_rule_tuple(t):
+    compiled = compile_rule(t[0], t[5])
+    if compiled is not None and VECTOR_ON:
+        compiled.vector = compile_vector(t[0], t[5])
+    return t + (compiled,)
+
+
+def _drain_rule_events() -> list:
+    events = []
+    while True:
+        try:
+            events.append(_RULE_EVENTS.get_nowait())
+        except queue.Empty:
+            return events
+
+
+def _apply_rule_events(events) -> bool:
+    snapshot = _RULES_CACHE["snapshot"]
+    version = snapshot.version
+    removed, added = set(), {}
+    for ev in sorted(events, key=lambda e: e["version"]):
+        if ev["version"] <= version:
+            continue
+        if ev["version"] != version + 1:
+            system_logger.warning({"event": "rules_version_gap", "have": version, "got": ev["version"]})
+            return False
+        key = (ev["kind"], ev["id"])
+        removed.add(key)
+        added.pop(key, None)
+        if ev["op"] == OP_UPSERT:
+            t = _load_rule_from_db(ev["kind"], ev["id"])
+            if t is not None:
+                added[key] = _compile_rule_tuple(t)
+        version = ev["version"]
+
+    if version == snapshot.version:
+        return True
+    _RULES_CACHE["snapshot"] = snapshot.with_changes(removed, added.values(), version)
+    system_logger.warning({
+        "event": "rules_delta_applied",
+        "version": version,
+        "changed": sorted(f"{k}:{i}" for k, i in removed),
+        "rules": len(_RULES_CACHE["snapshot"]),
+    })
+    ml_added = [t for t in added.values() if t[0] == "ml"]
+    if ml_added:
+        try:
+            _warm_ml_models(ml_added)
+        except Exception as e:
+            system_logger.warning({"event": "ml_warm_error", "error": str(e)})
+    return True
+
+
+def _remote_rules_version(now):
+    if now - _RULES_CACHE["checked_at"] < RULES_CHECK_SEC:
+        return None
+    _RULES_CACHE["checked_at"] = now
+    try:
+        return current_version(r)
+    except redis.RedisError as e:
+        system_logger.warning({"event": "rules_version_check_failed", "error": str(e)})
+        return None
+
+
+def _reload_rules(now):
+    old = _RULES_CACHE["snapshot"]
+
+    system_logger.warning("══════════════════════════════════════════════════════════════")
+    system_logger.warning("RULES CACHE RELOADING...")
+
+    try:
+        version = current_version(r)
+    except redis.RedisError:
+        version = old.version
+    snapshot = RuleSnapshot(
+        [_compile_rule_tuple(t) for t in _load_all_active_rules_from_db()],
+        version=version,
+    )
+    _RULES_CACHE["snapshot"] = snapshot
+    _RULES_CACHE["loaded_at"] = now
+    _RULES_CACHE["behind"] = None
+
+    system_logger.warning({
+        "event": "rules_cache_refresh",
+        "version": snapshot.version,
+        "before": len(old),
+        "after": len(snapshot),
+        "by_kind": {k: len(v) for k, v in snapshot.by_kind.items()},
+        "msg": "=== Правила перезагружены ==="
+    })
+
+    try:
+        _warm_ml_models(snapshot.by_kind.get("ml", ()))
+        system_logger.info("ML модели прогреты")
+    except Exception as e:
+        system_logger.warning({
+            "event": "ml_warm_error",
+            "error": str(e)
+        })
+
+    system_logger.warning("══════════════════════════════════════════════════════════════")
 
 
 def _maybe_refresh_rules_cache():
     global _RULES_NEEDS_RELOAD
     now = time.monotonic()
+    events = _drain_rule_events()
     need_reload = (
         _RULES_NEEDS_RELOAD
         or (now - _RULES_CACHE["loaded_at"] > RULES_TTL_SEC)
-        or not _RULES_CACHE["items"]
+        or not _RULES_CACHE["loaded_at"]
     )
+    if not need_reload and events:
+        need_reload = not _apply_rule_events(events)
+
+    if not need_reload:
+        # событие могло быть ещё в пути: перезагружаемся, только если расхождение держится две проверки
+        remote = _remote_rules_version(now)
+        if remote is not None:
+            if remote == _RULES_CACHE["snapshot"].version:
+                _RULES_CACHE["behind"] = None
+            elif _RULES_CACHE["behind"] == remote:
+                system_logger.warning({
+                    "event": "rules_version_mismatch",
+                    "local": _RULES_CACHE["snapshot"].version,
+                    "remote": remote,
+                })
+                need_reload = True
+            else:
+                _RULES_CACHE["behind"] = remote
 
     if need_reload:
-        old_count = len(_RULES_CACHE["items"])
-
-        system_logger.warning("══════════════════════════════════════════════════════════════")
-        system_logger.warning("RULES CACHE RELOADING...")
-
-        merged = _load_all_active_rules_from_db()
-        _RULES_CACHE["items"] = merged
-        _RULES_CACHE["loaded_at"] = now
-
-        system_logger.warning({
-            "event": "rules_cache_refresh",
-            "before": old_count,
-            "after": len(merged),
-            "msg": "=== Правила перезагружены ==="
-        })
-
-        try:
-            _warm_ml_models(merged)
-            system_logger.info("ML модели прогреты")
-        except Exception as e:
-            system_logger.warning({
-                "event": "ml_warm_error",
-                "error": str(e)
-            })
-
         _RULES_NEEDS_RELOAD = False
-        system_logger.warning("══════════════════════════════════════════════════════════════")
+        _reload_rules(now)
 
     try:
         MLEngine.get_instance()
@@ -212,38 +360,58 @@ def _maybe_refresh_rules_cache():
         system_logger.warning({"event": "ml_engine_init_fail", "error": str(e)})
 
 
-def load_rules_snapshot(batch_cutoff) -> list:
+def load_rules_snapshot(batch_cutoff):
     _maybe_refresh_rules_cache()
-    cutoff = _aware(batch_cutoff)
-    out = []
-    for t in _RULES_CACHE["items"]:
-        updated = _aware(t[2])  
-        if updated <= cutoff:
-            out.append(t)
-    return out
-
-
-def read_batch():
-    msgs = r.xreadgroup(GROUP, CONSUMER, {STREAM: ">"}, count=READ_COUNT, block=BLOCK_MS)
-    if not msgs:
-        return []
-    _, batch = msgs[0]
-    return batch
-
-
-def _coerce_types(d: dict) -> dict:
-    out = dict(d)
-    ts = out.get("timestamp")
-    if isinstance(ts, str):
-        dt = parse_datetime(ts)
-        if dt:
-            if timezone.is_naive(dt):
-                dt = timezone.make_aware(dt)
-            out["timestamp"] = dt
-    return out
-
-
-def _build_pattern_stats(batch, pattern_rules):
+    return _RULES_CACHE["snapshot"].view(batch_cutoff)
+
+
+def _decode_entries(entries):
+    return [(mid.decode(), TxRecord.parse(decode_fields(fields)) if fields else None) for mid, fields in entries]
+
+
+def read_batch(streams):
+    msgs = r_raw.xreadgroup(GROUP, CONSUMER, {s: ">" for s in streams}, count=READ_COUNT, block=BLOCK_MS)
+    return [(stream.decode(), _decode_entries(batch)) for stream, batch in (msgs or []) if batch]
+
+
+def claim_pending(stream, min_idle_ms):
+    next_id, claimed = "0-0", []
+    while True:
+        res = r_raw.xautoclaim(stream, GROUP, CONSUMER, min_idle_ms, next_id, count=READ_COUNT)
+        if not res or not res[1]:
+            break
+        next_id = res[0].decode()
+        claimed.extend(_decode_entries(res[1]))
+        if next_id == "0-0":
+            break
+    gone = [mid for mid, data in claimed if not data]
+    if gone:
+        r.xack(stream, GROUP, *gone)
+    return [(mid, data) for mid, data in claimed if data]
+
+
+def _rebuild_txid_index():
+    try:
+        ids = Transaction.objects.values_list("transaction_id", flat=True).iterator(chunk_size=txid_index.chunk)
+        total = txid_index.rebuild(ids)
+        if total is not None:
+            logger.warning({"event": "txindex_rebuilt", "count": total})
+    except Exception as e:
+        logger.error({"event": "txindex_rebuild_failed", "error": str(e)})
+    finally:
+        connection.close()
+
+
+def _ensure_txid_index():
+    try:
+        if txid_index.is_ready():
+            return
+    except redis.RedisError:
+        return
+    threading.Thread(target=_rebuild_txid_index, name="txindex-rebuild", daemon=True).start()
+
+
+def _build_pattern_stats(batch, pattern_rules, max_window):
     if not pattern_rules or not batch:
         return {"sender": {}, "receiver": {}, "pair": {}, "max_window_seconds": 0}
 
@@ -251,17 +419,6 @@ def _build_pattern_stats(batch, pattern_rules):
     need_receiver = any(r.group_mode == "receiver" for r in pattern_rules)
     need_pair = any(r.group_mode == "pair" for r in pattern_rules)
 
-    max_window = 0
-    for r in pattern_rules:
-        ws = getattr(r, "window_seconds", None)
-        if ws is None:
-            wm = getattr(r, "window_minutes", 10)
-            try:
-                ws = int(wm) * 60
-            except Exception:
-                ws = 600
-        max_window = max(max_window, int(ws))
-
     senders, receivers, pairs = set(), set(), set()
     for _mid, d in batch:
         s = d.get("sender_account"); rcv = d.get("receiver_account")
@@ -356,31 +513,154 @@ def _pattern_batched(tx: dict, rule, stats) -> tuple[bool, str]:
     return triggered, reason
 
 
-def apply_rules(tx, rules_snapshot, pattern_stats=None):
+def _verify_compiled(kind, rule_id, rule, compiled, tx):
+    try:
+        expected = bool(reference_eval(kind, rule, tx)[0])
+    except Exception as e:
+        expected = type(e)
+    try:
+        got = bool(compiled.test(tx))
+    except Exception as e:
+        got = type(e)
+    if got != expected:
+        logger.error({
+            "event": "rule_compile_mismatch",
+            "rule_type": kind,
+            "rule_id": rule_id,
+            "compiled": str(got),
+            "reference": str(expected),
+            "tx_id": tx.get("transaction_id"),
+        })
+
+
+def _vector_verdicts(rows, rules_snapshot):
+    if not VECTOR_ON or len(rows) < VECTOR_MIN_BATCH:
+        return None
+    try:
+        verdicts = batch_verdicts(rows, rules_snapshot.items)
+    except Exception as e:
+        logger.warning({"event": "rules_vector_error", "error": str(e)})
+        return None
+    if RULES_VERIFY:
+        _verify_vector(rows, rules_snapshot, verdicts)
+    return verdicts
+
+
+def _verify_vector(rows, rules_snapshot, verdicts):
+    for j, (kind, _c, _u, _id, _crit, rule, compiled) in enumerate(rules_snapshot.items):
+        if compiled is None or compiled.vector is None:
+            continue
+        for i, tx in enumerate(rows):
+            st = verdicts.state[i, j]
+            if st == SCALAR:
+                continue
+            try:
+                expected = bool(reference_eval(kind, rule, tx)[0])
+            except Exception as e:
+                expected = type(e)
+            if expected != (st == HIT):
+                logger.error({
+                    "event": "rule_vector_mismatch",
+                    "rule_type": kind,
+                    "rule_id": _id,
+                    "vector": bool(st == HIT),
+                    "reference": str(expected),
+                    "tx_id": tx.get("transaction_id"),
+                })
+
+
+def _verify_index(tx, rules_snapshot, candidates):
+    state = dict(candidates)
+    for j, (kind, _c, _u, _id, _crit, rule, _compiled) in enumerate(rules_snapshot.items):
+        if kind != "threshold" or state.get(j) is False:
+            continue
+        try:
+            expected = bool(reference_eval(kind, rule, tx)[0])
+        except Exception as e:
+            expected = type(e)
+        if expected != bool(state.get(j)):
+            logger.error({
+                "event": "rule_index_mismatch",
+                "rule_id": _id,
+                "index": bool(state.get(j)),
+                "reference": str(expected),
+                "tx_id": tx.get("transaction_id"),
+            })
+
+
+def _rule_candidates(i, tx, rules_snapshot, verdicts, ranking=None):
+    if verdicts is not None:
+        return verdicts.row(i)
+    index = rules_snapshot.threshold_index if ranking is None else ranking.index
+    if index is None:
+        return None
+    candidates = index.candidates(tx)
+    if ranking is not None:
+        # индекс ранжированного представления хранит позиции ранга вместо номеров правил
+        order = ranking.order
+        candidates = [(order[pos], hit) for pos, hit in candidates]
+    if RULES_VERIFY:
+        _verify_index(tx, rules_snapshot, candidates)
+    return candidates
+
+
+def _eval_rule(tx, kind, rule, compiled, hit, pattern_stats, windows):
+    if hit:
+        return True, compiled.explain(tx)
+    if compiled is not None:
+        if RULES_VERIFY:
+            _verify_compiled(kind, rule.id, rule, compiled, tx)
+        if not compiled.test(tx):
+            return False, ""
+        return True, compiled.explain(tx)
+    if kind == "pattern":
+        if windows is not None:
+            res = pattern_windowed(tx, rule, windows)
+        else:
+            res = (_pattern_batched(tx, rule, pattern_stats)
+                   if pattern_stats else patt_eval(tx, rule))
+    else:
+        return False, ""
+
+    triggered = res[0] if isinstance(res, tuple) else bool(res)
+    reason = res[1] if isinstance(res, tuple) and len(res) > 1 else ""
+    return triggered, reason
+
+
+def apply_rules(tx, rules_snapshot, pattern_stats=None, candidates=None, windows=None, ranking=None):
     fired_rules = []
     fired = False
     max_crit = 0
 
-    ml_rules = [r for r in rules_snapshot if r[0] == "ml"]
-
-    for kind, _created, _updated, _id, crit, rule in rules_snapshot:
+    items, levels = rules_snapshot.items, rules_snapshot.levels
+    sample = False
+    if ranking is not None:
+        if candidates is None:
+            candidates = [(j, False) for j in ranking.order]
+        else:
+            # кандидаты уже идут по рангу; известные срабатывания критичных правил — первыми
+            first = [c for c in candidates if c[1] and levels[c[0]] >= STOP_CRIT_L]
+            if first:
+                candidates = first + [c for c in candidates if not (c[1] and levels[c[0]] >= STOP_CRIT_L)]
+        sample = rule_stats.sampled()
+    elif candidates is None:
+        candidates = ((j, False) for j in range(len(items)))
+    stopped = False
+
+    for j, hit in candidates:
+        kind, _created, _updated, _id, crit, rule, compiled = items[j]
+        if stopped and kind == "pattern":
+            # хвост после остановки досчитывается только дешёвыми правилами, окна и БД не трогаем
+            continue
         try:
-            if kind == "threshold":
-                res = thr_eval(tx, rule.column_name, rule.value, rule.operator)
-            elif kind == "composite":
-                res = comp_eval(tx, rule.rule)
-            elif kind == "pattern":
-                res = (_pattern_batched(tx, rule, pattern_stats)
-                       if pattern_stats else patt_eval(tx, rule))
-            elif kind == "ml":
-                continue
+            if sample:
+                t0 = time.perf_counter_ns()
+                triggered, reason = _eval_rule(tx, kind, rule, compiled, hit, pattern_stats, windows)
+                rule_stats.record(kind, _id, triggered, None if hit else time.perf_counter_ns() - t0)
             else:
-                continue
-
-            triggered = res[0] if isinstance(res, tuple) else bool(res)
-            reason = res[1] if isinstance(res, tuple) and len(res) > 1 else ""
+                triggered, reason = _eval_rule(tx, kind, rule, compiled, hit, pattern_stats, windows)
 
-            if not triggered:
+            if not triggered or stopped:
                 continue
 
             fired = True
@@ -392,7 +672,7 @@ def apply_rules(tx, rules_snapshot, pattern_stats=None):
                 "reason": reason
             })
 
-            lvl = crit_to_level(crit)
+            lvl = levels[j]
             if lvl > max_crit:
                 max_crit = lvl
 
@@ -407,9 +687,14 @@ def apply_rules(tx, rules_snapshot, pattern_stats=None):
             })
 
             if STOP_MODE == "critical" and lvl >= STOP_CRIT_L:
-                break
+                if not sample:
+                    break
+                # на сэмплируемой транзакции хвост досчитываем только ради статистики
+                stopped = True
 
         except Exception as e:
+            if stopped:
+                continue
             logger.warning({
                 "event": "rule_error",
                 "kind": kind,
@@ -418,7 +703,7 @@ def apply_rules(tx, rules_snapshot, pattern_stats=None):
                 "error": str(e)
             })
 
-    for kind, _created, _updated, _id, crit, rule in ml_rules:
+    for kind, _created, _updated, _id, crit, rule, _compiled in rules_snapshot.ml:
         try:
             res = ml_eval(tx, rule, advisory_only=True)
             logger.debug({
@@ -437,34 +722,115 @@ def apply_rules(tx, rules_snapshot, pattern_stats=None):
     return fired, fired_rules, max_crit
 
 
-def process_batch(batch, rules_snapshot):
-    rules_memory = {}
-    if not batch:
-        return 0
+def _prepare_windows(pattern_rules, rows, tags=()):
+    if window_store is None:
+        return None
+    if not pattern_rules:
+        window_store.invalidate()
+        return None
+    t0 = time.perf_counter()
+    try:
+        seeded = window_store.prepare(pattern_rules, rows)
+        window_store.begin(rows, tags)
+    except (OperationalError, redis.RedisError) as e:
+        logger.warning({"event": "window_prepare_failed", "error": str(e)})
+        window_store.invalidate()
+        return None
+    if seeded:
+        system_logger.warning({
+            "event": "window_store_seeded",
+            "modes": sorted(window_store.modes),
+            "horizon_sec": window_store.horizon,
+            "since": window_store.since,
+            "keys": window_store.size(),
+            "ms": round((time.perf_counter() - t0) * 1000.0, 1),
+        })
+    elif window_store.stale:
+        logger.info({"event": "window_seed_pending", "modes": sorted(window_store.modes)})
+    return window_store
+
+
+_TX_LOG_MAIN = frozenset((
+    "transaction_id", "sender_account", "receiver_account", "amount", "status", "timestamp",
+    "correlation_id", "transaction_type"
+))
+
 
-    pattern_rules = [t[5] for t in rules_snapshot if t[0] == "pattern"]
-    patt_stats = _build_pattern_stats(batch, pattern_rules)
+def _existing_txids(txids):
+    if not txids:
+        return set()
+    found = None
+    if txid_index is not None:
+        try:
+            found = txid_index.contains(txids)
+        except redis.RedisError as e:
+            logger.warning({"event": "txindex_lookup_failed", "error": str(e)})
+    if found is not None and len(found) == len(txids):
+        return found
+    # индекс не готов или видит не все: остаток уточняем в БД
+    existing = set(found or ())
+    rest = [t for t in txids if t not in existing]
+    for i in range(0, len(rest), 5000):
+        part = rest[i:i+5000]
+        existing.update(
+            Transaction.objects.filter(transaction_id__in=part).values_list("transaction_id", flat=True)
+        )
+    return existing
+
+
+def evaluate_batch(batch, rules_snapshot, stream=STREAM):
+    rules_memory = {}
+    pattern_rules = rules_snapshot.pattern
     t_build = time.perf_counter()
-    to_insert, msg_ids_to_ack = [], []
+    to_insert, to_promote, msg_ids_to_ack = [], [], []
     want_alerted_txids, reprocess_alert_txids = set(), set()
-    recalc_candidates = []  
 
-    for msg_id, data in batch:
-        data = _coerce_types(data)
+    rows, recalc_flags = [], []
+    for _msg_id, data in batch:
         data.pop("is_fraud", None)
         data.pop("is_reviewed", None)
-        is_recalc = str(data.get("recalc", "0")) == "1"
-        triggered, fired_rules, max_crit = apply_rules(data, rules_snapshot, patt_stats)
+        recalc_flags.append(str(data.pop("recalc", "0")) == "1")
+        rows.append(data)
+    # пересчёт уже сохранённой транзакции только повышает статус; новую обрабатываем как обычную
+    existing = _existing_txids(list({
+        d.get("transaction_id") for d, rc in zip(rows, recalc_flags) if rc and d.get("transaction_id")
+    }))
+    recalc_flags = [rc and (not d.get("transaction_id") or d.get("transaction_id") in existing)
+                    for d, rc in zip(rows, recalc_flags)]
+    verdicts = _vector_verdicts(rows, rules_snapshot)
+    ranking = None
+    if rule_stats is not None:
+        ranking = rule_stats.ranking(rules_snapshot)
+        if rule_stats.reordered:
+            logger.info({"event": "rule_order_updated", "head": list(rule_stats.head)})
+        if verdicts is not None:
+            verdicts = verdicts.ranked(ranking.order)
+    # метка сообщения делает сброс в окна идемпотентным при повторной обработке батча
+    tags = [f"{stream}|{msg_id}" for msg_id, _raw in batch]
+    windows, patt_stats = _prepare_windows(pattern_rules, rows, tags), None
+    # пока другой воркер заливает историю, окна только пополняем, а считаем по батчу
+    live_windows = windows if windows is not None and not windows.stale else None
+    if live_windows is None:
+        patt_stats = _build_pattern_stats(batch, pattern_rules, rules_snapshot.max_pattern_window)
+
+    for i, (msg_id, _raw) in enumerate(batch):
+        data, is_recalc = rows[i], recalc_flags[i]
+        candidates = _rule_candidates(i, data, rules_snapshot, verdicts, ranking)
+        triggered, fired_rules, max_crit = apply_rules(data, rules_snapshot, patt_stats, candidates, live_windows, ranking)
+        if windows is not None and not is_recalc:
+            windows.add_tx(data, tags[i])
         data["_fired_rules"] = fired_rules
         txid = data.get("transaction_id")
         if txid:
             rules_memory[txid] = fired_rules 
 
         if is_recalc:
-            if txid:
-                recalc_candidates.append((msg_id, data, triggered))
-            else:
-                msg_ids_to_ack.append(msg_id)
+            if txid and triggered:
+                data.pop("_fired_rules", None)
+                data["status"] = Transaction.STATUS_ALERTED
+                reprocess_alert_txids.add(txid)
+                to_promote.append(data)
+            msg_ids_to_ack.append(msg_id)
             continue
 
         desired_status = Transaction.STATUS_ALERTED if triggered else Transaction.STATUS_PROCESSED
@@ -485,104 +851,91 @@ def process_batch(batch, rules_snapshot):
             ),
             "correlation_id": data.get("correlation_id"),
             "type": data.get("transaction_type"),
-            "additional": {k: v for k, v in data.items() if k not in [
-                "transaction_id", "sender_account", "receiver_account", "amount", "status", "timestamp",
-                "correlation_id", "transaction_type"
-            ]}
+            "additional": {k: v for k, v in data.items() if k not in _TX_LOG_MAIN}
         }
         transaction_logger.info(transaction_log)
 
         data.pop("_fired_rules", None)
-        to_insert.append(Transaction(**data))
+        to_insert.append(data)
         msg_ids_to_ack.append(msg_id)
 
-    recalc_txids = [d.get("transaction_id") for _, d, _ in recalc_candidates if d.get("transaction_id")]
-    existing = set()
+    if windows is not None:
+        try:
+            windows.flush()
+        except redis.RedisError as e:
+            logger.warning({"event": "window_flush_failed", "error": str(e)})
+        if windows.late:
+            logger.info({"event": "window_late_events", "count": windows.late, "watermark": windows.watermark()})
+            windows.late = 0
+
+    to_insert.sort(key=lambda d: d.get("transaction_id") or "") 
+    build_ms = (time.perf_counter() - t_build) * 1000.0
+    return {
+        "batch": batch,
+        "to_insert": to_insert,
+        "to_promote": to_promote,
+        "msg_ids_to_ack": msg_ids_to_ack,
+        "want_alerted_txids": want_alerted_txids,
+        "reprocess_alert_txids": reprocess_alert_txids,
+        "rules_memory": rules_memory,
+        "build_ms": build_ms,
+    }
 
-    if recalc_txids:
-        for i in range(0, len(recalc_txids), 5000):
-            part = recalc_txids[i:i+5000]
-            existing.update(
-                Transaction.objects.filter(transaction_id__in=part).values_list("transaction_id", flat=True)
-            )
 
-    for msg_id, data, triggered in recalc_candidates:
-        txid = data.get("transaction_id")
-        if txid in existing:
-            if triggered:
-                reprocess_alert_txids.add(txid)
-            msg_ids_to_ack.append(msg_id)
-        else:
-            desired_status = Transaction.STATUS_ALERTED if triggered else Transaction.STATUS_PROCESSED
-            data.pop("recalc", None)
-            data["status"] = desired_status
-            if txid and desired_status == Transaction.STATUS_ALERTED:
-                want_alerted_txids.add(txid)
-            transaction_log = {
-                "event": "transaction_log",
-                "transaction_id": data.get("transaction_id"),
-                "sender": data.get("sender_account"),
-                "receiver": data.get("receiver_account"),
-                "amount": data.get("amount"),
-                "status": data.get("status"),
-                "timestamp": (
-                    data.get("timestamp").isoformat() if hasattr(data.get("timestamp"), "isoformat") else str(data.get("timestamp"))
-                ),
-                "correlation_id": data.get("correlation_id"),
-                "type": data.get("transaction_type"),
-                "additional": {k: v for k, v in data.items() if k not in [
-                    "transaction_id", "sender_account", "receiver_account", "amount", "status", "timestamp",
-                    "correlation_id", "transaction_type"
-                ]}
-            }
-            transaction_logger.info(transaction_log)
-            to_insert.append(Transaction(**data))
-            msg_ids_to_ack.append(msg_id)
-    
-    to_insert.sort(key=lambda o: o.transaction_id or "") 
-    build_ms = (time.perf_counter() - t_build) * 1000.0
+def persist_batch(ctx):
+    # повышение статуса идёт тем же upsert: ON CONFLICT обновляет только status
+    to_insert = ctx["to_insert"] + ctx["to_promote"]
     t_db = time.perf_counter()
-    for i in range(0, len(to_insert), BULK_INSERT_CHUNK):
-        chunk = to_insert[i:i+BULK_INSERT_CHUNK]
+    persisted_txids = []
+    upserted, failed = 0, 0
+    chunk_size = max(1, len(to_insert) if PERSIST_BACKEND == "copy" else BULK_INSERT_CHUNK)
+    for i in range(0, len(to_insert), chunk_size):
+        chunk = to_insert[i:i+chunk_size]
         try:
-            with db_tx.atomic():
-                with connection.cursor() as c:
-                    c.execute("SET LOCAL lock_timeout = '5s'")
-                    c.execute("SET LOCAL statement_timeout = '30s'")
-
-                Transaction.objects.bulk_create(
-                    chunk,
-                    ignore_conflicts=True,
-                )
+            upserted += upsert_rows(chunk)
+            persisted_txids.extend(t for t in (d.get("transaction_id") for d in chunk) if t)
 
         except OperationalError as e:
             logger.error({
                 "event": "bulk_insert_failed",
+                "backend": PERSIST_BACKEND,
                 "chunk_start": i,
-            "chunk_size": len(chunk),
-            "error": str(e),
-        })
-        continue
-
-    with db_tx.atomic():
-        if want_alerted_txids:
-            Transaction.objects.filter(
-                transaction_id__in=list(want_alerted_txids)
-            ).exclude(status=Transaction.STATUS_ALERTED).update(
-                status=Transaction.STATUS_ALERTED
-            )
+                "chunk_size": len(chunk),
+                "error": str(e),
+            })
+            failed += 1
+            continue
 
-        if reprocess_alert_txids:
-            Transaction.objects.filter(
-                transaction_id__in=list(reprocess_alert_txids)
-            ).exclude(status=Transaction.STATUS_ALERTED).update(
-                status=Transaction.STATUS_ALERTED
-            )
     db_ms = (time.perf_counter() - t_db) * 1000.0
+    if txid_index is not None and persisted_txids:
+        try:
+            txid_index.add(persisted_txids)
+        except redis.RedisError as e:
+            logger.warning({"event": "txindex_add_failed", "error": str(e)})
+            try:
+                txid_index.invalidate()
+            except redis.RedisError:
+                pass
+    ctx["db_ms"] = db_ms
+    ctx["upserted"] = upserted
+    if failed:
+        # не подтверждаем батч, часть которого не сохранена: повтор upsert безопасен
+        raise OperationalError(f"{failed} chunk(s) failed to persist")
+    return ctx
+
+
+def ack_and_alert(ctx, stream):
+    batch = ctx["batch"]
+    to_insert = ctx["to_insert"]
+    msg_ids_to_ack = ctx["msg_ids_to_ack"]
+    want_alerted_txids = ctx["want_alerted_txids"]
+    reprocess_alert_txids = ctx["reprocess_alert_txids"]
+    rules_memory = ctx["rules_memory"]
+    build_ms, db_ms = ctx["build_ms"], ctx["db_ms"]
     t_ack = time.perf_counter()
     pipe = r.pipeline(transaction=False)
     for mid in msg_ids_to_ack:
-        pipe.xack(STREAM, GROUP, mid)
+        pipe.xack(stream, GROUP, mid)
     pipe.execute()
     ack_ms = (time.perf_counter() - t_ack) * 1000.0
     logger.info({
@@ -591,8 +944,11 @@ def process_batch(batch, rules_snapshot):
         "db_ms": round(db_ms, 1),
         "ack_ms": round(ack_ms, 1),
         "batch_size": len(batch),
+        "stream": stream,
         "inserted": len(to_insert),
+        "upserted": ctx.get("upserted", 0),
         "reprocess_upgraded": len(reprocess_alert_txids),
+        **({"stages": ctx["stages"]} if "stages" in ctx else {}),
     })
     if want_alerted_txids:
         rules_by_tx = {
@@ -601,11 +957,20 @@ def process_batch(batch, rules_snapshot):
             if fired
         }
 
+        tx_by_id = {}
+        for _, d in batch:
+            if d:
+                tx_by_id.setdefault(d.get("transaction_id"), d)
+
+        alerts = []
         for txid, rules_list in rules_by_tx.items():
             if not rules_list:
                 continue
 
-            tx_data = next((d for _, d in batch if d.get("transaction_id") == txid), None)
+            if txid not in want_alerted_txids:
+                continue
+
+            tx_data = tx_by_id.get(txid)
             if not tx_data:
                 continue
 
@@ -620,76 +985,334 @@ def process_batch(batch, rules_snapshot):
             crit = max_rule["criticality"]
 
             reason_text = "; ".join(rule_reasons) if rule_reasons else "—"
+            alerts.append((tx_data, [f"{t} ({reason_text})" for t in rule_titles], crit, reason_text))
+
+        if alerts:
+            send_alerts_bulk(alerts, tg_client=r)
 
-            send_alert_webhook(
-                tx_data,
-                rules_triggered=[f"{t} ({reason_text})" for t in rule_titles],
-                criticality=crit
-            )
-            
-            try:
-                alert_payload = {
-                    "txid": tx_data.get("transaction_id"),
-                    "amount": tx_data.get("amount"),
-                    "sender": tx_data.get("sender_account"),
-                    "receiver": tx_data.get("receiver_account"),
-                    "criticality": crit,
-                    "reason": reason_text,
-                }
-                r.xadd("tg_alert_queue", {"payload": json.dumps(alert_payload)}, maxlen=2000)
-                logger.info(f"[TG enqueue] tx={tx_data.get('transaction_id')} ({crit})")
-            except Exception as e:
-                logger.warning(f"[TG enqueue error] {e}")
-      
     return len(to_insert)
 
 
+def _transient(e) -> bool:
+    return isinstance(e, (OperationalError, InterfaceError, redis.ConnectionError, redis.TimeoutError))
+
+
+def _poison(e) -> bool:
+    # ошибка не БД и не Redis - повтор того же батча не поможет
+    return not isinstance(e, (DatabaseError, redis.RedisError))
+
+
+def _retrying(stage, fn, item):
+    attempt = 0
+    while True:
+        try:
+            return fn(item)
+        except Exception as e:
+            attempt += 1
+            # недоступность БД/Redis пережидаем без лимита: ack только после коммита
+            if _STOP or _poison(e) or (not _transient(e) and attempt > STAGE_RETRIES):
+                raise
+            logger.warning({"event": "batch_stage_retry", "stage": stage, "attempt": attempt, "error": str(e)})
+            time.sleep(min(STAGE_RETRY_MAX, STAGE_RETRY_SEC * 2 ** (attempt - 1)))
+
+
+def _dead_letter(stream, batch, stage, error):
+    # исходные поля записи копируются как есть, чтобы replay_dead.py вернул её в поток без изменений
+    ids = [mid for mid, _ in batch]
+    pipe = r_raw.pipeline(transaction=False)
+    for mid in ids:
+        pipe.xrange(stream, mid, mid)
+    originals = pipe.execute()
+    pipe = r_raw.pipeline(transaction=False)
+    for (mid, data), found in zip(batch, originals):
+        if found:
+            fields = dict(found[0][1])
+        else:
+            payload = data.as_dict(raw=True) if isinstance(data, TxRecord) else dict(data or {})
+            fields = {"dlq_payload": json.dumps(payload, ensure_ascii=False, default=str)}
+        fields.update({"dlq_stream": stream, "dlq_msg_id": mid, "dlq_stage": stage, "dlq_error": error})
+        pipe.xadd(DEAD_STREAM, fields, maxlen=DEAD_MAXLEN, approximate=True)
+    pipe.xack(stream, GROUP, *ids)
+    pipe.execute()
+    logger.error({
+        "event": "batch_dead_lettered",
+        "stream": stream,
+        "stage": stage,
+        "batch_size": len(batch),
+        "dead_stream": DEAD_STREAM,
+        "error": error,
+    })
+
+
+def _batch_failed(stream, batch, stage, e):
+    if not _poison(e):
+        # записи остаются в PEL и вернутся через XAUTOCLAIM после MIN_IDLE_MS
+        logger.error({"event": "batch_left_pending", "stream": stream, "stage": stage,
+                      "batch_size": len(batch), "error": str(e)})
+        return
+    try:
+        _dead_letter(stream, batch, stage, f"{type(e).__name__}: {e}")
+    except redis.RedisError as de:
+        logger.error({"event": "dead_letter_failed", "stream": stream, "error": str(de)})
+
+
+def process_batch(batch, rules_snapshot, stream=STREAM):
+    if not batch:
+        return 0
+    stage = "evaluate"
+    try:
+        ctx = evaluate_batch(batch, rules_snapshot, stream)
+        stage = "persist"
+        _retrying(stage, persist_batch, ctx)
+        stage = "ack"
+        return _retrying(stage, lambda c: ack_and_alert(c, stream), ctx)
+    except Exception as e:
+        _batch_failed(stream, batch, stage, e)
+        return 0
+
+
+def _batch_done(stream, n, dt):
+    tps = (n / dt) if dt > 0 else 0.0
+    logger.info({"event": "batch_done", "stream": stream, "n": n, "dt_ms": round(dt*1000, 1), "tps": round(tps, 1)})
+    try:
+        r.hset(BATCH_STATS_KEY, CONSUMER, round(dt*1000, 1))
+    except redis.RedisError:
+        pass
+
+
+def _run_batch(stream, batch):
+    if pipeline is not None:
+        pipeline.submit(stream, batch)
+        return 0
+    batch_cutoff = timezone.now()
+    rules_snapshot = load_rules_snapshot(batch_cutoff)
+
+    t_batch = time.perf_counter()
+    n = process_batch(batch, rules_snapshot, stream)
+    _batch_done(stream, n, time.perf_counter() - t_batch)
+    return n
+
+
+class _Stage:
+    def __init__(self, name, fn, retry=True, on_fail=None):
+        self.name = name
+        self.fn = fn
+        self.retry = retry
+        self.on_fail = on_fail
+        self.out = None
+        self.q = queue.Queue(maxsize=PIPELINE_DEPTH)
+        self.busy = 0.0
+        self.failed = 0
+        self.window = time.perf_counter()
+        self.thread = threading.Thread(target=self._loop, name=f"stage-{name}", daemon=True)
+
+    def _loop(self):
+        try:
+            while True:
+                item = self.q.get()
+                if item is None:
+                    if self.out is not None:
+                        self.out.q.put(None)
+                    self.q.task_done()
+                    return
+                t = time.perf_counter()
+                res = None
+                try:
+                    # стадия последовательна: пока батч повторяется, следующие не обгоняют его до ack
+                    res = _retrying(self.name, self.fn, item) if self.retry else self.fn(item)
+                except Exception as e:
+                    self.failed += 1
+                    logger.error({"event": "pipeline_stage_failed", "stage": self.name, "error": str(e)})
+                    if self.on_fail is not None:
+                        try:
+                            self.on_fail(self.name, item, e)
+                        except Exception as fe:
+                            # поток стадии не должен умирать: иначе submit()/close() повиснут
+                            logger.error({"event": "pipeline_fail_handler_error", "stage": self.name, "error": str(fe)})
+                self.busy += time.perf_counter() - t
+                if res is not None and self.out is not None:
+                    self.out.q.put(res)
+                self.q.task_done()
+        finally:
+            connection.close()
+
+    def stats(self) -> dict:
+        now = time.perf_counter()
+        span = now - self.window
+        occupancy = self.busy / span if span > 0 else 0.0
+        failed, self.failed = self.failed, 0
+        self.busy, self.window = 0.0, now
+        return {"queue": self.q.qsize(), "busy_pct": round(occupancy * 100.0, 1), "failed": failed}
+
+
+class BatchPipeline:
+    def __init__(self):
+        self.processed = 0
+        self.stages = [
+            # evaluate меняет записи и окна на месте, поэтому не повторяется
+            _Stage("evaluate", self._evaluate, retry=False, on_fail=self._failed),
+            _Stage("persist", persist_batch, on_fail=self._failed),
+            _Stage("ack", self._ack, on_fail=self._failed),
+        ]
+        for up, down in zip(self.stages, self.stages[1:]):
+            up.out = down
+        for st in self.stages:
+            st.thread.start()
+
+    def _evaluate(self, item):
+        stream, batch, t_submit = item
+        rules_snapshot = load_rules_snapshot(timezone.now())
+        ctx = evaluate_batch(batch, rules_snapshot, stream)
+        ctx["stream"], ctx["t_submit"] = stream, t_submit
+        return ctx
+
+    def _ack(self, ctx):
+        ctx["stages"] = {st.name: st.stats() for st in self.stages}
+        n = ack_and_alert(ctx, ctx["stream"])
+        self.processed += n
+        _batch_done(ctx["stream"], n, time.perf_counter() - ctx["t_submit"])
+
+    def _failed(self, stage, item, e):
+        if isinstance(item, tuple):
+            stream, batch = item[0], item[1]
+        else:
+            stream, batch = item["stream"], item["batch"]
+        _batch_failed(stream, batch, stage, e)
+
+    def submit(self, stream, batch):
+        if batch:
+            self.stages[0].q.put((stream, batch, time.perf_counter()))
+
+    def drain(self):
+        for st in self.stages:
+            st.q.join()
+
+    def close(self):
+        self.stages[0].q.put(None)
+        for st in self.stages:
+            st.thread.join()
+
+
+pipeline = None
+
+
+def _lease_heartbeat():
+    # аренды продлеваются отдельно от главного цикла: submit() может ждать дольше аренды
+    while not _STOP:
+        try:
+            assigner.heartbeat()
+        except redis.RedisError as e:
+            logger.warning({"event": "partition_heartbeat_failed", "error": str(e)})
+        time.sleep(assigner.heartbeat_sec)
+
+
+def _drain_legacy_streams():
+    n = 0
+    for stream in LEGACY_STREAMS:
+        try:
+            claimed = claim_pending(stream, MIN_IDLE_MS)
+            if claimed:
+                n += _run_batch(stream, claimed)
+            while True:
+                msgs = r_raw.xreadgroup(GROUP, CONSUMER, {stream: ">"}, count=READ_COUNT)
+                batch = _decode_entries(msgs[0][1]) if msgs and msgs[0][1] else []
+                if batch:
+                    logger.info({"event": "legacy_stream_drain", "stream": stream, "count": len(batch)})
+                    n += _run_batch(stream, batch)
+                if not msgs or len(msgs[0][1]) < READ_COUNT:
+                    break
+        except redis.ResponseError as e:
+            # базового потока или группы нет - дочитывать нечего
+            if "NOGROUP" not in str(e):
+                logger.error({"event": "legacy_stream_error", "stream": stream, "error": str(e)})
+    return n
+
+
+def _claim_and_run(streams, min_idle_ms):
+    n = 0
+    try:
+        for stream in streams:
+            claimed = claim_pending(stream, min_idle_ms)
+            if claimed:
+                logger.info({"event":"xautoclaim_claimed","stream": stream,"count":len(claimed)})
+                for i in range(0, len(claimed), READ_COUNT):
+                    n += _run_batch(stream, claimed[i:i + READ_COUNT])
+    except redis.ResponseError as e:
+        if "unknown command" in str(e).lower():
+            logger.warning("xautoclaim not supported, consider Redis >= 6.2")
+        else:
+            logger.error({"event":"xautoclaim_error","error": str(e)})
+    return n
+
+
+_STOP = False
+
+
+def _request_stop(signum, frame):
+    global _STOP
+    _STOP = True
+    logger.warning({"event": "worker_stop_requested", "signal": signum})
+
+
 def main():
+    global pipeline
+    signal.signal(signal.SIGTERM, _request_stop)
+    if PIPELINE_ON:
+        pipeline = BatchPipeline()
     last_claim = time.monotonic()
+    last_index_check = 0.0
+    last_progress = time.monotonic()
     total, t0 = 0, time.perf_counter()
-    logger.warning({"event": "worker_loop_start"})
+    logger.warning({"event": "worker_loop_start", "consumer": CONSUMER, "partitions": len(STREAMS)})
+    threading.Thread(target=_pubsub_listener, name="rules-pubsub", daemon=True).start()
+    if assigner is not None:
+        threading.Thread(target=_lease_heartbeat, name="partition-heartbeat", daemon=True).start()
 
     try:
-        while True:
+        while not _STOP:
+            if assigner is not None:
+                owned = assigner.refresh(before_release=pipeline.drain if pipeline is not None else None)
+                if assigner.newly_acquired:
+                    if window_store is not None:
+                        window_store.invalidate()
+                    total += _claim_and_run(assigner.newly_acquired, 0)
+                if not owned:
+                    time.sleep(assigner.heartbeat_sec)
+                    continue
+            else:
+                owned = STREAMS
+
             now_mono = time.monotonic()
+            if txid_index is not None and now_mono - last_index_check >= TXINDEX_CHECK_SEC:
+                _ensure_txid_index()
+                last_index_check = now_mono
             if now_mono - last_claim >= CLAIM_EVERY_SEC:
-                try:
-                    next_id, claimed_total = "0-0", 0
-                    while True:
-                        res = r.xautoclaim(STREAM, GROUP, CONSUMER, MIN_IDLE_MS, next_id, count=READ_COUNT)
-                        if not res or not res[1]:
-                            break
-                        next_id = res[0]; claimed_total += len(res[1])
-                    if claimed_total:
-                        logger.info({"event":"xautoclaim_claimed","count":claimed_total})
-                except redis.ResponseError as e:
-                    if "unknown command" in str(e).lower():
-                        logger.warning("xautoclaim not supported, consider Redis >= 6.2")
-                    else:
-                        logger.error({"event":"xautoclaim_error","error": str(e)})
+                total += _claim_and_run(owned, MIN_IDLE_MS)
+                total += _drain_legacy_streams()
                 last_claim = now_mono
 
-            batch = read_batch()
-            if not batch:
-                continue
-
-            batch_cutoff = timezone.now()
-            rules_snapshot = load_rules_snapshot(batch_cutoff)
+            for stream, batch in read_batch(owned):
+                total += _run_batch(stream, batch)
 
-            t_batch = time.perf_counter()
-            n = process_batch(batch, rules_snapshot)
-            dt = time.perf_counter() - t_batch
-            tps = (n / dt) if dt > 0 else 0.0
-
-            total += n
-            logger.info({"event": "batch_done", "n": n, "dt_ms": round(dt*1000, 1), "tps": round(tps, 1), "total": total})
-
-            if total and total % 10000 == 0:
+            done = total + (pipeline.processed if pipeline is not None else 0)
+            if done and time.monotonic() - last_progress >= PROGRESS_EVERY_SEC:
                 dt_total = time.perf_counter() - t0
-                tps_total = total / dt_total if dt_total > 0 else 0.0
-                logger.info({"event": "progress", "processed": total, "avg_tps": round(tps_total, 2)})
+                tps_total = done / dt_total if dt_total > 0 else 0.0
+                logger.info({"event": "progress", "processed": done, "avg_tps": round(tps_total, 2)})
+                last_progress = time.monotonic()
 
     except KeyboardInterrupt:
+        pass
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+            total += pipeline.processed
+        if assigner is not None:
+            assigner.release_all()
+        try:
+            r.hdel(BATCH_STATS_KEY, CONSUMER)
+        except redis.RedisError:
+            pass
         dt_total = time.perf_counter() - t0
         tps_total = total / dt_total if dt_total > 0 else 0.0
         logger.warning({"event": "final_summary", "processed": total, "seconds": round(dt_total, 3), "avg_tps": round(tps_total, 2)})
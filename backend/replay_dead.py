@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+import redis
+import logging
+from dotenv import load_dotenv
+from transactions.partitions import dead_stream
+
+
+load_dotenv()
+
+REDIS_HOST   = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT   = int(os.getenv("REDIS_PORT", "6379"))
+STREAM       = os.getenv("TX_STREAM", "transactions_stream")
+DEAD_STREAM  = dead_stream(STREAM)
+REPLAY_COUNT = int(os.getenv("TX_REPLAY_COUNT", "0"))
+REPLAY_STAGE = os.getenv("TX_REPLAY_STAGE", "")
+REPLAY_CHUNK = int(os.getenv("TX_REPLAY_CHUNK", "500"))
+DRY_RUN      = os.getenv("TX_REPLAY_DRY_RUN", "0") == "1"
+
+logger = logging.getLogger("replay_dead")
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+logger.addHandler(handler)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=False)
+
+_META = (b"dlq_stream", b"dlq_msg_id", b"dlq_stage", b"dlq_error")
+
+
+def _restore(fields: dict) -> dict:
+    payload = fields.get(b"dlq_payload")
+    if payload is not None:
+        return {k: "" if v is None else str(v) for k, v in json.loads(payload).items()}
+    return {k: v for k, v in fields.items() if k not in _META}
+
+
+def replay() -> dict:
+    stats = {"replayed": 0, "skipped": 0}
+    start = "-"
+    while not REPLAY_COUNT or stats["replayed"] < REPLAY_COUNT:
+        entries = r.xrange(DEAD_STREAM, start, "+", count=REPLAY_CHUNK)
+        if not entries:
+            break
+        start = "(" + entries[-1][0].decode()
+        pipe = r.pipeline(transaction=True)
+        for mid, fields in entries:
+            if REPLAY_COUNT and stats["replayed"] >= REPLAY_COUNT:
+                break
+            stage = (fields.get(b"dlq_stage") or b"").decode()
+            target = (fields.get(b"dlq_stream") or b"").decode()
+            if not target or (REPLAY_STAGE and stage != REPLAY_STAGE):
+                stats["skipped"] += 1
+                continue
+            # запись уходит в исходный поток и удаляется из мёртвого атомарно
+            pipe.xadd(target, _restore(fields))
+            pipe.xdel(DEAD_STREAM, mid)
+            stats["replayed"] += 1
+        if not DRY_RUN:
+            pipe.execute()
+    return stats
+
+
+def main():
+    stats = replay()
+    logger.warning({"event": "dead_replayed", "dead_stream": DEAD_STREAM, "dry_run": DRY_RUN, **stats})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
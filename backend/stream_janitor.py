@@ -0,0 +1,129 @@
+import os
+import time
+import redis
+import logging
+from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge, start_http_server
+from transactions.partitions import DEAD_MAXLEN, dead_stream, partition_streams
+
+
+load_dotenv()
+
+REDIS_HOST   = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT   = int(os.getenv("REDIS_PORT", "6379"))
+STREAM       = os.getenv("TX_STREAM", "transactions_stream")
+INTERVAL_SEC = float(os.getenv("TX_JANITOR_INTERVAL_SEC", "5"))
+TRIM_LIMIT   = int(os.getenv("TX_JANITOR_TRIM_LIMIT", "0"))
+MEMORY_SAMPLES = int(os.getenv("TX_JANITOR_MEMORY_SAMPLES", "5"))
+METRICS_PORT = int(os.getenv("TX_JANITOR_METRICS_PORT", "9108"))
+
+# базовый поток остаётся от записей до разбиения на партиции; его дочитывают воркеры, чистим по MINID так же
+STREAMS = partition_streams(STREAM)
+STREAMS += [STREAM] if STREAM not in STREAMS else []
+DEAD_STREAM = dead_stream(STREAM)
+
+logger = logging.getLogger("stream_janitor")
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+logger.addHandler(handler)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+STREAM_LENGTH  = Gauge("tx_stream_length", "Entries currently stored in the stream", ["stream"])
+STREAM_MEMORY  = Gauge("tx_stream_memory_bytes", "MEMORY USAGE of the stream key", ["stream"])
+STREAM_BACKLOG = Gauge("tx_stream_backlog", "Unread plus pending entries per consumer group", ["stream", "group"])
+STREAM_TRIMMED = Counter("tx_stream_trimmed_total", "Entries removed by the janitor", ["stream"])
+
+r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+
+
+def _parse_id(sid: str) -> tuple:
+    ms, _, seq = sid.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def _after(sid: str) -> str:
+    ms, seq = _parse_id(sid)
+    return f"{ms}-{seq + 1}"
+
+
+def safe_min_id(stream: str):
+    groups = r.xinfo_groups(stream)
+    if not groups:
+        return None, groups
+    floor = None
+    for g in groups:
+        if g.get("pending"):
+            summary = r.xpending(stream, g["name"])
+            candidate = summary.get("min") or g["last-delivered-id"]
+        else:
+            candidate = _after(g["last-delivered-id"])
+        if floor is None or _parse_id(candidate) < _parse_id(floor):
+            floor = candidate
+    return floor, groups
+
+
+def sweep_stream(stream: str) -> dict:
+    try:
+        floor, groups = safe_min_id(stream)
+    except redis.ResponseError as e:
+        if "no such key" in str(e).lower():
+            return {"stream": stream, "length": 0, "trimmed": 0}
+        raise
+
+    trimmed = 0
+    if floor is not None and floor != "0-1":
+        trimmed = r.xtrim(stream, minid=floor, approximate=True, limit=TRIM_LIMIT or None)
+        if trimmed:
+            STREAM_TRIMMED.labels(stream).inc(trimmed)
+    return {"stream": stream, "min_id": floor, "trimmed": trimmed, "groups": len(groups), **_measure(stream, groups)}
+
+
+def sweep_dead(stream: str) -> dict:
+    # у мёртвого потока нет групп (replay читает XRANGE), поэтому MINID неприменим - держим его по MAXLEN
+    trimmed = r.xtrim(stream, maxlen=DEAD_MAXLEN, approximate=True, limit=TRIM_LIMIT or None)
+    if trimmed:
+        STREAM_TRIMMED.labels(stream).inc(trimmed)
+    return {"stream": stream, "maxlen": DEAD_MAXLEN, "trimmed": trimmed, **_measure(stream, [])}
+
+
+def _measure(stream: str, groups) -> dict:
+    pipe = r.pipeline(transaction=False)
+    pipe.xlen(stream)
+    pipe.memory_usage(stream, samples=MEMORY_SAMPLES)
+    length, memory = pipe.execute(raise_on_error=False)
+    if not isinstance(length, Exception):
+        STREAM_LENGTH.labels(stream).set(length)
+    if not isinstance(memory, Exception) and memory is not None:
+        STREAM_MEMORY.labels(stream).set(memory)
+    for g in groups:
+        lag = g.get("lag")
+        if lag is not None:
+            STREAM_BACKLOG.labels(stream, g["name"]).set(int(lag) + int(g.get("pending") or 0))
+
+    return {
+        "length": length if not isinstance(length, Exception) else None,
+        "memory_bytes": memory if not isinstance(memory, Exception) else None,
+    }
+
+
+def main():
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    logger.warning({"event": "janitor_start", "streams": STREAMS, "dead_stream": DEAD_STREAM,
+                    "dead_maxlen": DEAD_MAXLEN, "interval_sec": INTERVAL_SEC})
+    while True:
+        t0 = time.perf_counter()
+        for stream in STREAMS + [DEAD_STREAM]:
+            try:
+                stats = sweep_dead(stream) if stream == DEAD_STREAM else sweep_stream(stream)
+                if stats["trimmed"]:
+                    logger.info({"event": "stream_trimmed", **stats})
+            except Exception as e:
+                logger.error({"event": "janitor_error", "stream": stream, "error": str(e)})
+        elapsed = time.perf_counter() - t0
+        time.sleep(max(0.0, INTERVAL_SEC - elapsed))
+
+
+if __name__ == "__main__":
+    main()
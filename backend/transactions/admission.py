@@ -0,0 +1,114 @@
+import os
+import math
+import time
+import logging
+from typing import List, Optional
+
+
+ADMISSION_ON      = os.getenv("TX_ADMISSION", "1") == "1"
+ADMIT_RATIO       = float(os.getenv("TX_ADMIT_MAX_RATIO", "0.8"))
+ADMIT_PARTIAL     = os.getenv("TX_ADMIT_PARTIAL", "1") == "1"
+ADMIT_CACHE_MS    = int(os.getenv("TX_ADMIT_CACHE_MS", "250"))
+RETRY_AFTER_SEC   = int(os.getenv("TX_ADMIT_RETRY_AFTER", "5"))
+RETRY_AFTER_MAX   = int(os.getenv("TX_ADMIT_RETRY_AFTER_MAX", "60"))
+
+logger = logging.getLogger("transactions.admission")
+
+
+def read_group_state(client, streams: List[str], group: str) -> dict:
+    pipe = client.pipeline(transaction=False)
+    for s in streams:
+        pipe.xlen(s)
+        pipe.xinfo_groups(s)
+    res = pipe.execute(raise_on_error=False)
+
+    backlogs, consumers, entries_read = [], 0, 0
+    for i in range(len(streams)):
+        length, groups = res[2 * i], res[2 * i + 1]
+        if isinstance(length, Exception):
+            raise length
+        info = None
+        if not isinstance(groups, Exception):
+            info = next((g for g in groups if g.get("name") == group), None)
+        if info is None:
+            backlogs.append(int(length))
+            continue
+        lag = info.get("lag")
+        unread = int(lag) if lag is not None else int(length)
+        backlogs.append(unread + int(info.get("pending") or 0))
+        consumers += int(info.get("consumers") or 0)
+        entries_read += int(info.get("entries-read") or 0)
+    return {"backlogs": backlogs, "consumers": consumers, "entries_read": entries_read}
+
+
+class Decision:
+    __slots__ = ("admit", "status", "retry_after", "reason", "backlog")
+
+    def __init__(self, admit: Optional[int], status: int = 202, retry_after: Optional[int] = None,
+                 reason: str = "ok", backlog: Optional[int] = None):
+        self.admit = admit
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+        self.backlog = backlog
+
+
+class AdmissionController:
+    def __init__(self, client, streams: List[str], group: str, partition_maxlen: int,
+                 ratio: float = ADMIT_RATIO, cache_ms: int = ADMIT_CACHE_MS, partial: bool = ADMIT_PARTIAL):
+        self.r = client
+        self.streams = streams
+        self.group = group
+        self.limit = max(1, int(partition_maxlen * ratio))
+        self.cache_ms = cache_ms
+        self.partial = partial
+        self._at = 0.0
+        self._state = None
+        self._rate_sample = None
+        self.drain_rate = None
+
+    def _read_state(self) -> dict:
+        return read_group_state(self.r, self.streams, self.group)
+
+    def state(self) -> dict:
+        now = time.monotonic()
+        if self._state is not None and (now - self._at) * 1000.0 < self.cache_ms:
+            return self._state
+        st = self._read_state()
+        if st["entries_read"]:
+            if self._rate_sample is not None:
+                t_prev, read_prev = self._rate_sample
+                if now > t_prev and st["entries_read"] >= read_prev:
+                    self.drain_rate = (st["entries_read"] - read_prev) / (now - t_prev)
+            self._rate_sample = (now, st["entries_read"])
+        self._state, self._at = st, now
+        return st
+
+    def retry_after(self, excess: int) -> int:
+        if self.drain_rate:
+            return max(1, min(RETRY_AFTER_MAX, math.ceil(excess / self.drain_rate)))
+        return RETRY_AFTER_SEC
+
+    def decide(self, wanted: Optional[int]) -> Decision:
+        try:
+            st = self.state()
+        except Exception as e:
+            logger.warning({"event": "admission_state_failed", "error": str(e)})
+            return Decision(admit=wanted)
+
+        backlogs = st["backlogs"]
+        backlog = sum(backlogs)
+        headroom = max(0, min(self.limit - b for b in backlogs)) * len(backlogs)
+
+        if backlog and not st["consumers"]:
+            return Decision(0, 503, RETRY_AFTER_SEC, "no_consumers", backlog)
+        if headroom <= 0:
+            return Decision(0, 429, self.retry_after(backlog - self.limit * len(backlogs) + 1), "lag", backlog)
+        if wanted is None:
+            return Decision(headroom, backlog=backlog)
+        if wanted <= headroom:
+            return Decision(wanted, backlog=backlog)
+        retry = self.retry_after(wanted - headroom)
+        if self.partial:
+            return Decision(headroom, 202, retry, "partial", backlog)
+        return Decision(0, 429, retry, "lag", backlog)
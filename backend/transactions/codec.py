@@ -0,0 +1,132 @@
+import os
+import math
+import struct
+from datetime import datetime, timezone as dt_timezone, timedelta
+
+
+STREAM_FORMAT = os.getenv("TX_STREAM_FORMAT", "hash")
+PACKED_FIELD  = "p"
+PACKED_VERSION = 1
+AMOUNT_SCALE  = 100
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+US = timedelta(microseconds=1)
+
+TRANSACTION_TYPES = ("withdrawal", "deposit", "transfer", "payment")
+DEVICES = ("mobile", "atm", "pos", "web")
+FLOAT_FIELDS = ("time_since_last_transaction", "spending_deviation_score", "velocity_score", "geo_anomaly_score")
+STR_FIELDS = (
+    "transaction_id", "correlation_id", "sender_account", "receiver_account",
+    "merchant_category", "location", "payment_channel", "device_hash", "status", "ip_address",
+)
+REQUIRED = ("transaction_id", "correlation_id", "timestamp", "sender_account", "receiver_account",
+            "amount", "transaction_type", "device_used")
+IGNORED = ("is_fraud", "is_reviewed")
+KNOWN = set(STR_FIELDS) | set(FLOAT_FIELDS) | set(IGNORED) | {
+    "timestamp", "amount", "transaction_type", "device_used", "recalc",
+}
+
+F_RECALC = 1
+NULL_STR = 0xFFFF
+NULL_FLOAT = float("nan")
+
+_HEAD = struct.Struct("<BBqq4dBB%dH" % len(STR_FIELDS))
+_TYPE_IDX = {v: i for i, v in enumerate(TRANSACTION_TYPES)}
+_DEVICE_IDX = {v: i for i, v in enumerate(DEVICES)}
+
+
+def _epoch_us(ts):
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    if not isinstance(ts, datetime) or ts.tzinfo is None:
+        return None
+    return (ts - EPOCH) // US
+
+
+def pack_record(obj: dict):
+    if any(k not in KNOWN for k in obj) or any(obj.get(k) is None for k in REQUIRED):
+        return None
+    try:
+        ts_us = _epoch_us(obj["timestamp"])
+        amount = float(obj["amount"])
+        cents = round(amount * AMOUNT_SCALE)
+        if ts_us is None or cents / AMOUNT_SCALE != amount:
+            return None
+        t_idx = _TYPE_IDX[obj["transaction_type"]]
+        d_idx = _DEVICE_IDX[obj["device_used"]]
+
+        flags = F_RECALC if str(obj.get("recalc", "0")) == "1" else 0
+        floats = []
+        for name in FLOAT_FIELDS:
+            v = obj.get(name)
+            if v is None:
+                floats.append(NULL_FLOAT)
+                continue
+            v = float(v)
+            if math.isnan(v):
+                return None
+            floats.append(v)
+
+        lens, texts = [], []
+        for name in STR_FIELDS:
+            v = obj.get(name)
+            if v is None:
+                lens.append(NULL_STR)
+                continue
+            v = str(v)
+            if len(v) >= NULL_STR:
+                return None
+            lens.append(len(v))
+            texts.append(v)
+        head = _HEAD.pack(PACKED_VERSION, flags, ts_us, cents, *floats, t_idx, d_idx, *lens)
+        body = "".join(texts).encode("utf-8")
+    except (KeyError, ValueError, TypeError, OverflowError, UnicodeEncodeError, struct.error):
+        return None
+    return head + body
+
+
+def unpack_record(buf: bytes) -> dict:
+    head = _HEAD.unpack_from(buf, 0)
+    if head[0] != PACKED_VERSION:
+        raise ValueError(f"Неизвестная версия формата записи: {head[0]}")
+    f0, f1, f2, f3 = head[4:8]
+    out = {
+        "timestamp": EPOCH + timedelta(0, 0, head[2]),
+        "amount": head[3] / AMOUNT_SCALE,
+        "transaction_type": TRANSACTION_TYPES[head[8]],
+        "device_used": DEVICES[head[9]],
+        "time_since_last_transaction": f0 if f0 == f0 else None,
+        "spending_deviation_score": f1 if f1 == f1 else None,
+        "velocity_score": f2 if f2 == f2 else None,
+        "geo_anomaly_score": f3 if f3 == f3 else None,
+    }
+    text = buf[_HEAD.size:].decode("utf-8")
+    pos = 0
+    for name, n in zip(STR_FIELDS, head[10:]):
+        if n == NULL_STR:
+            out[name] = None
+            continue
+        out[name] = text[pos:pos + n]
+        pos += n
+    if head[1] & F_RECALC:
+        out["recalc"] = "1"
+    return out
+
+
+def encode_fields(obj: dict, fmt: str = STREAM_FORMAT) -> dict:
+    if fmt == "packed":
+        packed = pack_record(obj)
+        if packed is not None:
+            return {PACKED_FIELD: packed}
+    return {k: (v.isoformat() if hasattr(v, "isoformat") else str(v)) for k, v in obj.items()}
+
+
+def decode_fields(fields: dict) -> dict:
+    packed = fields.get(b"p")
+    if packed is None:
+        return {k.decode("utf-8"): v.decode("utf-8") for k, v in fields.items()}
+    out = unpack_record(packed)
+    for k, v in fields.items():
+        if k != b"p":
+            out[k.decode("utf-8")] = v.decode("utf-8")
+    return out
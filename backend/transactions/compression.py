@@ -0,0 +1,107 @@
+import io
+import os
+import gzip
+import zlib
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import JSONParser
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+MAX_DECOMPRESSED = int(os.getenv("TX_MAX_DECOMPRESSED_BYTES", str(256 * 1024 * 1024)))
+MAX_RATIO        = float(os.getenv("TX_MAX_COMPRESSION_RATIO", "200"))
+RATIO_MIN_BYTES  = int(os.getenv("TX_COMPRESSION_RATIO_MIN_BYTES", str(1024 * 1024)))
+READ_BUFFER      = 64 * 1024
+
+IDENTITY = ("", "identity")
+GZIP = ("gzip", "x-gzip")
+ZSTD = ("zstd",)
+
+_DECODE_ERRORS = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+class PayloadTooLarge(APIException):
+    status_code = 413
+    default_detail = "Распакованное тело запроса превышает допустимый размер."
+    default_code = "payload_too_large"
+
+
+class UnsupportedContentEncoding(APIException):
+    status_code = 415
+    default_detail = "Неподдерживаемый Content-Encoding."
+    default_code = "unsupported_content_encoding"
+
+
+def content_encoding(request) -> str:
+    return (request.META.get("HTTP_CONTENT_ENCODING") or "").strip().lower()
+
+
+def supported_encodings() -> tuple:
+    return IDENTITY + GZIP + (ZSTD if zstandard else ())
+
+
+class _CountingReader(io.RawIOBase):
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.raw.read(len(b))
+        n = len(data)
+        b[:n] = data
+        self.count += n
+        return n
+
+
+class _LimitedReader(io.RawIOBase):
+    def __init__(self, src, counter: _CountingReader, limit: int, ratio: float):
+        self.src = src
+        self.counter = counter
+        self.limit = limit
+        self.ratio = ratio
+        self.total = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        try:
+            data = self.src.read(len(b))
+        except _DECODE_ERRORS as e:
+            raise ParseError(f"Не удалось распаковать тело запроса: {e}")
+        n = len(data)
+        self.total += n
+        if self.total > self.limit:
+            raise PayloadTooLarge(f"Распакованное тело запроса больше {self.limit} байт.")
+        if self.total > RATIO_MIN_BYTES and self.total > self.ratio * max(1, self.counter.count):
+            raise PayloadTooLarge(f"Коэффициент сжатия тела запроса превышает {self.ratio:g}.")
+        b[:n] = data
+        return n
+
+
+def decoded_stream(stream, encoding: str, limit: int = MAX_DECOMPRESSED, ratio: float = MAX_RATIO):
+    if encoding in IDENTITY:
+        return stream
+    counter = _CountingReader(stream)
+    if encoding in GZIP:
+        src = gzip.GzipFile(fileobj=counter, mode="rb")
+    elif encoding in ZSTD and zstandard is not None:
+        src = zstandard.ZstdDecompressor().stream_reader(counter, read_across_frames=True)
+    else:
+        raise UnsupportedContentEncoding(f"Неподдерживаемый Content-Encoding: {encoding}")
+    return io.BufferedReader(_LimitedReader(src, counter, limit, ratio), buffer_size=READ_BUFFER)
+
+
+class CompressedJSONParser(JSONParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get("request")
+        encoding = content_encoding(request) if request is not None else ""
+        if stream is not None and encoding not in IDENTITY:
+            stream = decoded_stream(stream, encoding)
+        return super().parse(stream, media_type, parser_context)
@@ -0,0 +1,121 @@
+import os
+import math
+import time
+import hashlib
+import redis
+from typing import List
+
+
+DEDUP_MODE     = os.getenv("TX_DEDUP_MODE", "set")
+BUCKET_SEC     = int(os.getenv("TX_DEDUP_BUCKET_SEC", "0"))
+BUCKETS        = int(os.getenv("TX_DEDUP_BUCKETS", "4"))
+BLOOM_CAPACITY = int(os.getenv("TX_DEDUP_BLOOM_CAPACITY", "1000000"))
+BLOOM_FP_RATE  = float(os.getenv("TX_DEDUP_BLOOM_FP", "0.001"))
+
+
+class DedupStore:
+    def __init__(self, client, prefix: str, ttl_sec: int, bucket_sec: int = BUCKET_SEC, mode: str = DEDUP_MODE,
+                 capacity: int = BLOOM_CAPACITY, fp_rate: float = BLOOM_FP_RATE, chunk: int = 50000):
+        if mode not in ("set", "bloom"):
+            raise ValueError(f"Неизвестный режим дедупликации: {mode}")
+        self.r = client
+        self.prefix = prefix
+        self.ttl_sec = ttl_sec
+        # каждый токен проверяется во всех корзинах, поэтому по умолчанию корзин мало: TTL / TX_DEDUP_BUCKETS
+        self.bucket_sec = max(1, bucket_sec or math.ceil(ttl_sec / max(1, BUCKETS)))
+        self.mode = mode
+        self.n_buckets = max(1, math.ceil(ttl_sec / self.bucket_sec)) + 1
+        self.chunk = chunk
+        self.k = 1
+        self.bits = 0
+        if mode == "bloom":
+            bucket_fp = fp_rate / self.n_buckets
+            self.bits = int(math.ceil(-capacity * math.log(bucket_fp) / (math.log(2) ** 2)))
+            self.k = max(1, int(round(self.bits / capacity * math.log(2))))
+            self.chunk = max(1, chunk // self.k)
+
+    @property
+    def bloom(self) -> bool:
+        return self.mode == "bloom"
+
+    def _bucket(self, now=None) -> int:
+        return int((now if now is not None else time.time()) // self.bucket_sec)
+
+    def bucket_keys(self, now=None) -> List[str]:
+        cur = self._bucket(now)
+        return [f"{self.prefix}:{cur - i}" for i in range(self.n_buckets)]
+
+    def expire_at(self, now=None) -> int:
+        return (self._bucket(now) + 1) * self.bucket_sec + self.ttl_sec
+
+    def encode(self, token: str) -> List[str]:
+        if not self.bloom:
+            return [token]
+        d = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], "big")
+        h2 = int.from_bytes(d[8:], "big") | 1
+        return [str((h1 + i * h2) % self.bits) for i in range(self.k)]
+
+    def _check_cmds(self, pipe, key: str, part: List[str]) -> None:
+        if self.bloom:
+            args = []
+            for tok in part:
+                for off in self.encode(tok):
+                    args += ["GET", "u1", off]
+            pipe.execute_command("BITFIELD_RO", key, *args)
+        else:
+            pipe.execute_command("SMISMEMBER", key, *part)
+
+    def _fold(self, part: List[str], per_bucket: list) -> List[bool]:
+        if not self.bloom:
+            return [any(bool(res[j]) for res in per_bucket) for j in range(len(part))]
+        k = self.k
+        return [
+            any(all(res[j * k:(j + 1) * k]) for res in per_bucket)
+            for j in range(len(part))
+        ]
+
+    def seen_flags(self, tokens: List[str], now=None) -> List[bool]:
+        keys = self.bucket_keys(now)
+        flags: List[bool] = []
+        for i in range(0, len(tokens), self.chunk):
+            part = tokens[i:i + self.chunk]
+            if not part:
+                continue
+            pipe = self.r.pipeline(transaction=False)
+            for key in keys:
+                self._check_cmds(pipe, key, part)
+            try:
+                per_bucket = pipe.execute()
+            except redis.ResponseError:
+                pipe = self.r.pipeline(transaction=False)
+                for key in keys:
+                    for tok in part:
+                        if self.bloom:
+                            for off in self.encode(tok):
+                                pipe.getbit(key, int(off))
+                        else:
+                            pipe.sismember(key, tok)
+                res = pipe.execute()
+                step = len(part) * self.k
+                per_bucket = [res[b * step:(b + 1) * step] for b in range(len(keys))]
+            flags.extend(self._fold(part, per_bucket))
+        return flags
+
+    def add(self, tokens: List[str], now=None) -> None:
+        if not tokens:
+            return
+        key = self.bucket_keys(now)[0]
+        pipe = self.r.pipeline(transaction=False)
+        for i in range(0, len(tokens), self.chunk):
+            part = tokens[i:i + self.chunk]
+            if self.bloom:
+                args = []
+                for tok in part:
+                    for off in self.encode(tok):
+                        args += ["SET", "u1", off, 1]
+                pipe.execute_command("BITFIELD", key, *args)
+            else:
+                pipe.sadd(key, *part)
+        pipe.expireat(key, self.expire_at(now))
+        pipe.execute()
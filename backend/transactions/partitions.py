@@ -0,0 +1,152 @@
+import os
+import time
+import zlib
+import hashlib
+import logging
+from typing import List
+
+
+STREAM_PARTITIONS = max(1, int(os.getenv("TX_STREAM_PARTITIONS", "1")))
+LEASE_MS          = int(os.getenv("TX_PARTITION_LEASE_MS", "30000"))
+HEARTBEAT_SEC     = float(os.getenv("TX_PARTITION_HEARTBEAT_SEC", "3"))
+DEAD_MAXLEN       = int(os.getenv("TX_DEAD_MAXLEN", "100000"))
+
+logger = logging.getLogger("transactions.partitions")
+
+ACQUIRE_LUA = """
+local cur = redis.call('GET', KEYS[1])
+if cur == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if not cur then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def partition_streams(base: str, n: int = STREAM_PARTITIONS) -> List[str]:
+    if n <= 1:
+        return [base]
+    return [f"{base}:{i}" for i in range(n)]
+
+
+def dead_stream(base: str) -> str:
+    return os.getenv("TX_DEAD_STREAM") or f"{base}:dead"
+
+
+def partition_of(key, n: int = STREAM_PARTITIONS) -> int:
+    if n <= 1:
+        return 0
+    return zlib.crc32(str(key or "").encode("utf-8")) % n
+
+
+def stream_for(base: str, key, n: int = STREAM_PARTITIONS) -> str:
+    if n <= 1:
+        return base
+    return f"{base}:{partition_of(key, n)}"
+
+
+def _hrw_owner(partition: int, workers: List[str]) -> str:
+    return max(workers, key=lambda w: hashlib.md5(f"{w}:{partition}".encode("utf-8")).digest())
+
+
+class PartitionAssigner:
+    def __init__(self, client, base: str, consumer: str, n: int = STREAM_PARTITIONS,
+                 lease_ms: int = LEASE_MS, heartbeat_sec: float = HEARTBEAT_SEC):
+        self.r = client
+        self.base = base
+        self.consumer = consumer
+        self.n = n
+        self.lease_ms = lease_ms
+        self.heartbeat_sec = heartbeat_sec
+        self.members_key = f"{base}:members"
+        self.streams = partition_streams(base, n)
+        self.owned: List[str] = []
+        self.newly_acquired: List[str] = []
+        self._last = 0.0
+        self._acquire = client.register_script(ACQUIRE_LUA)
+        self._release = client.register_script(RELEASE_LUA)
+        self._renew = client.register_script(RENEW_LUA)
+
+    def _lease_key(self, stream: str) -> str:
+        return f"{stream}:owner"
+
+    def refresh(self, force: bool = False, before_release=None) -> List[str]:
+        now = time.monotonic()
+        self.newly_acquired = []
+        if not force and now - self._last < self.heartbeat_sec:
+            return self.owned
+        self._last = now
+
+        wall = time.time()
+        pipe = self.r.pipeline(transaction=False)
+        pipe.zadd(self.members_key, {self.consumer: wall})
+        pipe.zremrangebyscore(self.members_key, "-inf", wall - self.lease_ms / 1000.0)
+        pipe.zrange(self.members_key, 0, -1)
+        live = pipe.execute()[2] or [self.consumer]
+
+        desired = [s for p, s in enumerate(self.streams) if _hrw_owner(p, live) == self.consumer]
+        lost = [s for s in self.owned if s not in desired]
+        if lost and before_release is not None:
+            before_release()
+        for s in lost:
+            self._release(keys=[self._lease_key(s)], args=[self.consumer])
+
+        owned = []
+        for s in desired:
+            if self._acquire(keys=[self._lease_key(s)], args=[self.consumer, self.lease_ms]):
+                owned.append(s)
+                if s not in self.owned:
+                    self.newly_acquired.append(s)
+
+        if owned != self.owned:
+            logger.warning({
+                "event": "partitions_rebalanced",
+                "consumer": self.consumer,
+                "workers": len(live),
+                "owned": owned,
+            })
+        self.owned = owned
+        return owned
+
+    def heartbeat(self) -> List[str]:
+        # продлевает только уже взятые аренды; перераспределение остаётся за refresh()
+        owned = list(self.owned)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.zadd(self.members_key, {self.consumer: time.time()})
+        for s in owned:
+            self._renew(keys=[self._lease_key(s)], args=[self.consumer, self.lease_ms], client=pipe)
+        res = pipe.execute()[1:]
+        lost = [s for s, ok in zip(owned, res) if not ok]
+        if lost:
+            logger.warning({"event": "partition_lease_lost", "consumer": self.consumer, "streams": lost})
+        return lost
+
+    def release_all(self) -> None:
+        for s in self.owned:
+            try:
+                self._release(keys=[self._lease_key(s)], args=[self.consumer])
+            except Exception:
+                pass
+        try:
+            self.r.zrem(self.members_key, self.consumer)
+        except Exception:
+            pass
+        self.owned = []
@@ -0,0 +1,125 @@
+import io
+import os
+from typing import List
+from django.db import connection
+from django.db import transaction as db_tx
+from .models import Transaction
+
+
+PERSIST_BACKEND = os.getenv("TX_PERSIST_BACKEND", "insert")
+STAGE_TABLE     = "tx_copy_stage"
+ALERTED         = Transaction.STATUS_ALERTED
+
+_FIELDS = [f for f in Transaction._meta.concrete_fields if not f.primary_key]
+COLUMNS = [f.column for f in _FIELDS]
+_NULLABLE_TYPED = {
+    f.attname for f in _FIELDS
+    if f.null and f.get_internal_type() not in ("CharField", "TextField")
+}
+_DEFAULTS = {f.attname: f.get_default() for f in _FIELDS if f.has_default()}
+# значения родного для колонки типа psycopg2 передаёт как есть, без get_db_prep_save
+_NATIVE = {"CharField": str, "TextField": str, "FloatField": float, "BooleanField": bool}
+_PREP = [(f, _NATIVE.get(f.get_internal_type())) for f in _FIELDS]
+_TXID = Transaction._meta.get_field("transaction_id").column
+_STATUS = Transaction._meta.get_field("status").column
+_TABLE = connection.ops.quote_name(Transaction._meta.db_table)
+_COLS_SQL = ", ".join(connection.ops.quote_name(c) for c in COLUMNS)
+_ROW_SQL = "(" + ", ".join(["%s"] * len(COLUMNS)) + ")"
+
+# статус только повышается: processed -> alerted, обратно никогда
+_ON_CONFLICT = (
+    f" ON CONFLICT ({_TXID}) DO UPDATE SET {_STATUS} = EXCLUDED.{_STATUS}"
+    f" WHERE EXCLUDED.{_STATUS} = '{ALERTED}'"
+    f" AND {_TABLE}.{_STATUS} IS DISTINCT FROM '{ALERTED}'"
+)
+
+
+def _collapse(rows: List[dict]) -> List[dict]:
+    out, by_txid = [], {}
+    for row in rows:
+        txid = row.get("transaction_id")
+        if txid is None:
+            out.append(row)
+            continue
+        prev = by_txid.get(txid)
+        if prev is None or (row.get("status") == ALERTED and prev.get("status") != ALERTED):
+            by_txid[txid] = row
+    return list(by_txid.values()) + out
+
+
+def _row_values(row: dict) -> list:
+    vals = []
+    for f in _FIELDS:
+        name = f.attname
+        v = row.get(name, _DEFAULTS.get(name))
+        if name in _NULLABLE_TYPED and v in ("", "None"):
+            v = None
+        vals.append(v)
+    return vals
+
+
+def _csv_value(v) -> str:
+    if v is None:
+        return ""
+    if v is True:
+        return "t"
+    if v is False:
+        return "f"
+    if hasattr(v, "isoformat"):
+        v = v.isoformat()
+    return '"' + str(v).replace('"', '""') + '"'
+
+
+def _csv_buffer(rows: List[dict]) -> io.StringIO:
+    out = [",".join(_csv_value(v) for v in _row_values(row)) for row in rows]
+    out.append("")
+    return io.StringIO("\n".join(out))
+
+
+def _set_timeouts(c):
+    c.execute("SET LOCAL lock_timeout = '5s'")
+    c.execute("SET LOCAL statement_timeout = '30s'")
+
+
+def _values_upsert(c, rows: List[dict]) -> int:
+    params = []
+    db = c.db
+    for row in rows:
+        for (f, native), v in zip(_PREP, _row_values(row)):
+            params.append(v if v is None or type(v) is native else f.get_db_prep_save(v, db))
+    c.execute(
+        f"INSERT INTO {_TABLE} ({_COLS_SQL}) VALUES "
+        + ", ".join([_ROW_SQL] * len(rows))
+        + _ON_CONFLICT,
+        params,
+    )
+    return c.rowcount
+
+
+def _copy_upsert(c, rows: List[dict]) -> int:
+    c.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS {STAGE_TABLE} ON COMMIT DELETE ROWS AS "
+        f"SELECT {_COLS_SQL} FROM {_TABLE} WITH NO DATA"
+    )
+    c.copy_expert(
+        f"COPY {STAGE_TABLE} ({_COLS_SQL}) FROM STDIN WITH (FORMAT csv)",
+        _csv_buffer(rows),
+    )
+    c.execute(
+        f"INSERT INTO {_TABLE} ({_COLS_SQL}) "
+        f"SELECT {_COLS_SQL} FROM {STAGE_TABLE}"
+        + _ON_CONFLICT
+    )
+    return c.rowcount
+
+
+def upsert_rows(rows: List[dict]) -> int:
+    rows = _collapse(rows)
+    if not rows:
+        return 0
+    with db_tx.atomic():
+        with connection.cursor() as c:
+            _set_timeouts(c)
+            if PERSIST_BACKEND == "copy":
+                return _copy_upsert(c, rows)
+            return _values_upsert(c, rows)
@@ -0,0 +1,99 @@
+DEDUP_ENQUEUE_LUA = """
+local expire_at = tonumber(ARGV[1])
+local use_dedup = ARGV[2] == '1'
+local auto = ARGV[3] == '1'
+local bloom = ARGV[4] == 'bloom'
+local k = tonumber(ARGV[5])
+local ns = tonumber(ARGV[6])
+local current = KEYS[ns + 1]
+local queued, dropped, recalced, added = 0, 0, 0, 0
+local n = #ARGV
+local i = 7
+
+local function is_seen(from, to)
+    if bloom then
+        for t = from, to, k do
+            for b = ns + 1, #KEYS do
+                local hit = true
+                for o = t, t + k - 1 do
+                    if redis.call('GETBIT', KEYS[b], ARGV[o]) == 0 then
+                        hit = false
+                        break
+                    end
+                end
+                if hit then
+                    return true
+                end
+            end
+        end
+        return false
+    end
+    for t = from, to do
+        for b = ns + 1, #KEYS do
+            if redis.call('SISMEMBER', KEYS[b], ARGV[t]) == 1 then
+                return true
+            end
+        end
+    end
+    return false
+end
+
+local function remember(from, to)
+    if from > to then
+        return 0
+    end
+    if bloom then
+        for o = from, to do
+            redis.call('SETBIT', current, ARGV[o], 1)
+        end
+        return 1
+    end
+    local cnt = 0
+    for t = from, to do
+        cnt = cnt + redis.call('SADD', current, ARGV[t])
+    end
+    return cnt
+end
+
+while i <= n do
+    local force = ARGV[i] == '1'
+    local stream = KEYS[tonumber(ARGV[i + 1])]
+    local tok_from = i + 3
+    local tok_to = i + 2 + tonumber(ARGV[i + 2])
+    local fld_from = tok_to + 2
+    local fld_to = tok_to + 1 + 2 * tonumber(ARGV[tok_to + 1])
+    i = fld_to + 1
+
+    local seen = false
+    if not force and (use_dedup or auto) then
+        seen = is_seen(tok_from, tok_to)
+    end
+
+    if seen and not auto then
+        dropped = dropped + 1
+    else
+        local recalc = force or seen
+        if not recalc and use_dedup then
+            added = added + remember(tok_from, tok_to)
+        end
+        local entry = {}
+        for f = fld_from, fld_to do
+            entry[#entry + 1] = ARGV[f]
+        end
+        if seen then
+            entry[#entry + 1] = 'recalc'
+            entry[#entry + 1] = '1'
+        end
+        redis.call('XADD', stream, '*', unpack(entry))
+        queued = queued + 1
+        if recalc then
+            recalced = recalced + 1
+        end
+    end
+end
+
+if added > 0 then
+    redis.call('EXPIREAT', current, expire_at)
+end
+return {queued, dropped, recalced}
+"""
@@ -0,0 +1,158 @@
+import operator
+from transactions.rules import threshold as thr_eval, composite as comp_eval
+from transactions.txrecord import text_of
+
+
+OPS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+_EMPTY = (None, "")
+
+
+class CompiledRule:
+    __slots__ = ("test", "explain", "vector")
+
+    def __init__(self, test, explain, vector=None):
+        self.test = test
+        self.explain = explain
+        self.vector = vector
+
+
+def _raiser(exc):
+    def test(tx):
+        raise exc.__class__(*exc.args)
+    return test
+
+
+def _const(value):
+    def test(tx):
+        return value
+    return test
+
+
+def compile_threshold(column: str, value, op: str):
+    fn = OPS.get(op)
+    if fn is None:
+        return _raiser(ValueError(f"Неизвестный оператор: {op}"))
+
+    def test(tx):
+        try:
+            left = float(tx.get(column, 0))
+        except (TypeError, ValueError):
+            raise ValueError(f"Некорректное значение поля '{column}': {tx.get(column)}")
+        return fn(left, value)
+    return test
+
+
+def _compile_leaf(node: dict):
+    col = node["column"]
+    op = node["operator"]
+    expected = node["value"]
+    fn = OPS.get(op)
+    if fn is None:
+        return _const(False)
+    hash(col)
+
+    try:
+        expected_f = float(expected)
+    except (TypeError, ValueError):
+        expected_f = None
+    expected_s = str(expected)
+
+    if expected_f is None:
+        def test(tx):
+            actual = tx.get(col)
+            if actual in _EMPTY:
+                return False
+            return fn(text_of(tx, col, actual), expected_s)
+        return test
+
+    def test(tx):
+        actual = tx.get(col)
+        if actual in _EMPTY:
+            return False
+        try:
+            actual_f = float(actual)
+        except (TypeError, ValueError):
+            return fn(text_of(tx, col, actual), expected_s)
+        return fn(actual_f, expected_f)
+    return test
+
+
+def _compile_node(node):
+    if "column" in node:
+        return _compile_leaf(node)
+
+    logic = node.get("logic", "AND").upper()
+    subrules = node.get("conditions", [])
+    if not isinstance(subrules, list) or not subrules:
+        return _const(False)
+
+    subs = tuple(_compile_node(sub) for sub in subrules)
+
+    if logic == "AND":
+        if len(subs) == 1:
+            return subs[0]
+
+        def test(tx):
+            for f in subs:
+                if not f(tx):
+                    return False
+            return True
+        return test
+
+    if logic == "OR":
+        if len(subs) == 1:
+            return subs[0]
+
+        def test(tx):
+            for f in subs:
+                if f(tx):
+                    return True
+            return False
+        return test
+
+    if logic == "NOT":
+        if len(subs) != 1:
+            return _const(False)
+        sub = subs[0]
+
+        def test(tx):
+            return not sub(tx)
+        return test
+
+    return _const(False)
+
+
+def compile_composite(rule_json):
+    try:
+        return _compile_node(rule_json)
+    except Exception as e:
+        return _raiser(e)
+
+
+def compile_rule(kind: str, rule):
+    if kind == "threshold":
+        column, value, op = rule.column_name, rule.value, rule.operator
+        return CompiledRule(
+            compile_threshold(column, value, op),
+            lambda tx: thr_eval(tx, column, value, op)[1],
+        )
+    if kind == "composite":
+        rule_json = rule.rule
+        return CompiledRule(
+            compile_composite(rule_json),
+            lambda tx: comp_eval(tx, rule_json)[1],
+        )
+    return None
+
+
+def reference_eval(kind: str, rule, tx: dict):
+    if kind == "threshold":
+        return thr_eval(tx, rule.column_name, rule.value, rule.operator)
+    return comp_eval(tx, rule.rule)
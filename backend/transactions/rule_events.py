@@ -0,0 +1,52 @@
+import os
+import json
+import redis
+import logging
+from django.db import transaction as db_tx
+
+
+RULES_CHANNEL     = os.getenv("TX_RULES_CHANNEL", "rules_reload")
+RULES_VERSION_KEY = os.getenv("TX_RULES_VERSION_KEY", "rules:version")
+
+RULE_KINDS = ("threshold", "composite", "pattern", "ml")
+OP_UPSERT = "upsert"
+OP_DELETE = "delete"
+
+logger = logging.getLogger(__name__)
+
+# INCR и PUBLISH в одном скрипте: порядок версий в канале совпадает с порядком инкремента
+PUBLISH_LUA = """
+local v = redis.call('INCR', KEYS[1])
+redis.call('PUBLISH', ARGV[1], string.format('{"version":%d,"kind":"%s","id":%d,"op":"%s"}', v, ARGV[2], tonumber(ARGV[3]), ARGV[4]))
+return v
+"""
+
+
+def current_version(client) -> int:
+    return int(client.get(RULES_VERSION_KEY) or 0)
+
+
+def parse_event(data):
+    try:
+        ev = json.loads(data)
+        if ev.get("kind") not in RULE_KINDS or ev.get("op") not in (OP_UPSERT, OP_DELETE):
+            return None
+        return {"version": int(ev["version"]), "kind": ev["kind"], "id": int(ev["id"]), "op": ev["op"]}
+    except (TypeError, ValueError, KeyError, AttributeError):
+        return None
+
+
+class RulePublisher:
+    def __init__(self, client):
+        self.client = client
+        self._publish = client.register_script(PUBLISH_LUA)
+
+    def publish(self, kind: str, rule_id: int, op: str):
+        try:
+            return int(self._publish(keys=[RULES_VERSION_KEY], args=[RULES_CHANNEL, kind, int(rule_id), op]))
+        except redis.RedisError as e:
+            logger.warning({"event": "rule_publish_failed", "kind": kind, "rule_id": rule_id, "error": str(e)})
+            return None
+
+    def publish_on_commit(self, kind: str, rule_id: int, op: str):
+        db_tx.on_commit(lambda: self.publish(kind, rule_id, op))
@@ -0,0 +1,92 @@
+import os
+from bisect import bisect_left, bisect_right
+
+
+INDEX_ON        = os.getenv("TX_RULES_INDEX", "1") == "1"
+INDEX_MIN_RULES = int(os.getenv("TX_RULES_INDEX_MIN", "32"))
+
+_OPS = (">", ">=", "<", "<=", "==", "!=")
+
+
+def _ordered(pairs):
+    pairs.sort()
+    return [v for v, _j in pairs], [(j, True) for _v, j in pairs]
+
+
+class _ColumnIndex:
+    __slots__ = ("gt_vals", "gt_hits", "ge_vals", "ge_hits", "lt_vals", "lt_hits",
+                 "le_vals", "le_hits", "eq", "ne_hits", "ne_by_value", "fallback")
+
+    def __init__(self, by_op: dict):
+        self.gt_vals, self.gt_hits = _ordered(by_op[">"])
+        self.ge_vals, self.ge_hits = _ordered(by_op[">="])
+        self.lt_vals, self.lt_hits = _ordered(by_op["<"])
+        self.le_vals, self.le_hits = _ordered(by_op["<="])
+        self.eq = {}
+        for v, j in sorted(by_op["=="]):
+            self.eq.setdefault(v, []).append((j, True))
+        self.ne_hits = [(j, True) for _v, j in sorted(by_op["!="], key=lambda x: x[1])]
+        self.ne_by_value = {}
+        for v, j in by_op["!="]:
+            self.ne_by_value.setdefault(v, set()).add(j)
+        self.fallback = sorted((j, False) for pairs in by_op.values() for _v, j in pairs)
+
+    def collect(self, left: float, out: list):
+        out.extend(self.gt_hits[:bisect_left(self.gt_vals, left)])
+        out.extend(self.ge_hits[:bisect_right(self.ge_vals, left)])
+        out.extend(self.lt_hits[bisect_right(self.lt_vals, left):])
+        out.extend(self.le_hits[bisect_left(self.le_vals, left):])
+        out.extend(self.eq.get(left, ()))
+        skip = self.ne_by_value.get(left)
+        if skip:
+            out.extend(h for h in self.ne_hits if h[0] not in skip)
+        else:
+            out.extend(self.ne_hits)
+
+
+class ThresholdIndex:
+    __slots__ = ("columns", "others")
+
+    def __init__(self, items, keys=None):
+        by_column, others = {}, []
+        for j, t in enumerate(items):
+            kind, rule = t[0], t[5]
+            if keys is not None:
+                j = keys[j]
+            if kind == "ml":
+                continue
+            if kind == "threshold" and rule.operator in _OPS:
+                try:
+                    value = float(rule.value)
+                except (TypeError, ValueError):
+                    value = None
+                if value is not None and value == value:
+                    by_op = by_column.setdefault(rule.column_name, {op: [] for op in _OPS})
+                    by_op[rule.operator].append((value, j))
+                    continue
+            others.append((j, False))
+        self.columns = {col: _ColumnIndex(by_op) for col, by_op in by_column.items()}
+        self.others = others
+
+    def candidates(self, tx: dict) -> list:
+        out = list(self.others)
+        for col, index in self.columns.items():
+            try:
+                left = float(tx.get(col, 0))
+            except (TypeError, ValueError):
+                left = None
+            if left is None or left != left:
+                # ошибку и сравнение с NaN отдаём скалярному пути, чтобы reason/rule_error не менялись
+                out.extend(index.fallback)
+                continue
+            index.collect(left, out)
+        out.sort()
+        return out
+
+
+def build_threshold_index(items, keys=None):
+    if not INDEX_ON:
+        return None
+    if sum(1 for t in items if t[0] == "threshold") < INDEX_MIN_RULES:
+        return None
+    return ThresholdIndex(items, keys)
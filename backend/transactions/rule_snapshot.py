@@ -0,0 +1,57 @@
+from bisect import bisect_right
+from django.utils import timezone
+from transactions.constrants import crit_to_level
+from transactions.rules import window_seconds_of
+from transactions.rule_index import build_threshold_index
+
+
+def _aware(dt):
+    if dt is None:
+        return timezone.now()
+    return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+
+
+class RuleView:
+    __slots__ = ("version", "items", "levels", "ml", "pattern", "max_pattern_window", "threshold_index")
+
+    def __init__(self, version: int, items: tuple, levels: tuple):
+        self.version = version
+        self.items = items
+        self.levels = levels
+        self.ml = tuple(t for t in items if t[0] == "ml")
+        self.pattern = tuple(t[5] for t in items if t[0] == "pattern")
+        self.max_pattern_window = max((int(window_seconds_of(r)) for r in self.pattern), default=0)
+        self.threshold_index = build_threshold_index(items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class RuleSnapshot:
+    __slots__ = ("version", "items", "updated", "levels", "by_kind", "_views")
+
+    def __init__(self, items, version: int = 0):
+        keyed = sorted(((_aware(t[2]), t[3], t) for t in items), key=lambda x: (x[0], x[1]))
+        self.version = version
+        self.items = tuple(t for _u, _id, t in keyed)
+        self.updated = tuple(u for u, _id, _t in keyed)
+        self.levels = tuple(crit_to_level(t[4]) for t in self.items)
+        by_kind = {}
+        for t in self.items:
+            by_kind.setdefault(t[0], []).append(t)
+        self.by_kind = {k: tuple(v) for k, v in by_kind.items()}
+        self._views = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def with_changes(self, removed, added, version: int) -> "RuleSnapshot":
+        kept = [t for t in self.items if (t[0], t[3]) not in removed]
+        return RuleSnapshot(kept + list(added), version=version)
+
+    def view(self, cutoff) -> RuleView:
+        n = bisect_right(self.updated, _aware(cutoff))
+        view = self._views.get(n)
+        if view is None:
+            view = self._views[n] = RuleView(self.version, self.items[:n], self.levels[:n])
+        return view
@@ -0,0 +1,98 @@
+import os
+import time
+from transactions.rule_index import build_threshold_index
+
+
+STATS_SAMPLE_EVERY = int(os.getenv("TX_RULE_STATS_SAMPLE", "16"))
+STATS_DECAY        = float(os.getenv("TX_RULE_STATS_DECAY", "0.999"))
+REORDER_SEC        = float(os.getenv("TX_RULE_REORDER_SEC", "5"))
+
+# пока замеров нет: грубая цена по типу правила и априорная вероятность срабатывания 0.05
+_PRIOR_COST_NS = {"threshold": 1_000, "composite": 3_000, "pattern": 30_000}
+_PRIOR_HITS = 0.5
+_PRIOR_N = 10.0
+
+
+class Ranking:
+    # порядок считается раз на представление/обновление: индекс порогов строится по позициям
+    # ранга, поэтому его кандидаты уже идут в нужном порядке и сортировать на транзакции нечего
+    __slots__ = ("rank", "order", "index")
+
+    def __init__(self, view, order: list):
+        self.order = order
+        self.rank = rank = [len(view.items)] * len(view.items)
+        for pos, j in enumerate(order):
+            rank[j] = pos
+        self.index = None
+        if view.threshold_index is not None:
+            self.index = build_threshold_index(view.items, rank)
+
+
+class RuleStats:
+    def __init__(self, stop_level: int, sample_every: int = STATS_SAMPLE_EVERY,
+                 decay: float = STATS_DECAY, reorder_sec: float = REORDER_SEC):
+        self.stop_level = stop_level
+        self.sample_every = max(1, sample_every)
+        self.decay = decay
+        self.reorder_sec = reorder_sec
+        self._stats = {}
+        self._tick = 0
+        self._view = None
+        self._rank = None
+        self.head = ()
+        self.reordered = False
+        self._ranked_at = 0.0
+
+    def sampled(self) -> bool:
+        self._tick += 1
+        return self._tick % self.sample_every == 0
+
+    def record(self, kind: str, rule_id: int, triggered: bool, cost_ns=None):
+        st = self._stats.get((kind, rule_id))
+        if st is None:
+            st = self._stats[(kind, rule_id)] = [0.0, 0.0, None]
+        st[0] = st[0] * self.decay + 1.0
+        st[1] = st[1] * self.decay + (1.0 if triggered else 0.0)
+        if cost_ns is not None:
+            if st[2] is None:
+                st[2] = float(cost_ns)
+            else:
+                alpha = max(1.0 - self.decay, 1.0 / st[0])
+                st[2] += (cost_ns - st[2]) * alpha
+
+    def hit_rate(self, kind: str, rule_id: int) -> float:
+        st = self._stats.get((kind, rule_id))
+        n, hits = (st[0], st[1]) if st else (0.0, 0.0)
+        return (hits + _PRIOR_HITS) / (n + _PRIOR_N)
+
+    def cost_ns(self, kind: str, rule_id: int) -> float:
+        st = self._stats.get((kind, rule_id))
+        if st is None or st[2] is None:
+            return float(_PRIOR_COST_NS.get(kind, 10_000))
+        return st[2]
+
+    def ranking(self, view, now=None):
+        now = time.monotonic() if now is None else now
+        if view is self._view and now - self._ranked_at < self.reorder_sec:
+            self.reordered = False
+            return self._rank
+
+        items, levels = view.items, view.levels
+        critical, rest = [], []
+        for j, t in enumerate(items):
+            if t[0] == "ml":
+                continue
+            if levels[j] >= self.stop_level:
+                # цена ожидания первого срабатывания: дешёвые и частые критичные правила вперёд
+                critical.append((self.cost_ns(t[0], t[3]) / self.hit_rate(t[0], t[3]), j))
+            else:
+                rest.append(j)
+        critical.sort()
+        order = [j for _score, j in critical] + rest
+
+        head = tuple(f"{items[j][0]}:{items[j][3]}" for j in order[:5])
+        if view is not self._view or self._rank is None or order != self._rank.order:
+            self._rank = Ranking(view, order)
+        self._view, self._ranked_at = view, now
+        self.reordered, self.head = head != self.head, head
+        return self._rank
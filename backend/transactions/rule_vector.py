@@ -0,0 +1,214 @@
+import os
+from transactions.rule_compiler import OPS
+from transactions.txrecord import text_of
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+VECTOR_ON        = os.getenv("TX_RULES_VECTOR", "1") == "1" and np is not None
+VECTOR_MIN_BATCH = int(os.getenv("TX_RULES_VECTOR_MIN_BATCH", "256"))
+
+SKIP, HIT, SCALAR = 0, 1, 2
+_MISSING = object()
+_EMPTY = (None, "")
+
+
+class _Column:
+    __slots__ = ("rows", "name", "values", "present", "empty", "is_num", "num", "_codes", "_uniques")
+
+    def __init__(self, rows, name):
+        n = len(rows)
+        self.rows, self.name = rows, name
+        self.values = values = [row.get(name, _MISSING) for row in rows]
+        present = np.ones(n, dtype=bool)
+        empty = np.zeros(n, dtype=bool)
+        is_num = np.zeros(n, dtype=bool)
+        num = np.full(n, np.nan)
+        for i, v in enumerate(values):
+            if v is _MISSING:
+                present[i] = False
+                empty[i] = True
+                continue
+            if v in _EMPTY:
+                empty[i] = True
+            try:
+                num[i] = float(v)
+                is_num[i] = True
+            except (TypeError, ValueError):
+                pass
+        self.present, self.empty, self.is_num, self.num = present, empty, is_num, num
+        self._codes = self._uniques = None
+
+    def str_compare(self, fn, expected_s: str):
+        if self._codes is None:
+            index, codes = {}, np.full(len(self.values), -1, dtype=np.int64)
+            for i, v in enumerate(self.values):
+                if not self.empty[i]:
+                    codes[i] = index.setdefault(text_of(self.rows[i], self.name, v), len(index))
+            self._codes, self._uniques = codes, list(index)
+        table = np.array([bool(fn(u, expected_s)) for u in self._uniques] + [False], dtype=bool)
+        return table[self._codes]
+
+
+class _Columns(dict):
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = rows
+        self.n = len(rows)
+
+    def __missing__(self, name):
+        col = self[name] = _Column(self.rows, name)
+        return col
+
+
+def _false(cols):
+    return np.zeros(cols.n, dtype=bool)
+
+
+def _vec_threshold(column: str, value, op: str):
+    fn = OPS.get(op)
+    if fn is None:
+        return None
+
+    def evaluate(cols):
+        col = cols[column]
+        left = np.where(col.present, col.num, 0.0)
+        hits = np.asarray(fn(left, value), dtype=bool)
+        return hits, col.present & ~col.is_num
+    return evaluate
+
+
+def _vec_leaf(node: dict):
+    col_name = node["column"]
+    op = node["operator"]
+    expected = node["value"]
+    fn = OPS.get(op)
+    if fn is None:
+        return _false
+    hash(col_name)
+
+    try:
+        expected_f = float(expected)
+    except (TypeError, ValueError):
+        expected_f = None
+    expected_s = str(expected)
+
+    if expected_f is None:
+        def evaluate(cols):
+            return cols[col_name].str_compare(fn, expected_s)
+        return evaluate
+
+    def evaluate(cols):
+        col = cols[col_name]
+        out = col.is_num & np.asarray(fn(col.num, expected_f), dtype=bool)
+        text = ~col.is_num & ~col.empty
+        if text.any():
+            out |= text & col.str_compare(fn, expected_s)
+        return out
+    return evaluate
+
+
+def _vec_node(node):
+    if "column" in node:
+        return _vec_leaf(node)
+
+    logic = node.get("logic", "AND").upper()
+    subrules = node.get("conditions", [])
+    if not isinstance(subrules, list) or not subrules:
+        return _false
+
+    subs = [_vec_node(sub) for sub in subrules]
+
+    if logic == "AND":
+        def evaluate(cols):
+            out = subs[0](cols)
+            for f in subs[1:]:
+                out = out & f(cols)
+            return out
+        return evaluate
+
+    if logic == "OR":
+        def evaluate(cols):
+            out = subs[0](cols)
+            for f in subs[1:]:
+                out = out | f(cols)
+            return out
+        return evaluate
+
+    if logic == "NOT":
+        if len(subs) != 1:
+            return _false
+        sub = subs[0]
+
+        def evaluate(cols):
+            return ~sub(cols)
+        return evaluate
+
+    return _false
+
+
+def _vec_composite(rule_json):
+    node = _vec_node(rule_json)
+
+    def evaluate(cols):
+        return node(cols), None
+    return evaluate
+
+
+def compile_vector(kind: str, rule):
+    if np is None:
+        return None
+    try:
+        if kind == "threshold":
+            return _vec_threshold(rule.column_name, rule.value, rule.operator)
+        if kind == "composite":
+            return _vec_composite(rule.rule)
+    except Exception:
+        return None
+    return None
+
+
+class BatchVerdicts:
+    __slots__ = ("state", "order")
+
+    def __init__(self, state, order=None):
+        self.state = state
+        self.order = order
+
+    def ranked(self, order: list) -> "BatchVerdicts":
+        # столбцы переставляются один раз на батч, строки отдаются уже в порядке ранга
+        order = np.asarray(order, dtype=np.intp)
+        return BatchVerdicts(self.state[:, order], order)
+
+    def row(self, i: int) -> list:
+        st = self.state[i]
+        idx = np.flatnonzero(st)
+        js = idx if self.order is None else self.order[idx]
+        return list(zip(js.tolist(), (st[idx] == HIT).tolist()))
+
+
+def batch_verdicts(rows: list, rules_snapshot: list):
+    n = len(rows)
+    state = np.full((n, len(rules_snapshot)), SCALAR, dtype=np.int8)
+    cols = _Columns(rows)
+    with np.errstate(invalid="ignore"):
+        for j, t in enumerate(rules_snapshot):
+            if t[0] == "ml":
+                state[:, j] = SKIP
+                continue
+            compiled = t[6]
+            vec = compiled.vector if compiled is not None else None
+            if vec is None:
+                continue
+            try:
+                hits, scalar = vec(cols)
+            except Exception:
+                continue
+            col = np.where(hits, HIT, SKIP).astype(np.int8)
+            if scalar is not None:
+                col[scalar] = SCALAR
+            state[:, j] = col
+    return BatchVerdicts(state)
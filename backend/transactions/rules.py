@@ -2,10 +2,12 @@ import os
 import json
 import redis
 import operator
+from collections.abc import Mapping
 from datetime import datetime, timedelta
 from django.db.models import Count, Sum, Max
 from django.utils import timezone
 from transactions.models import Transaction
+from transactions.txrecord import TxRecord, text_of
 
 
 def parse_datetime_safe(s: str):
@@ -69,7 +71,7 @@ def composite(tx: dict, rule_json: dict, depth: int = 0):
             actual_val = float(actual)
             expected_val = float(expected)
         except (TypeError, ValueError):
-            actual_val = str(actual)
+            actual_val = text_of(tx, col, actual)
             expected_val = str(expected)
 
         try:
@@ -107,11 +109,7 @@ def composite(tx: dict, rule_json: dict, depth: int = 0):
     return result, reason
 
 
-def pattern(tx: dict, rule):
-    now = tx.get("timestamp")
-    if not now or not hasattr(now, "tzinfo"):
-        now = timezone.now()
-
+def window_seconds_of(rule) -> int:
     window_seconds = getattr(rule, "window_seconds", None)
     if window_seconds is None:
         wm = getattr(rule, "window_minutes", 10)
@@ -119,6 +117,45 @@ def pattern(tx: dict, rule):
             window_seconds = int(wm) * 60
         except Exception:
             window_seconds = 600
+    return window_seconds
+
+
+def pattern_verdict(rule, window_seconds, count_ops_db, total_amount_db, max_amount_db, amount_cur, group_label):
+    count_ops = count_ops_db + 1
+    total_amount = total_amount_db + amount_cur
+    max_amount = max(max_amount_db, amount_cur)
+    min_count = int(getattr(rule, "min_count", 1) or 1)
+    triggered = count_ops >= min_count
+
+    total_limit = getattr(rule, "total_amount_limit", None)
+    if total_limit is not None:
+        triggered = triggered and (total_amount <= float(total_limit))
+
+    per_tx_max_limit = getattr(rule, "min_amount_limit", None)
+    if per_tx_max_limit is not None:
+        triggered = triggered and (max_amount <= float(per_tx_max_limit))
+
+    per_tx_min_limit = getattr(rule, "per_tx_min_limit", None)
+    if per_tx_min_limit is not None:
+        triggered = triggered and (amount_cur >= float(per_tx_min_limit))
+
+    mm = window_seconds / 60
+    mm_txt = int(mm) if window_seconds % 60 == 0 else round(mm, 1)
+
+    reason = (
+        f"{count_ops} операций за {mm_txt} мин, сумма={total_amount:.2f}, "
+        f"max_amount={max_amount:.2f} ({group_label})"
+    )
+
+    return triggered, reason
+
+
+def pattern(tx: dict, rule):
+    now = tx.get("timestamp")
+    if not now or not hasattr(now, "tzinfo"):
+        now = timezone.now()
+
+    window_seconds = window_seconds_of(rule)
 
     window_start = now - timedelta(seconds=window_seconds)
 
@@ -153,38 +190,16 @@ def pattern(tx: dict, rule):
         max_amount=Max("amount"),
     )
 
-    count_ops_db = int(agg["cnt"] or 0)
-    total_amount_db = float(agg["total"] or 0.0)
-    max_amount_db = float(agg["max_amount"] or 0.0)
-    amount_cur = float(tx.get("amount") or 0.0)
-    count_ops = count_ops_db + 1
-    total_amount = total_amount_db + amount_cur
-    max_amount = max(max_amount_db, amount_cur)
-    min_count = int(getattr(rule, "min_count", 1) or 1)
-    triggered = count_ops >= min_count
-
-    total_limit = getattr(rule, "total_amount_limit", None)
-    if total_limit is not None:
-        triggered = triggered and (total_amount <= float(total_limit))
-
-    per_tx_max_limit = getattr(rule, "min_amount_limit", None)
-    if per_tx_max_limit is not None:
-        triggered = triggered and (max_amount <= float(per_tx_max_limit))
-
-    per_tx_min_limit = getattr(rule, "per_tx_min_limit", None)
-    if per_tx_min_limit is not None:
-        triggered = triggered and (amount_cur >= float(per_tx_min_limit))
-
-    mm = window_seconds / 60
-    mm_txt = int(mm) if window_seconds % 60 == 0 else round(mm, 1)
-
-    reason = (
-        f"{count_ops} операций за {mm_txt} мин, сумма={total_amount:.2f}, "
-        f"max_amount={max_amount:.2f} ({group_label})"
+    return pattern_verdict(
+        rule,
+        window_seconds,
+        int(agg["cnt"] or 0),
+        float(agg["total"] or 0.0),
+        float(agg["max_amount"] or 0.0),
+        float(tx.get("amount") or 0.0),
+        group_label,
     )
 
-    return triggered, reason
-
 
 r = redis.Redis(
     host=os.getenv("REDIS_HOST", "localhost"),
@@ -196,7 +211,9 @@ r = redis.Redis(
 def _safe_json(obj):
     if isinstance(obj, datetime):
         return obj.isoformat()
-    if isinstance(obj, dict):
+    if isinstance(obj, TxRecord):
+        obj = obj.as_dict(raw=True)
+    if isinstance(obj, Mapping):
         return {k: _safe_json(v) for k, v in obj.items()}
     if isinstance(obj, list):
         return [_safe_json(v) for v in obj]
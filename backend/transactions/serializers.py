@@ -9,22 +9,25 @@ from .models import MLRule
 
 SAFE_TEXT_FIELDS = {"location", "merchant_category"}
 ID_LIKE_FIELDS = {"transaction_id", "correlation_id", "sender_account", "receiver_account", "device_hash", "payment_channel"}
+FLOAT_FIELDS = {"time_since_last_transaction", "spending_deviation_score", "velocity_score", "geo_anomaly_score"}
+CTRL_CHARS_RE = re.compile(r"[\x00-\x1f\x7f-\x9f]")
+
+def sanitize_value(k, v):
+    if isinstance(v, str):
+        v = v.strip()
+        v = CTRL_CHARS_RE.sub("", v)
+        if k in SAFE_TEXT_FIELDS:
+            v = html.escape(v)[:255]
+        if v == "" and k == "time_since_last_transaction":
+            v = 0.0
+    if k in FLOAT_FIELDS and v is not None:
+        try: v = float(v)
+        except: v = 0.0 if k=="time_since_last_transaction" else None
+    return v
+
 
 def sanitize_record(data: dict) -> dict:
-    clean = {}
-    for k, v in data.items():
-        if isinstance(v, str):
-            v = v.strip()
-            v = re.sub(r"[\x00-\x1f\x7f-\x9f]", "", v)
-            if k in SAFE_TEXT_FIELDS:
-                v = html.escape(v)[:255]
-            if v == "" and k == "time_since_last_transaction":
-                v = 0.0
-        if k in {"time_since_last_transaction","spending_deviation_score","velocity_score","geo_anomaly_score"} and v is not None:
-            try: v = float(v)
-            except: v = 0.0 if k=="time_since_last_transaction" else None
-        clean[k] = v
-    return clean
+    return {k: sanitize_value(k, v) for k, v in data.items()}
 
 
 class TransactionSerializer(serializers.Serializer):
@@ -0,0 +1,212 @@
+import math
+import random
+import unittest
+from types import SimpleNamespace
+from django.test import SimpleTestCase
+from transactions.rule_compiler import compile_rule, reference_eval
+from transactions.rule_index import ThresholdIndex
+from transactions.rule_vector import np, HIT, SCALAR, batch_verdicts, compile_vector
+from transactions.txrecord import TxRecord
+
+
+COLUMNS = [
+    "amount", "velocity_score", "geo_anomaly_score", "transaction_type", "device_used", "location", "missing",
+]
+OPERATORS = [">", ">=", "<", "<=", "==", "!=", "=~"]
+VALUES = [0, 1, 0.5, 100, 2500.0, "100", "abc", "mobile", "transfer", None, "", "nan", float("nan")]
+
+EDGE_TXS = [
+    {},
+    {"amount": None, "velocity_score": "", "transaction_type": None},
+    {"amount": "", "device_used": ""},
+    {"amount": 0, "velocity_score": 0.0},
+    {"amount": 12.5, "velocity_score": "12.5", "transaction_type": "transfer"},
+    {"amount": "bad", "device_used": "mobile", "location": "Moscow"},
+    {"amount": float("nan"), "velocity_score": "nan", "geo_anomaly_score": float("inf")},
+    {"amount": "100", "transaction_type": "100", "device_used": "web"},
+    {"amount": -3.5, "geo_anomaly_score": "-inf", "location": "Tokyo"},
+    {"amount": 2500.0, "velocity_score": 1, "transaction_type": True},
+]
+
+
+def outcome(fn):
+    try:
+        return bool(fn()), None
+    except Exception as e:
+        return None, type(e).__name__
+
+
+def threshold_rule(column, op, value):
+    return "threshold", SimpleNamespace(column_name=column, operator=op, value=value)
+
+
+def composite_rule(node):
+    return "composite", SimpleNamespace(rule=node)
+
+
+def leaf(column, op, value):
+    return {"column": column, "operator": op, "value": value}
+
+
+EDGE_RULES = [
+    threshold_rule("amount", ">", 100.0),
+    threshold_rule("amount", "<=", 0.0),
+    threshold_rule("amount", "==", 12.5),
+    threshold_rule("amount", "!=", 12.5),
+    threshold_rule("missing", ">=", 0.0),
+    threshold_rule("velocity_score", "<", float("nan")),
+    threshold_rule("amount", "=~", 1.0),
+    threshold_rule("transaction_type", ">", 1.0),
+    composite_rule(leaf("amount", ">", 100)),
+    composite_rule(leaf("amount", ">", "100")),
+    composite_rule(leaf("device_used", "==", "mobile")),
+    composite_rule(leaf("transaction_type", ">=", "abc")),
+    composite_rule(leaf("transaction_type", "==", "100")),
+    composite_rule(leaf("missing", "==", None)),
+    composite_rule(leaf("amount", "!=", "nan")),
+    composite_rule(leaf("amount", "=~", 1)),
+    composite_rule({"column": "amount", "operator": ">"}),
+    composite_rule({"column": "amount", "value": 1}),
+    composite_rule({"logic": "AND", "conditions": []}),
+    composite_rule({"logic": "OR"}),
+    composite_rule({"logic": "NOT", "conditions": [leaf("amount", ">", 100)]}),
+    composite_rule({"logic": "NOT", "conditions": [leaf("amount", ">", 100), leaf("amount", "<", 1)]}),
+    composite_rule({"logic": "not", "conditions": [{"logic": "NOT", "conditions": [leaf("missing", ">", 0)]}]}),
+    composite_rule({"logic": "XOR", "conditions": [leaf("amount", ">", 1)]}),
+    composite_rule({"conditions": [leaf("amount", ">", 1), leaf("device_used", "!=", "web")]}),
+    composite_rule({"logic": "or", "conditions": [
+        leaf("location", "==", "Moscow"),
+        {"logic": "AND", "conditions": [leaf("amount", ">=", 0), leaf("velocity_score", "<", 20)]},
+    ]}),
+]
+
+
+def random_node(rnd, depth=0):
+    if depth >= 3 or rnd.random() < 0.4:
+        node = leaf(rnd.choice(COLUMNS), rnd.choice(OPERATORS), rnd.choice(VALUES))
+        if rnd.random() < 0.05:
+            node.pop(rnd.choice(["operator", "value"]))
+        return node
+    node = {"logic": rnd.choice(["AND", "or", "NOT", "XOR"]), "conditions": []}
+    if rnd.random() < 0.1:
+        node.pop("logic")
+    node["conditions"] = [random_node(rnd, depth + 1) for _ in range(rnd.choice([0, 1, 1, 2, 3]))]
+    return node
+
+
+def random_rules(rnd, n):
+    rules = []
+    for i in range(n):
+        if i % 2:
+            rules.append(composite_rule(random_node(rnd)))
+        else:
+            rules.append(threshold_rule(
+                rnd.choice(COLUMNS), rnd.choice(OPERATORS[:6] * 5 + OPERATORS[6:]),
+                float(rnd.choice([0, 1, 0.5, 100, 2500, "nan"])),
+            ))
+    return rules
+
+
+def random_txs(rnd, n):
+    return [{
+        "amount": rnd.choice([round(rnd.uniform(1, 5000), 2), 0, None, "", "12.5", "bad", float("nan")]),
+        "velocity_score": rnd.choice([float(rnd.randint(0, 20)), None, "", "7"]),
+        "geo_anomaly_score": round(rnd.random(), 2),
+        "transaction_type": rnd.choice(["withdrawal", "transfer", "100", None]),
+        "device_used": rnd.choice(["mobile", "web", ""]),
+        "location": rnd.choice(["Moscow", "Tokyo", None]),
+    } for _ in range(n)]
+
+
+def parsed(txs):
+    # в воркере записи приходят TxRecord: числа уже float, исходный текст в raw
+    return [TxRecord.parse({k: v if v is None or isinstance(v, str) else repr(v) for k, v in tx.items()})
+            for tx in txs]
+
+
+class RuleDifferentialMixin:
+    def assert_compiled_matches(self, rules, txs):
+        for kind, rule in rules:
+            compiled = compile_rule(kind, rule)
+            for tx in txs:
+                ref = outcome(lambda: reference_eval(kind, rule, tx)[0])
+                got = outcome(lambda: compiled.test(tx))
+                self.assertEqual(ref, got, f"{kind} {rule} tx={tx!r}")
+                if got[0]:
+                    self.assertEqual(reference_eval(kind, rule, tx)[1], compiled.explain(tx),
+                                     f"{kind} {rule} tx={tx!r}")
+
+    def assert_vector_matches(self, rules, txs):
+        snapshot = []
+        for j, (kind, rule) in enumerate(rules):
+            compiled = compile_rule(kind, rule)
+            compiled.vector = compile_vector(kind, rule)
+            snapshot.append((kind, None, None, j, "low", rule, compiled))
+        state = batch_verdicts(txs, snapshot).state
+        for i, tx in enumerate(txs):
+            for j, (kind, rule) in enumerate(rules):
+                if state[i, j] == SCALAR:
+                    continue
+                ref = outcome(lambda: reference_eval(kind, rule, tx)[0])
+                self.assertEqual(ref, (state[i, j] == HIT, None), f"{kind} {rule} tx={tx!r}")
+
+    def assert_index_matches(self, rules, txs):
+        index = ThresholdIndex([(kind, None, None, j, "low", rule) for j, (kind, rule) in enumerate(rules)])
+        for tx in txs:
+            state = dict(index.candidates(tx))
+            for j, (kind, rule) in enumerate(rules):
+                if state.get(j) is False:
+                    continue
+                ref = outcome(lambda: reference_eval(kind, rule, tx)[0])
+                self.assertEqual(ref, (bool(state.get(j)), None), f"{rule} tx={tx!r} state={state.get(j)}")
+
+
+class CompiledRuleTests(RuleDifferentialMixin, SimpleTestCase):
+    def test_edge_cases(self):
+        self.assert_compiled_matches(EDGE_RULES, EDGE_TXS)
+
+    def test_edge_cases_parsed_records(self):
+        self.assert_compiled_matches(EDGE_RULES, parsed(EDGE_TXS))
+
+    def test_random_rules(self):
+        rnd = random.Random(1)
+        self.assert_compiled_matches(random_rules(rnd, 80), random_txs(rnd, 150))
+
+    def test_nan_threshold_never_fires(self):
+        kind, rule = threshold_rule("amount", "!=", float("nan"))
+        compiled = compile_rule(kind, rule)
+        self.assertTrue(math.isnan(rule.value))
+        self.assertEqual(compiled.test({"amount": 1.0}), reference_eval(kind, rule, {"amount": 1.0})[0])
+
+    def test_bad_operator_raises_like_reference(self):
+        kind, rule = threshold_rule("amount", "=~", 1.0)
+        self.assertEqual(outcome(lambda: compile_rule(kind, rule).test({"amount": 1})), (None, "ValueError"))
+
+
+@unittest.skipIf(np is None, "numpy не установлен")
+class VectorVerdictTests(RuleDifferentialMixin, SimpleTestCase):
+    def test_edge_cases(self):
+        self.assert_vector_matches(EDGE_RULES, EDGE_TXS)
+
+    def test_edge_cases_parsed_records(self):
+        self.assert_vector_matches(EDGE_RULES, parsed(EDGE_TXS))
+
+    def test_random_rules(self):
+        rnd = random.Random(2)
+        self.assert_vector_matches(random_rules(rnd, 80), random_txs(rnd, 300))
+
+
+class ThresholdIndexTests(RuleDifferentialMixin, SimpleTestCase):
+    def test_edge_cases(self):
+        rules = [r for r in EDGE_RULES if r[0] == "threshold"]
+        self.assert_index_matches(rules, EDGE_TXS)
+
+    def test_random_thresholds(self):
+        rnd = random.Random(3)
+        rules = [r for r in random_rules(rnd, 400) if r[0] == "threshold"]
+        self.assert_index_matches(rules, random_txs(rnd, 300))
+
+    def test_non_threshold_rules_are_always_candidates(self):
+        rules = [threshold_rule("amount", ">", 1.0), composite_rule(leaf("amount", ">", 1))]
+        index = ThresholdIndex([(kind, None, None, j, "low", rule) for j, (kind, rule) in enumerate(rules)])
+        self.assertEqual(dict(index.candidates({"amount": 0.0})), {1: False})
@@ -0,0 +1,74 @@
+import random
+import unittest
+from django.test import SimpleTestCase
+from transactions.rule_compiler import compile_rule
+from transactions.rule_index import ThresholdIndex
+from transactions.rule_stats import RuleStats
+from transactions.rule_vector import np, batch_verdicts, compile_vector
+from transactions.tests.test_rule_differential import composite_rule, leaf, random_txs, threshold_rule
+
+
+class _View:
+    def __init__(self, rules, levels):
+        self.items = []
+        for j, (kind, rule) in enumerate(rules):
+            compiled = compile_rule(kind, rule)
+            compiled.vector = compile_vector(kind, rule)
+            self.items.append((kind, None, None, j, "high" if levels[j] else "low", rule, compiled))
+        self.items.append(("ml", None, None, len(rules), "low", None, None))
+        self.levels = list(levels) + [0]
+        self.threshold_index = ThresholdIndex(self.items)
+
+
+def make_view(rnd, n=120):
+    rules = []
+    for j in range(n):
+        if j % 5 == 4:
+            rules.append(composite_rule(leaf("amount", ">", rnd.choice([1, 100, 1000]))))
+        else:
+            rules.append(threshold_rule(
+                rnd.choice(["amount", "velocity_score", "geo_anomaly_score"]),
+                rnd.choice([">", ">=", "<", "<=", "==", "!="]),
+                float(rnd.choice([0, 0.5, 1, 7, 100, 2500])),
+            ))
+    return _View(rules, [3 if rnd.random() < 0.3 else 1 for _ in rules])
+
+
+class RankingTests(SimpleTestCase):
+    def setUp(self):
+        self.rnd = random.Random(7)
+        self.view = make_view(self.rnd)
+        self.stats = RuleStats(stop_level=3)
+        for j, t in enumerate(self.view.items[:-1]):
+            for _ in range(self.rnd.randint(0, 30)):
+                self.stats.record(t[0], t[3], self.rnd.random() < 0.2, self.rnd.randint(100, 50_000))
+
+    def test_order_skips_ml_and_puts_critical_first(self):
+        ranking = self.stats.ranking(self.view, now=0.0)
+        levels = self.view.levels
+        self.assertNotIn(len(self.view.items) - 1, ranking.order)
+        crit = [levels[j] >= 3 for j in ranking.order]
+        self.assertEqual(crit, sorted(crit, reverse=True))
+        for pos, j in enumerate(ranking.order):
+            self.assertEqual(ranking.rank[j], pos)
+
+    def test_ranking_cached_until_refresh(self):
+        ranking = self.stats.ranking(self.view, now=0.0)
+        self.assertIs(self.stats.ranking(self.view, now=1.0), ranking)
+        self.assertIs(self.stats.ranking(self.view, now=100.0), ranking)
+
+    def test_ranked_index_yields_rank_order(self):
+        ranking = self.stats.ranking(self.view, now=0.0)
+        for tx in random_txs(self.rnd, 200):
+            plain = self.view.threshold_index.candidates(tx)
+            ranked = [(ranking.order[pos], hit) for pos, hit in ranking.index.candidates(tx)]
+            self.assertEqual(ranked, sorted(plain, key=lambda c: ranking.rank[c[0]]))
+
+    @unittest.skipIf(np is None, "numpy не установлен")
+    def test_ranked_verdicts_yield_rank_order(self):
+        ranking = self.stats.ranking(self.view, now=0.0)
+        txs = random_txs(self.rnd, 200)
+        verdicts = batch_verdicts(txs, self.view.items)
+        ranked = verdicts.ranked(ranking.order)
+        for i in range(len(txs)):
+            self.assertEqual(ranked.row(i), sorted(verdicts.row(i), key=lambda c: ranking.rank[c[0]]))
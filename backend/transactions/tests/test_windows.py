@@ -0,0 +1,62 @@
+import random
+from datetime import datetime, timezone
+from django.test import SimpleTestCase
+from transactions.windows import WindowStore
+
+
+def brute_stats(store, mode, key, window_seconds, at):
+    buckets = store.keys[mode].get(key) or {}
+    lo = store._bucket(at - window_seconds)
+    hi = store._bucket(at) if store.event_time else float("inf")
+    cnt, total, mx = 0, 0.0, 0.0
+    for b, (c, t, m) in buckets.items():
+        if lo <= b <= hi:
+            cnt += c
+            total += t
+            mx = max(mx, m)
+    return cnt, total, mx
+
+
+class WindowStatsTests(SimpleTestCase):
+    def make_store(self, event_time):
+        store = WindowStore(bucket_sec=5, evict_every_sec=0, event_time=event_time, lateness=60)
+        store.modes = frozenset({"sender"})
+        store.horizon = 600
+        store.since = 0
+        store.stale = False
+        return store
+
+    def assert_matches_brute(self, event_time, seed):
+        rnd = random.Random(seed)
+        store = self.make_store(event_time)
+        now = 1_700_000_000.0
+        for step in range(3000):
+            now += rnd.uniform(0, 3)
+            store.now = now
+            late = rnd.random() < 0.1
+            ts = now - (rnd.uniform(0, 200) if late else rnd.uniform(0, 2))
+            tx = {
+                "sender_account": rnd.choice(["A", "B", "C"]),
+                "amount": rnd.choice([round(rnd.uniform(1, 900), 2), 0, -5.0]),
+                "timestamp": datetime.fromtimestamp(ts, tz=timezone.utc),
+            }
+            store.add_tx(tx)
+            if step % 97 == 0:
+                store.evict()
+            for window in (60, 300):
+                at = store.anchor(tx)
+                got = store.stats("sender", tx["sender_account"], window, at)
+                want = brute_stats(store, "sender", tx["sender_account"], window, at)
+                self.assertEqual(got[0], want[0])
+                self.assertAlmostEqual(got[1], want[1], places=6)
+                self.assertEqual(got[2], want[2])
+
+    def test_event_time_matches_full_scan(self):
+        self.assert_matches_brute(True, 1)
+
+    def test_processing_time_matches_full_scan(self):
+        self.assert_matches_brute(False, 2)
+
+    def test_missing_key(self):
+        store = self.make_store(True)
+        self.assertEqual(store.stats("sender", "nobody", 60, 0.0), (0, 0.0, 0.0))
@@ -0,0 +1,96 @@
+import os
+import zlib
+import redis
+from typing import Iterable, List, Optional
+
+
+TXINDEX_ON     = os.getenv("TX_TXINDEX", "1") == "1"
+TXINDEX_PREFIX = os.getenv("TX_TXINDEX_PREFIX", "tx_persisted")
+TXINDEX_SHARDS = int(os.getenv("TX_TXINDEX_SHARDS", "64"))
+TXINDEX_CHUNK  = int(os.getenv("TX_TXINDEX_CHUNK", "10000"))
+TXINDEX_LOCK_SEC = int(os.getenv("TX_TXINDEX_LOCK_SEC", "600"))
+
+
+class TxIdIndex:
+    def __init__(self, client, prefix: str = TXINDEX_PREFIX, shards: int = TXINDEX_SHARDS,
+                 chunk: int = TXINDEX_CHUNK):
+        self.r = client
+        self.prefix = prefix
+        self.shards = max(1, shards)
+        self.chunk = chunk
+        self.ready_key = f"{prefix}:ready"
+        self.gen_key = f"{prefix}:gen"
+        self.lock_key = f"{prefix}:rebuild_lock"
+
+    def _shard_key(self, txid: str) -> str:
+        return f"{self.prefix}:{zlib.crc32(txid.encode('utf-8')) % self.shards}"
+
+    def _group(self, txids: Iterable[str]) -> dict:
+        by_shard = {}
+        for t in txids:
+            if t:
+                by_shard.setdefault(self._shard_key(t), []).append(t)
+        return by_shard
+
+    def is_ready(self) -> bool:
+        return self.r.get(self.ready_key) is not None
+
+    def contains(self, txids: List[str]) -> Optional[set]:
+        found = set()
+        for i in range(0, len(txids), self.chunk):
+            by_shard = self._group(txids[i:i + self.chunk])
+            pipe = self.r.pipeline(transaction=False)
+            pipe.get(self.ready_key)
+            for key, part in by_shard.items():
+                pipe.execute_command("SMISMEMBER", key, *part)
+            try:
+                res = pipe.execute()
+            except redis.ResponseError:
+                return None
+            if res[0] is None:
+                return None
+            for part, flags in zip(by_shard.values(), res[1:]):
+                found.update(t for t, f in zip(part, flags) if f)
+        return found
+
+    def add(self, txids: List[str]) -> None:
+        pipe = self.r.pipeline(transaction=False)
+        for i in range(0, len(txids), self.chunk):
+            for key, part in self._group(txids[i:i + self.chunk]).items():
+                pipe.sadd(key, *part)
+        pipe.execute()
+
+    def invalidate(self) -> None:
+        pipe = self.r.pipeline(transaction=False)
+        pipe.incr(self.gen_key)
+        pipe.delete(self.ready_key)
+        pipe.execute()
+
+    def rebuild(self, id_iter: Iterable[str]) -> Optional[int]:
+        if not self.r.set(self.lock_key, "1", nx=True, ex=TXINDEX_LOCK_SEC):
+            return None
+        try:
+            gen = self.r.get(self.gen_key)
+            total, buf = 0, []
+            for txid in id_iter:
+                buf.append(txid)
+                if len(buf) >= self.chunk:
+                    self.add(buf)
+                    total += len(buf)
+                    buf = []
+            if buf:
+                self.add(buf)
+                total += len(buf)
+            with self.r.pipeline() as pipe:
+                try:
+                    pipe.watch(self.gen_key)
+                    if pipe.get(self.gen_key) != gen:
+                        return None
+                    pipe.multi()
+                    pipe.set(self.ready_key, "1")
+                    pipe.execute()
+                except redis.WatchError:
+                    return None
+            return total
+        finally:
+            self.r.delete(self.lock_key)
@@ -0,0 +1,159 @@
+import sys
+from collections.abc import MutableMapping
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from transactions.codec import FLOAT_FIELDS, STR_FIELDS
+
+
+NUMERIC_FIELDS = ("amount",) + FLOAT_FIELDS
+CATEGORICAL_FIELDS = ("transaction_type", "device_used", "merchant_category", "location", "payment_channel")
+FIELDS = tuple(dict.fromkeys(
+    ("transaction_id", "correlation_id", "timestamp", "sender_account", "receiver_account")
+    + NUMERIC_FIELDS + CATEGORICAL_FIELDS + STR_FIELDS
+))
+
+_FIELD_SET = frozenset(FIELDS)
+_NUMERIC = frozenset(NUMERIC_FIELDS)
+_CATEGORICAL = frozenset(CATEGORICAL_FIELDS)
+_MISSING = object()
+
+
+def _parse_timestamp(v):
+    try:
+        dt = parse_datetime(v)
+    except ValueError:
+        return v
+    if not dt:
+        return v
+    return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+
+
+def _parse_value(key: str, v):
+    if not isinstance(v, str):
+        return v
+    if key in _CATEGORICAL:
+        return sys.intern(v)
+    if key == "timestamp":
+        return _parse_timestamp(v)
+    return v
+
+
+class TxRecord(MutableMapping):
+    __slots__ = FIELDS + ("extra", "raw")
+
+    def __init__(self, data=None):
+        self.extra = None
+        self.raw = None
+        if data:
+            for k, v in data.items():
+                self[k] = v
+
+    @classmethod
+    def parse(cls, data: dict) -> "TxRecord":
+        rec = cls()
+        for k, v in data.items():
+            if k in _NUMERIC and isinstance(v, str):
+                try:
+                    n = float(v)
+                except ValueError:
+                    rec[k] = v
+                    continue
+                rec[k] = n
+                if str(n) != v:
+                    # исходный текст нужен только строковым сравнениям и шаблонам
+                    if rec.raw is None:
+                        rec.raw = {}
+                    rec.raw[k] = v
+                continue
+            rec[k] = _parse_value(k, v)
+        return rec
+
+    def text(self, key: str, value) -> str:
+        raw = self.raw
+        if raw:
+            t = raw.get(key)
+            if t is not None:
+                return t
+        return str(value)
+
+    def get(self, key, default=None):
+        if key in _FIELD_SET:
+            return getattr(self, key, default)
+        extra = self.extra
+        return extra.get(key, default) if extra else default
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        extra = self.extra
+        if extra is None:
+            raise KeyError(key)
+        return extra[key]
+
+    def __setitem__(self, key, value):
+        if key in _FIELD_SET:
+            setattr(self, key, value)
+            if self.raw and key in self.raw:
+                del self.raw[key]
+            return
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+            if self.raw:
+                self.raw.pop(key, None)
+            return
+        if self.extra is None:
+            raise KeyError(key)
+        del self.extra[key]
+
+    def pop(self, key, default=_MISSING):
+        try:
+            value = self[key]
+        except KeyError:
+            if default is _MISSING:
+                raise
+            return default
+        del self[key]
+        return value
+
+    def __contains__(self, key):
+        if key in _FIELD_SET:
+            return hasattr(self, key)
+        return bool(self.extra) and key in self.extra
+
+    def __iter__(self):
+        for k in FIELDS:
+            if hasattr(self, k):
+                yield k
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for k in FIELDS if hasattr(self, k)) + len(self.extra or ())
+
+    def as_dict(self, raw: bool = False) -> dict:
+        out = {k: getattr(self, k) for k in FIELDS if hasattr(self, k)}
+        if raw and self.raw:
+            out.update(self.raw)
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+    def __repr__(self):
+        return f"TxRecord({self.as_dict()!r})"
+
+
+def text_of(tx, key: str, value) -> str:
+    if isinstance(tx, TxRecord):
+        return tx.text(key, value)
+    return str(value)
@@ -0,0 +1,257 @@
+import re
+import math
+from datetime import datetime
+from django.core.validators import (
+    MaxLengthValidator, MinLengthValidator, MaxValueValidator, MinValueValidator,
+    ProhibitNullCharactersValidator, RegexValidator,
+)
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.fields import empty, SkipField, ProhibitSurrogateCharactersValidator
+from .serializers import TransactionSerializer, sanitize_value
+
+
+_BAD_CHARS_RE = re.compile(r"[\x00\ud800-\udfff]")
+_CHAR_VALIDATORS = (MaxLengthValidator, MinLengthValidator, ProhibitNullCharactersValidator,
+                    ProhibitSurrogateCharactersValidator, RegexValidator)
+_FLOAT_VALIDATORS = (MaxValueValidator, MinValueValidator)
+_OCTET = "(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])"
+_IPV4_RE = re.compile(f"{_OCTET}(?:\\.{_OCTET}){{3}}")
+
+_D2 = "([0-9]{2})"
+_YMD = f"([0-9]{{4}})-{_D2}-{_D2}"
+_HMS = f"{_D2}:{_D2}:{_D2}"
+_FAST_DT_FORMATS = {
+    "%Y-%m-%dT%H:%M:%S.%f": (re.compile(f"{_YMD}T{_HMS}\\.([0-9]{{1,6}})"), (0, 1, 2, 3, 4, 5, 6)),
+    "%Y-%m-%dT%H:%M:%S":    (re.compile(f"{_YMD}T{_HMS}"), (0, 1, 2, 3, 4, 5, None)),
+    "%Y-%m-%d %H:%M:%S.%f": (re.compile(f"{_YMD} {_HMS}\\.([0-9]{{1,6}})"), (0, 1, 2, 3, 4, 5, 6)),
+    "%Y-%m-%d %H:%M:%S":    (re.compile(f"{_YMD} {_HMS}"), (0, 1, 2, 3, 4, 5, None)),
+    "%d.%m.%Y %H:%M":       (re.compile(f"{_D2}\\.{_D2}\\.([0-9]{{4}}) {_D2}:{_D2}"), (2, 1, 0, 3, 4, None, None)),
+}
+
+
+class _Slow(Exception):
+    pass
+
+
+def _char_step(field):
+    regexes = []
+    for v in field.validators:
+        if not isinstance(v, _CHAR_VALIDATORS):
+            return None
+        if isinstance(v, RegexValidator):
+            if v.inverse_match:
+                return None
+            regexes.append(v.regex)
+    allow_blank, max_len, min_len = field.allow_blank, field.max_length, field.min_length
+    slow = field.run_validation
+
+    def step(v):
+        if v.__class__ is not str:
+            return slow(v)
+        v = v.strip()
+        if not v:
+            if allow_blank:
+                return ""
+            raise _Slow
+        if (max_len is not None and len(v) > max_len) or (min_len is not None and len(v) < min_len):
+            raise _Slow
+        if _BAD_CHARS_RE.search(v):
+            raise _Slow
+        for rx in regexes:
+            if not rx.search(v):
+                raise _Slow
+        return v
+    return step
+
+
+def _choice_step(field):
+    choices = field.choice_strings_to_values
+    slow = field.run_validation
+
+    def step(v):
+        if v.__class__ is str and v in choices:
+            return choices[v]
+        return slow(v)
+    return step
+
+
+def _float_step(field):
+    if any(not isinstance(v, _FLOAT_VALIDATORS) for v in field.validators):
+        return None
+    lo, hi = field.min_value, field.max_value
+    max_str = field.MAX_STRING_LENGTH
+    isfinite = math.isfinite
+
+    def step(v):
+        cls = v.__class__
+        if cls is float or cls is int:
+            v = float(v)
+        elif cls is str and len(v) <= max_str:
+            try:
+                v = float(v)
+            except ValueError:
+                raise _Slow
+        else:
+            raise _Slow
+        if not isfinite(v) or (lo is not None and v < lo) or (hi is not None and v > hi):
+            raise _Slow
+        return v
+    return step
+
+
+def _datetime_step(field):
+    if field.validators:
+        return None
+    formats = getattr(field, "input_formats", None) or []
+    fast = [_FAST_DT_FORMATS[f] for f in formats if f in _FAST_DT_FORMATS]
+    if not fast:
+        return None
+    enforce_tz = field.enforce_timezone
+    field_tz = field.timezone if hasattr(field, "timezone") else field.default_timezone()
+    if field_tz is not None and str(field_tz) == "UTC":
+        enforce_tz = lambda dt: dt.replace(tzinfo=field_tz)
+    slow = field.run_validation
+
+    def step(v):
+        if v.__class__ is str:
+            for rx, (iy, imo, id_, ih, imi, isec, ifr) in fast:
+                m = rx.fullmatch(v)
+                if m is None:
+                    continue
+                g = m.groups()
+                try:
+                    dt = datetime(
+                        int(g[iy]), int(g[imo]), int(g[id_]), int(g[ih]), int(g[imi]),
+                        int(g[isec]) if isec is not None else 0,
+                        int(g[ifr].ljust(6, "0")) if ifr is not None else 0,
+                    )
+                except ValueError:
+                    break
+                return enforce_tz(dt)
+        return slow(v)
+    return step
+
+
+def _ipv4_step(field):
+    if field.protocol != "ipv4" or field.max_length is not None:
+        return None
+    slow = field.run_validation
+
+    def step(v):
+        if v.__class__ is str:
+            s = v.strip()
+            if _IPV4_RE.fullmatch(s):
+                return s
+        return slow(v)
+    return step
+
+
+def _compile_field(field):
+    cls = type(field)
+    step = None
+    clean_output = False
+    if cls in (serializers.CharField, serializers.RegexField):
+        step = _char_step(field)
+    elif cls is serializers.IPAddressField:
+        step = _ipv4_step(field)
+    elif cls is serializers.ChoiceField:
+        step = _choice_step(field)
+        clean_output = all(
+            sanitize_value(field.field_name, c) == c for c in field.choice_strings_to_values.values()
+        )
+    elif cls is serializers.FloatField:
+        step = _float_step(field)
+        clean_output = True
+    elif cls is serializers.DateTimeField:
+        step = _datetime_step(field)
+        clean_output = True
+    return step or field.run_validation, clean_output and step is not None
+
+
+def _transaction_checks(data: dict, now) -> bool:
+    if data["amount"] <= 0:
+        return False
+    if data["timestamp"] > now:
+        return False
+    ip_str = data.get("ip_address")
+    if ip_str and ip_str in ("0.0.0.0", "255.255.255.255"):
+        return False
+    return True
+
+
+class CompiledValidator:
+    def __init__(self, serializer_class, record_check=None):
+        self.child = serializer_class()
+        self.record_check = record_check
+        self.plan = []
+        for name, field in self.child.fields.items():
+            if field.read_only:
+                continue
+            if field.default is not empty:
+                missing = "default"
+            elif field.required:
+                missing = "required"
+            else:
+                missing = "skip"
+            step, clean_output = _compile_field(field)
+            self.plan.append((
+                name,
+                step,
+                clean_output,
+                missing,
+                field.get_default if missing == "default" else None,
+                field.allow_null,
+            ))
+
+    def _fast(self, item: dict, now):
+        out = {}
+        for name, step, clean_output, missing, get_default, allow_null in self.plan:
+            v = item.get(name, empty)
+            if v is empty:
+                if missing == "required":
+                    raise _Slow
+                if missing == "skip":
+                    continue
+                v = get_default()
+            elif v is None:
+                if not allow_null:
+                    raise _Slow
+            else:
+                try:
+                    v = step(v)
+                except (serializers.ValidationError, SkipField):
+                    raise _Slow
+                if clean_output:
+                    out[name] = v
+                    continue
+            out[name] = sanitize_value(name, v)
+        if self.record_check is not None and not self.record_check(out, now):
+            raise _Slow
+        return out
+
+    def _slow(self, item):
+        try:
+            validated = self.child.run_validation(item)
+        except serializers.ValidationError as exc:
+            return None, exc.detail
+        return {k: sanitize_value(k, v) for k, v in validated.items()}, {}
+
+    def validate_many(self, items):
+        now = timezone.now()
+        cleaned, errors = [], []
+        for item in items:
+            try:
+                if item.__class__ is not dict:
+                    raise _Slow
+                cleaned.append(self._fast(item, now))
+                errors.append({})
+            except _Slow:
+                obj, err = self._slow(item)
+                if obj is not None:
+                    cleaned.append(obj)
+                errors.append(err)
+        return cleaned, errors
+
+
+transaction_validator = CompiledValidator(TransactionSerializer, record_check=_transaction_checks)
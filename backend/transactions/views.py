@@ -1,7 +1,11 @@
 import csv
+import io
 import os
 import json
+import time
+import queue
 import hashlib
+import threading
 import redis
 import logging
 from typing import List, Tuple
@@ -11,8 +15,8 @@ from drf_spectacular.utils import extend_schema
 from rest_framework import status
 from rest_framework import status as http_status
 from rest_framework.response import Response
+from rest_framework.exceptions import APIException
 from rest_framework.decorators import api_view, parser_classes
-from rest_framework.parsers import JSONParser
 from rest_framework.pagination import PageNumberPagination
 from django.conf import settings
 from django.http import HttpResponse, JsonResponse
@@ -20,6 +24,15 @@ from django.db.models import Count, Avg, Max, Min, Sum
 from django.shortcuts import get_object_or_404
 from .models import Transaction, ThresholdRule, CompositeRule, PatternRule, MLRule
 from .serializers import TransactionSerializer, sanitize_record, ThresholdRuleSerializer, CompositeRuleSerializer, PatternRuleSerializer, MLRuleSerializer
+from .validation import transaction_validator
+from .redis_scripts import DEDUP_ENQUEUE_LUA
+from .dedup import DedupStore
+from .partitions import STREAM_PARTITIONS, partition_streams, partition_of
+from .codec import STREAM_FORMAT, encode_fields
+from .admission import ADMISSION_ON, AdmissionController
+from .txindex import TXINDEX_ON, TxIdIndex
+from .compression import CompressedJSONParser, content_encoding, decoded_stream, supported_encodings
+from .rule_events import OP_DELETE, OP_UPSERT, RulePublisher
 from transactions.rules import threshold as thr_eval, composite as comp_eval, pattern as patt_eval
 from .ml_engine import MLEngine
 
@@ -29,6 +42,7 @@ load_dotenv()
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 STREAM     = os.getenv("TX_STREAM", "transactions_stream")
+GROUP      = os.getenv("TX_GROUP", "1")
 USE_DEDUP = os.getenv("TX_USE_DEDUP") == "1"
 DEDUP_KEYS = [k.strip() for k in os.getenv("TX_DEDUP_KEYS", "correlation_id,transaction_id").split(",") if k.strip()]
 DEDUP_SET = os.getenv("TX_DEDUP_SET", "tx_seen_tokens")   
@@ -36,15 +50,25 @@ DEDUP_TTL_SEC = int(os.getenv("TX_DEDUP_TTL", "86400"))
 VAL_CHUNK    = int(os.getenv("TX_VALIDATE_CHUNK", "10000"))     
 DEDUP_CHUNK  = int(os.getenv("TX_DEDUP_CHECK_CHUNK", "50000"))  
 XADD_CHUNK   = int(os.getenv("TX_XADD_CHUNK", "5000"))          
+SCRIPT_CHUNK = int(os.getenv("TX_ENQUEUE_SCRIPT_CHUNK", "200"))
 MAX_BATCH    = int(os.getenv("TX_MAX_BATCH", "90000"))          
+FAST_VALIDATE = os.getenv("TX_FAST_VALIDATE", "1") == "1"          
+ATOMIC_ENQUEUE = os.getenv("TX_ATOMIC_ENQUEUE", "1") == "1"          
 LOOKUP_CHUNK = int(os.getenv("TX_LOOKUP_CHUNK", "5000"))        
+# XADD не обрезает поток: длину держат admission control (лимит ниже) и stream_janitor по MINID
 STREAM_MAXLEN = int(os.getenv("TX_STREAM_MAXLEN", "2000000"))  
-TRIM_APPROX   = os.getenv("TX_TRIM_APPROX") == "1"        
+STREAMS       = partition_streams(STREAM)
+PARTITION_MAXLEN = max(1, STREAM_MAXLEN // len(STREAMS))
 IDEMP_TTL_SEC = int(os.getenv("TX_IDEMP_TTL", "86400"))        
 IDEMP_NS      = os.getenv("TX_IDEMP_NS")             
 FPG_NS       = os.getenv("TX_FPG_NS")
 FPG_TTL_SEC  = int(os.getenv("TX_FPG_TTL", "604800"))          
 FPG_SEEN_KEY = f"{FPG_NS}:seen"
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+NDJSON_FLUSH    = int(os.getenv("TX_NDJSON_FLUSH", "2000"))
+NDJSON_FLUSH_MS = int(os.getenv("TX_NDJSON_FLUSH_MS", "50"))
+NDJSON_MAX_LINE = int(os.getenv("TX_NDJSON_MAX_LINE", "65536"))
+NDJSON_JOIN_SEC = float(os.getenv("TX_NDJSON_READER_JOIN_SEC", "2"))
 
 
 @api_view(["GET"])
@@ -268,7 +292,8 @@ def create_rule(request):
 
     serializer = Serializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        obj = serializer.save()
+        rule_publisher.publish_on_commit(rule_type, obj.id, OP_UPSERT)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -288,6 +313,7 @@ def update_rule(request, rule, id):
     serializer = Serializer(instance, data=request.data, partial=True)
     if serializer.is_valid():
         serializer.save()
+        rule_publisher.publish_on_commit(rule, instance.id, OP_UPSERT)
         return Response(serializer.data)
     return Response(serializer.errors, status=400)
 
@@ -304,7 +330,9 @@ def delete_rule(request, rule, id):
     except Model.DoesNotExist:
         return Response({"error": "Правило не найдено"}, status=404)
 
+    rule_id = instance.id
     instance.delete()
+    rule_publisher.publish_on_commit(rule, rule_id, OP_DELETE)
     return Response({"message": "Правило удалено"}, status=200)
 
 
@@ -377,6 +405,11 @@ def test_rule(request):
 
 r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
 logger = logging.getLogger(__name__)
+_dedup_enqueue_script = r.register_script(DEDUP_ENQUEUE_LUA)
+rule_publisher = RulePublisher(r)
+dedup_store = DedupStore(r, DEDUP_SET, DEDUP_TTL_SEC, chunk=DEDUP_CHUNK)
+admission = AdmissionController(r, STREAMS, GROUP, PARTITION_MAXLEN) if ADMISSION_ON else None
+txid_index = TxIdIndex(r) if TXINDEX_ON else None
 
 def _ensure_list(payload):
     if isinstance(payload, dict) and "transactions" in payload:
@@ -388,17 +421,31 @@ def _ensure_list(payload):
     return []
 
 
-def _make_fingerprint(items: List[dict]) -> str:
-    keys = []
-    for it in items:
-        tid = str(it.get("transaction_id", "")).strip()
-        cid = str(it.get("correlation_id", "")).strip()
-        keys.append(f"{tid}|{cid}")
-    keys.sort()
-    raw = ",".join(keys).encode("utf-8")
+def _fingerprint_key(it: dict) -> str:
+    tid = str(it.get("transaction_id", "")).strip()
+    cid = str(it.get("correlation_id", "")).strip()
+    return f"{tid}|{cid}"
+
+
+def _fingerprint_of(keys: List[str]) -> str:
+    raw = ",".join(sorted(keys)).encode("utf-8")
     return hashlib.sha1(raw).hexdigest()
 
 
+def _make_fingerprint(items: List[dict]) -> str:
+    return _fingerprint_of([_fingerprint_key(it) for it in items])
+
+
+def _seen_reprocess(batch_fingerprint: str, reprocess_yes: bool, reprocess_auto: bool) -> bool:
+    # уже присланный батч без явного reprocess пересчитывается в режиме auto
+    if reprocess_auto or reprocess_yes:
+        return reprocess_auto
+    try:
+        return bool(r.sismember(FPG_SEEN_KEY, batch_fingerprint))
+    except Exception:
+        return False
+
+
 def _dedup_tokens(obj: dict) -> List[str]:
     tokens = []
     for key in DEDUP_KEYS:
@@ -411,26 +458,17 @@ def _dedup_tokens(obj: dict) -> List[str]:
     return tokens
 
 
+def _seen_token_flags(tokens: List[str]) -> List[bool]:
+    return dedup_store.seen_flags(tokens)
+
+
 def _dedup_partition(cleaned: List[dict]) -> Tuple[List[dict], int]:
     if not USE_DEDUP or not cleaned:
         return cleaned, 0
 
     items_tokens = [_dedup_tokens(o) for o in cleaned]
     flat_tokens = [t for ts in items_tokens for t in ts]
-    existing = set()
-    
-    for i in range(0, len(flat_tokens), DEDUP_CHUNK):
-        part = flat_tokens[i:i + DEDUP_CHUNK]
-        if not part:
-            continue
-        try:
-            flags = r.execute_command("SMISMEMBER", DEDUP_SET, *part)
-        except redis.ResponseError:
-            pipe = r.pipeline(transaction=False)
-            for tok in part:
-                pipe.sismember(DEDUP_SET, tok)
-            flags = pipe.execute()
-        existing.update(tok for tok, f in zip(part, flags) if bool(f))
+    existing = {tok for tok, f in zip(flat_tokens, _seen_token_flags(flat_tokens)) if f}
 
     new_items, new_tokens, dropped = [], [], 0
     for obj, toks in zip(cleaned, items_tokens):
@@ -439,35 +477,53 @@ def _dedup_partition(cleaned: List[dict]) -> Tuple[List[dict], int]:
             continue
         new_items.append(obj)
         new_tokens.extend(toks)
-    
-    for i in range(0, len(new_tokens), DEDUP_CHUNK):
-        part = new_tokens[i:i + DEDUP_CHUNK]
-        if part:
-            r.sadd(DEDUP_SET, *part)
-    if new_tokens:
-        r.expire(DEDUP_SET, DEDUP_TTL_SEC)
 
+    dedup_store.add(new_tokens)
     return new_items, dropped
 
 
+def _stream_fields(obj: dict) -> dict:
+    return encode_fields(obj, STREAM_FORMAT)
+
+
 def _xadd_partition(to_send: List[dict]) -> int:
     queued = 0
-    for o in to_send:
-        ts = o.get("timestamp")
-        if hasattr(ts, "isoformat"):
-            o["timestamp"] = ts.isoformat() if ts is not None else None
-
     for i in range(0, len(to_send), XADD_CHUNK):
         chunk = to_send[i:i + XADD_CHUNK]
         pipe = r.pipeline(transaction=False)
         for obj in chunk:
-            clean = {k: (v.isoformat() if hasattr(v, "isoformat") else str(v)) for k, v in obj.items()}
-            pipe.xadd(STREAM, clean, maxlen=STREAM_MAXLEN, approximate=TRIM_APPROX)
+            stream = STREAMS[partition_of(obj.get("sender_account"))]
+            pipe.xadd(stream, _stream_fields(obj))
         pipe.execute()
         queued += len(chunk)
     return queued
 
 
+def _dedup_enqueue(items: List[dict], force_recalc: List[bool], auto: bool) -> Tuple[int, int]:
+    queued = dropped = 0
+    keys = STREAMS + dedup_store.bucket_keys()
+    # скрипт блокирует Redis целиком: пачки по сотне-другой записей, а не по XADD_CHUNK
+    for i in range(0, len(items), SCRIPT_CHUNK):
+        chunk = items[i:i + SCRIPT_CHUNK]
+        args = [dedup_store.expire_at(), int(USE_DEDUP), int(auto),
+                dedup_store.mode, dedup_store.k, len(STREAMS)]
+        for obj, force in zip(chunk, force_recalc[i:i + SCRIPT_CHUNK]):
+            toks = [] if force else [x for t in _dedup_tokens(obj) for x in dedup_store.encode(t)]
+            fields = _stream_fields(obj)
+            args.append(1 if force else 0)
+            args.append(partition_of(obj.get("sender_account")) + 1)
+            args.append(len(toks))
+            args.extend(toks)
+            args.append(len(fields))
+            for k, v in fields.items():
+                args.append(k)
+                args.append(v)
+        q, d, _recalced = _dedup_enqueue_script(keys=keys, args=args)
+        queued += int(q)
+        dropped += int(d)
+    return queued, dropped
+
+
 def _reprocess_flag(request) -> tuple[bool, bool]:
     def _to_val(v: str) -> str:
         return (v or "").strip().lower()
@@ -478,199 +534,214 @@ def _reprocess_flag(request) -> tuple[bool, bool]:
     return yes, auto
 
 
-@extend_schema(tags=["Main"], summary="Главный POST запрос")
-@api_view(["POST"])
-@parser_classes([JSONParser])  
-def stream_transaction(request):
-    if not (request.content_type or "").lower().startswith("application/json"):
-        return Response({"error": "Поддерживается только application/json"}, status=http_status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
-    items = _ensure_list(request.data)
-    if not items:
-        return Response({"error": "Нет транзакций для обработки"}, status=http_status.HTTP_400_BAD_REQUEST)
-    if isinstance(items, list) and len(items) > MAX_BATCH:
-        return Response(
-            {"error": f"Слишком большой батч JSON: {len(items)} > {MAX_BATCH}. Отправьте несколькими запросами."},
-            status=413
-        )
-    total_received = len(items)
-    total_queued = 0
-    total_invalid = 0
-    total_dedup_dropped = 0
-    errors_preview: List[dict] = []
-    reprocess_yes, reprocess_auto = _reprocess_flag(request)
+def _new_ingest_stats() -> dict:
+    return {"received": 0, "queued": 0, "invalid": 0, "dedup_dropped": 0, "deferred": 0, "errors": []}
 
-    batch_fingerprint = _make_fingerprint(items if isinstance(items, list) else [items])
 
-    try:
-        if r.sismember(FPG_SEEN_KEY, batch_fingerprint) and not reprocess_yes:
-            reprocess_auto = True  
-    except Exception:
-        pass
+def _admission_rejected(decision):
+    logger.warning({
+        "component": "ingest",
+        "event": "ingest_throttled",
+        "reason": decision.reason,
+        "backlog": decision.backlog,
+        "status": decision.status,
+        "retry_after": decision.retry_after,
+    })
+    if decision.status == http_status.HTTP_503_SERVICE_UNAVAILABLE:
+        msg = "Нет активных обработчиков очереди, повторите позже"
+    else:
+        msg = "Очередь обработки перегружена, повторите позже"
+    return Response(
+        {"error": msg, "backlog": decision.backlog, "retry_after": decision.retry_after},
+        status=decision.status,
+        headers={"Retry-After": str(decision.retry_after)},
+    )
+
+
+def _drf_validate(part: List[dict]) -> Tuple[List[dict], list]:
+    ser = TransactionSerializer(data=part, many=True)
+    ok = ser.is_valid(raise_exception=False)
+
+    valid_objs: List[dict] = []
+    if ok:
+        valid_objs = list(ser.validated_data)
+        errors = [{} for _ in valid_objs]
+    else:
+        errors = list(ser.errors)
+        vd = list(ser.validated_data)  
+        j = 0
+        for err in errors:
+            if not err and j < len(vd):
+                valid_objs.append(vd[j])
+                j += 1
+
+    return [sanitize_record(o) for o in valid_objs], errors
+
+
+def _ingest_chunk(part: List[dict], indices, stats: dict, reprocess_yes: bool, reprocess_auto: bool) -> None:
+    errors_preview = stats["errors"]
+    for it in part:
+        if isinstance(it, dict) and it.get("time_since_last_transaction") in ("", None):
+            it["time_since_last_transaction"] = 0.0
+
+    if FAST_VALIDATE:
+        cleaned, errors = transaction_validator.validate_many(part)
+    else:
+        cleaned, errors = _drf_validate(part)
+
+    chunk_errors = [{"index": indices[i], "error": e} for i, e in enumerate(errors) if e]
+    if chunk_errors:
+        take = min(100 - len(errors_preview), len(chunk_errors))
+        if take > 0:
+            errors_preview.extend(chunk_errors[:take])
+        stats["invalid"] += len(chunk_errors)
+
+    if not cleaned:
+        return
+
+    if reprocess_auto:
+        existing = _existing_txids(cleaned)
+        if ATOMIC_ENQUEUE:
+            force = []
+            for o in cleaned:
+                is_old = str(o.get("transaction_id") or "").strip() in existing
+                if is_old:
+                    o["recalc"] = "1"
+                force.append(is_old)
+            queued, dropped = _dedup_enqueue(cleaned, force, auto=True)
+            stats["queued"] += queued
+            stats["dedup_dropped"] += dropped
+        else:
+            _auto_partition_two_phase(cleaned, existing, stats)
+    elif reprocess_yes:
+        
+        for o in cleaned:
+            o["recalc"] = "1"
+        stats["queued"] += _xadd_partition(cleaned)
+    elif ATOMIC_ENQUEUE and USE_DEDUP:
+        queued, dropped = _dedup_enqueue(cleaned, [False] * len(cleaned), auto=False)
+        stats["queued"] += queued
+        stats["dedup_dropped"] += dropped
+    else:
+        cleaned, dropped = _dedup_partition(cleaned)
+        stats["dedup_dropped"] += dropped
+        if cleaned:
+            stats["queued"] += _xadd_partition(cleaned)
+
+
+def _existing_txids(cleaned: List[dict]) -> set:
+    txids = [str(o.get("transaction_id") or "").strip() for o in cleaned if o.get("transaction_id")]
+    if txid_index is not None:
+        try:
+            found = txid_index.contains(txids)
+        except redis.RedisError as e:
+            logger.warning({"event": "txindex_lookup_failed", "error": str(e)})
+            found = None
+        if found is not None:
+            return found
+    existing = set()
+    for i in range(0, len(txids), LOOKUP_CHUNK):
+        part_ids = txids[i:i + LOOKUP_CHUNK]
+        if part_ids:
+            existing.update(
+                Transaction.objects
+                .filter(transaction_id__in=part_ids)
+                .values_list("transaction_id", flat=True)
+            )
+    return existing
+
+
+def _auto_partition_two_phase(cleaned: List[dict], existing: set, stats: dict) -> None:
+    old_side, new_side = [], []
+    for o in cleaned:
+        if str(o.get("transaction_id") or "").strip() in existing:
+            o["recalc"] = "1"  
+            old_side.append(o)
+        else:
+            new_side.append(o)
+
+    flat_tokens: List[str] = []
+    idx_of_token: List[int] = []
+    for idx, o in enumerate(new_side):
+        for t in _dedup_tokens(o):
+            flat_tokens.append(t)
+            idx_of_token.append(idx)
+
+    seen_by_dedup_idxs = {
+        idx_of_token[tok_idx]
+        for tok_idx, f in enumerate(_seen_token_flags(flat_tokens)) if f
+    }
 
-    mode_ns = "auto" if reprocess_auto else ("reprocess" if reprocess_yes else "normal")
-    idem_key = request.headers.get("Idempotency-Key") or request.query_params.get("idempotency_key")
-    idem_redis_key = f"{IDEMP_NS}:{mode_ns}:{idem_key}" if idem_key else None
+    really_new, also_old = [], []
+    for idx, o in enumerate(new_side):
+        if idx in seen_by_dedup_idxs:
+            x = dict(o)
+            x["recalc"] = "1"
+            also_old.append(x)
+        else:
+            really_new.append(o)
 
-    if idem_redis_key:
-        cached = r.get(idem_redis_key)
-        if cached:
-            try:
-                payload = json.loads(cached)
-            except Exception:
-                payload = None
-            if payload:
-                payload.setdefault("idempotency", {})
-                payload["idempotency"].update({
-                    "duplicate_of": idem_key,
-                    "cached": True,
-                    "mode": mode_ns,
-                    "batch_fingerprint": batch_fingerprint,
-                })
-                return Response(payload, status=http_status.HTTP_200_OK)
-
-    for start in range(0, total_received, VAL_CHUNK):
-        part = items[start:start + VAL_CHUNK]
+    old_side.extend(also_old)
 
-        for it in part:
-            if it.get("time_since_last_transaction") in ("", None):
-                it["time_since_last_transaction"] = 0.0
+    if old_side:
+        stats["queued"] += _xadd_partition(old_side)
 
-        ser = TransactionSerializer(data=part, many=True)
-        ok = ser.is_valid(raise_exception=False)
+    if really_new:
+        really_new, dropped = _dedup_partition(really_new)
+        stats["dedup_dropped"] += dropped
+        if really_new:
+            stats["queued"] += _xadd_partition(really_new)
 
-        valid_objs: List[dict] = []
-        if ok:
-            valid_objs = list(ser.validated_data)
-        else:
-            
-            chunk_errors = [{"index": start + i, "error": e} for i, e in enumerate(ser.errors) if e]
-            take = min(100 - len(errors_preview), len(chunk_errors))
-            if take > 0:
-                errors_preview.extend(chunk_errors[:take])
-            total_invalid += sum(1 for e in ser.errors if e)
-
-            vd = list(ser.validated_data)  
-            j = 0
-            for err in ser.errors:
-                if not err and j < len(vd):
-                    valid_objs.append(vd[j])
-                    j += 1
-
-        if not valid_objs:
-            continue
 
-        cleaned = [sanitize_record(o) for o in valid_objs]
-
-        if reprocess_auto:
-            
-            txids = [str(o.get("transaction_id") or "").strip() for o in cleaned if o.get("transaction_id")]
-            existing = set()
-            if txids:
-                for i in range(0, len(txids), LOOKUP_CHUNK):
-                    part_ids = txids[i:i + LOOKUP_CHUNK]
-                    if part_ids:
-                        existing.update(
-                            Transaction.objects
-                            .filter(transaction_id__in=part_ids)
-                            .values_list("transaction_id", flat=True)
-                        )
-
-            old_side, new_side = [], []
-            for o in cleaned:
-                if str(o.get("transaction_id") or "").strip() in existing:
-                    o["recalc"] = "1"  
-                    old_side.append(o)
-                else:
-                    new_side.append(o)
-
-            
-            def _tokens_for(obj: dict) -> List[str]:
-                toks = []
-                for key in DEDUP_KEYS:
-                    v = obj.get(key)
-                    if v is None:
-                        continue
-                    s = str(v).strip()
-                    if s:
-                        toks.append(f"{key}:{s}")
-                return toks
-
-            seen_by_dedup_idxs = set()
-            flat_tokens: List[str] = []
-            idx_of_token: List[int] = []
-            for idx, o in enumerate(new_side):
-                for t in _tokens_for(o):
-                    flat_tokens.append(t)
-                    idx_of_token.append(idx)
-
-            for i in range(0, len(flat_tokens), DEDUP_CHUNK):
-                part_tokens = flat_tokens[i:i + DEDUP_CHUNK]
-                if not part_tokens:
-                    continue
-                try:
-                    flags = r.execute_command("SMISMEMBER", DEDUP_SET, *part_tokens)
-                except redis.ResponseError:
-                    pipe = r.pipeline(transaction=False)
-                    for t in part_tokens:
-                        pipe.sismember(DEDUP_SET, t)
-                    flags = pipe.execute()
-                for tok_idx, f in zip(range(i, i + len(part_tokens)), flags):
-                    if bool(f):
-                        seen_by_dedup_idxs.add(idx_of_token[tok_idx])
-
-            really_new, also_old = [], []
-            for idx, o in enumerate(new_side):
-                if idx in seen_by_dedup_idxs:
-                    x = dict(o)
-                    x["recalc"] = "1"
-                    also_old.append(x)
-                else:
-                    really_new.append(o)
-
-            old_side.extend(also_old)
-
-            if old_side:
-                total_queued += _xadd_partition(old_side)
-
-            if really_new:
-                really_new, dropped = _dedup_partition(really_new)
-                total_dedup_dropped += dropped
-                if really_new:
-                    total_queued += _xadd_partition(really_new)
-        else:
-            if reprocess_yes:
-                
-                for o in cleaned:
-                    o["recalc"] = "1"
-                total_queued += _xadd_partition(cleaned)
-            else:
-                cleaned, dropped = _dedup_partition(cleaned)
-                total_dedup_dropped += dropped
-                if cleaned:
-                    total_queued += _xadd_partition(cleaned)
+def _cached_idempotent_response(idem_redis_key, idem_key, mode_ns, batch_fingerprint):
+    if not idem_redis_key:
+        return None
+    cached = r.get(idem_redis_key)
+    if not cached:
+        return None
     try:
-        r.xtrim(STREAM, STREAM_MAXLEN, approximate=TRIM_APPROX)
-    except Exception as e:
-        logger.warning({"event": "xtrim_failed", "error": str(e)})
+        payload = json.loads(cached)
+    except Exception:
+        payload = None
+    if not payload:
+        return None
+    payload.setdefault("idempotency", {})
+    payload["idempotency"].update({
+        "duplicate_of": idem_key,
+        "cached": True,
+        "mode": mode_ns,
+        "batch_fingerprint": batch_fingerprint or payload["idempotency"].get("batch_fingerprint"),
+    })
+    return Response(payload, status=http_status.HTTP_200_OK)
 
-    logger.info({
+
+def _finish_ingest(stats: dict, mode_ns: str, idem_key, idem_redis_key, batch_fingerprint: str, extra_log=None,
+                   admission_info=None, seen_fingerprints=()):
+    log_record = {
         "component": "ingest",
         "event": "queued_to_stream",
-        "received": total_received,
-        "queued": total_queued,
-        "invalid": total_invalid,
+        "received": stats["received"],
+        "queued": stats["queued"],
+        "invalid": stats["invalid"],
         "dedup": "on" if USE_DEDUP else "off",
-        "dedup_dropped": total_dedup_dropped,
+        "dedup_dropped": stats["dedup_dropped"],
+        "deferred": stats["deferred"],
         "stream_maxlen": STREAM_MAXLEN,
+        "partitions": STREAM_PARTITIONS,
+        "stream_format": STREAM_FORMAT,
         "mode": mode_ns,
-    })
+    }
+    if extra_log:
+        log_record.update(extra_log)
+    logger.info(log_record)
 
     payload = {
         "summary": {
-            "received": total_received,
-            "queued": total_queued,
-            "invalid": total_invalid,
-            "dedup_dropped": total_dedup_dropped
+            "received": stats["received"],
+            "queued": stats["queued"],
+            "invalid": stats["invalid"],
+            "dedup_dropped": stats["dedup_dropped"],
+            "deferred": stats["deferred"]
         },
         "idempotency": {
             "key_used": bool(idem_key),
@@ -678,8 +749,12 @@ def stream_transaction(request):
             "batch_fingerprint": batch_fingerprint
         }
     }
-    if errors_preview:
-        payload["errors"] = errors_preview  
+    if stats["errors"]:
+        payload["errors"] = stats["errors"]  
+    headers = None
+    if admission_info:
+        payload["admission"] = admission_info
+        headers = {"Retry-After": str(admission_info["retry_after"])}
     
     if idem_redis_key:
         try:
@@ -688,13 +763,250 @@ def stream_transaction(request):
             logger.warning({"event": "idempotency_cache_set_failed", "error": str(e)})
 
     try:
-        r.sadd(FPG_SEEN_KEY, batch_fingerprint)
+        r.sadd(FPG_SEEN_KEY, batch_fingerprint, *seen_fingerprints)
         if FPG_TTL_SEC > 0:
             r.expire(FPG_SEEN_KEY, FPG_TTL_SEC)
     except Exception:
         pass
 
-    return Response(payload, status=http_status.HTTP_202_ACCEPTED)
+    return Response(payload, status=http_status.HTTP_202_ACCEPTED, headers=headers)
+
+
+def _iter_ndjson(stream):
+    while True:
+        line = stream.readline(NDJSON_MAX_LINE + 1)
+        if not line:
+            return
+        if len(line) > NDJSON_MAX_LINE and not line.endswith(b"\n"):
+            while True:
+                tail = stream.readline(NDJSON_MAX_LINE)
+                if not tail or tail.endswith(b"\n"):
+                    break
+            yield None, f"Строка длиннее {NDJSON_MAX_LINE} байт"
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError as e:
+            yield None, f"Некорректный JSON: {e}"
+            continue
+        if not isinstance(obj, dict):
+            yield None, "Ожидается JSON-объект транзакции"
+            continue
+        yield obj, None
+
+
+_READ_END = object()
+_READ_IDLE = object()
+
+
+def _read_ahead(it, timeout, maxsize: int):
+    # чтение тела в отдельном потоке: буфер сбрасывается по таймеру, даже если клиент молчит
+    q, stop = queue.Queue(maxsize=maxsize), threading.Event()
+
+    def put(x):
+        while not stop.is_set():
+            try:
+                q.put(x, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def pump():
+        try:
+            for x in it:
+                if not put(x):
+                    return
+            put(_READ_END)
+        except BaseException as e:
+            put(e)
+
+    reader = threading.Thread(target=pump, name="ndjson-reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            try:
+                x = q.get(timeout=timeout())
+            except queue.Empty:
+                yield _READ_IDLE
+                continue
+            if x is _READ_END:
+                return
+            if isinstance(x, BaseException):
+                raise x
+            yield x
+    finally:
+        stop.set()
+        # читатель замечает stop на ближайшем put; зависший на медленном клиенте не держит ответ
+        reader.join(NDJSON_JOIN_SEC)
+        if reader.is_alive():
+            logger.warning({"event": "ndjson_reader_still_running", "join_sec": NDJSON_JOIN_SEC})
+
+
+def _stream_ndjson(request, reprocess_yes: bool, reprocess_auto: bool):
+    mode_ns = "auto" if reprocess_auto else ("reprocess" if reprocess_yes else "normal")
+    idem_key = request.headers.get("Idempotency-Key") or request.query_params.get("idempotency_key")
+    idem_redis_key = f"{IDEMP_NS}:{mode_ns}:{idem_key}" if idem_key else None
+
+    cached = _cached_idempotent_response(idem_redis_key, idem_key, mode_ns, None)
+    if cached is not None:
+        return cached
+
+    decision = admission.decide(None) if admission is not None else None
+    if decision is not None and decision.status != http_status.HTTP_202_ACCEPTED:
+        return _admission_rejected(decision)
+    cap = decision.admit if decision is not None else None
+    admitted = 0
+    resume_from = None
+
+    stats = _new_ingest_stats()
+    fp_keys: List[str] = []
+    seen_fps: List[str] = []
+    buf: List[dict] = []
+    buf_idx: List[int] = []
+    buf_since = 0.0
+    flushes = 0
+    first_queued_ms = None
+    truncated = None
+    t0 = time.perf_counter()
+
+    def _flush():
+        nonlocal buf, buf_idx, flushes, first_queued_ms, reprocess_auto
+        if not buf:
+            return
+        # отпечаток куска по схеме JSON-пути: повторно присланный поток переходит в auto
+        # на первом узнанном куске и остаётся в нём до конца
+        chunk_fp = _fingerprint_of(fp_keys[-len(buf):])
+        reprocess_auto = _seen_reprocess(chunk_fp, reprocess_yes, reprocess_auto)
+        seen_fps.append(chunk_fp)
+        _ingest_chunk(buf, buf_idx, stats, reprocess_yes, reprocess_auto)
+        flushes += 1
+        if first_queued_ms is None and stats["queued"]:
+            first_queued_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+        buf, buf_idx = [], []
+
+    def _flush_due():
+        if not buf:
+            return None
+        return max(0.0, NDJSON_FLUSH_MS / 1000.0 - (time.perf_counter() - buf_since))
+
+    body = request.stream if request.stream is not None else io.BytesIO()
+    reader = _read_ahead(_iter_ndjson(decoded_stream(body, content_encoding(request))), _flush_due, NDJSON_FLUSH)
+    try:
+        for item in reader:
+            if item is _READ_IDLE:
+                _flush()
+                continue
+            obj, err = item
+            idx = stats["received"]
+            stats["received"] += 1
+            if err is not None:
+                stats["invalid"] += 1
+                if len(stats["errors"]) < 100:
+                    stats["errors"].append({"index": idx, "error": err})
+                continue
+            if cap is not None and admitted >= cap:
+                if resume_from is None:
+                    resume_from = idx
+                stats["deferred"] += 1
+                continue
+
+            admitted += 1
+            fp_keys.append(_fingerprint_key(obj))
+            if not buf:
+                buf_since = time.perf_counter()
+            buf.append(obj)
+            buf_idx.append(idx)
+            if len(buf) >= NDJSON_FLUSH or (time.perf_counter() - buf_since) * 1000.0 >= NDJSON_FLUSH_MS:
+                _flush()
+    except APIException as e:
+        truncated = str(e.detail)
+        stats["errors"].append({"index": stats["received"], "error": truncated})
+    finally:
+        reader.close()
+    _flush()
+
+    if not stats["received"]:
+        return Response({"error": "Нет транзакций для обработки"}, status=http_status.HTTP_400_BAD_REQUEST)
+
+    admission_info = None
+    if stats["deferred"]:
+        admission_info = {"deferred": stats["deferred"], "resume_from": resume_from,
+                          "retry_after": admission.retry_after(stats["deferred"])}
+    if reprocess_auto:
+        mode_ns = "auto"
+    batch_fingerprint = _fingerprint_of(fp_keys)
+    return _finish_ingest(
+        stats, mode_ns, idem_key, idem_redis_key, batch_fingerprint,
+        extra_log={"format": "ndjson", "flushes": flushes, "first_queued_ms": first_queued_ms,
+                   "content_encoding": content_encoding(request) or "identity", "truncated": truncated},
+        admission_info=admission_info, seen_fingerprints=seen_fps,
+    )
+
+
+@extend_schema(tags=["Main"], summary="Главный POST запрос")
+@api_view(["POST"])
+@parser_classes([CompressedJSONParser])  
+def stream_transaction(request):
+    encoding = content_encoding(request)
+    if encoding not in supported_encodings():
+        return Response(
+            {"error": f"Неподдерживаемый Content-Encoding: {encoding}. Допустимо: {', '.join(e for e in supported_encodings() if e)}"},
+            status=http_status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+    content_type = (request.content_type or "").lower()
+    if content_type.startswith(NDJSON_CONTENT_TYPE):
+        reprocess_yes, reprocess_auto = _reprocess_flag(request)
+        return _stream_ndjson(request, reprocess_yes, reprocess_auto)
+    if not content_type.startswith("application/json"):
+        return Response(
+            {"error": f"Поддерживается только application/json или {NDJSON_CONTENT_TYPE}"},
+            status=http_status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+    items = _ensure_list(request.data)
+    if not items:
+        return Response({"error": "Нет транзакций для обработки"}, status=http_status.HTTP_400_BAD_REQUEST)
+    if isinstance(items, list) and len(items) > MAX_BATCH:
+        return Response(
+            {"error": f"Слишком большой батч JSON: {len(items)} > {MAX_BATCH}. Отправьте несколькими запросами."},
+            status=413
+        )
+    stats = _new_ingest_stats()
+    stats["received"] = len(items)
+    reprocess_yes, reprocess_auto = _reprocess_flag(request)
+
+    batch_fingerprint = _make_fingerprint(items if isinstance(items, list) else [items])
+    reprocess_auto = _seen_reprocess(batch_fingerprint, reprocess_yes, reprocess_auto)
+
+    mode_ns = "auto" if reprocess_auto else ("reprocess" if reprocess_yes else "normal")
+    idem_key = request.headers.get("Idempotency-Key") or request.query_params.get("idempotency_key")
+    idem_redis_key = f"{IDEMP_NS}:{mode_ns}:{idem_key}" if idem_key else None
+
+    cached = _cached_idempotent_response(idem_redis_key, idem_key, mode_ns, batch_fingerprint)
+    if cached is not None:
+        return cached
+
+    admission_info = None
+    if admission is not None and isinstance(items, list):
+        decision = admission.decide(len(items))
+        if decision.status != http_status.HTTP_202_ACCEPTED:
+            return _admission_rejected(decision)
+        if decision.admit is not None and decision.admit < len(items):
+            stats["deferred"] = len(items) - decision.admit
+            admission_info = {"deferred": stats["deferred"], "resume_from": decision.admit,
+                              "retry_after": decision.retry_after}
+            items = items[:decision.admit]
+            batch_fingerprint = _make_fingerprint(items)
+
+    for start in range(0, len(items), VAL_CHUNK):
+        part = items[start:start + VAL_CHUNK]
+        _ingest_chunk(part, range(start, start + len(part)), stats, reprocess_yes, reprocess_auto)
+
+    return _finish_ingest(stats, mode_ns, idem_key, idem_redis_key, batch_fingerprint,
+                          admission_info=admission_info)
 
 
 @extend_schema(tags=["Analytics"], summary="Получить общую статистику по транзакциям")
@@ -9,10 +9,14 @@ WEBHOOK_BASE_URL = os.getenv("NOTIFY_WEBHOOK_URL", "http://127.0.0.1:8001/api/al
 FRONTEND_BASE_URL = os.getenv("FRONTEND_BASE_URL", "http://127.0.0.1:8001/transaction-details.html")
 ALERTS_QUEUE = os.getenv("ALERTS_QUEUE", "alerts_queue")
 DEDUP_TTL_SEC = int(os.getenv("WEBHOOK_DEDUP_TTL", "600"))
+TG_QUEUE = "tg_alert_queue"
+TG_MAXLEN = 2000
+BULK_CHUNK = int(os.getenv("ALERTS_BULK_CHUNK", "500"))
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 
 r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=1, decode_responses=True)
+r_tg = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
 logger = logging.getLogger("transactions.webhook")
 
 ROUTES = {
@@ -23,11 +27,27 @@ ROUTES = {
 }
 
 
+# SET NX + LPUSH на каждый алерт: дедуп и постановка в очередь атомарно, один вызов на пачку
+ENQUEUE_BULK_LUA = """
+local ttl = tonumber(ARGV[1])
+local out = {}
+for i = 2, #KEYS do
+  if redis.call('SET', KEYS[i], '1', 'NX', 'EX', ttl) then
+    redis.call('LPUSH', KEYS[1], ARGV[i])
+    out[#out + 1] = i - 1
+  end
+end
+return out
+"""
+
+_enqueue_bulk_script = r.register_script(ENQUEUE_BULK_LUA)
+
+
 def _payload_hash(payload: dict) -> str:
     return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
 
 
-def send_alert_webhook(tx: dict, rules_triggered=None, criticality="medium"):
+def build_alert_payload(tx: dict, rules_triggered=None, criticality="medium") -> dict:
     if criticality not in ROUTES:
         criticality = "medium"
 
@@ -54,6 +74,12 @@ def send_alert_webhook(tx: dict, rules_triggered=None, criticality="medium"):
         "transaction_link": transaction_link,
         "criticality": criticality,
     }
+    return payload
+
+
+def send_alert_webhook(tx: dict, rules_triggered=None, criticality="medium"):
+    payload = build_alert_payload(tx, rules_triggered, criticality)
+    criticality = payload["criticality"]
 
     key_hash = _payload_hash(payload)
     dedup_key = f"alert:sent:{key_hash}"
@@ -75,3 +101,55 @@ def send_alert_webhook(tx: dict, rules_triggered=None, criticality="medium"):
             "event": "alert_enqueue_failed",
             "error": str(e)
         })
+
+
+def send_alerts_bulk(alerts, tg_client=None) -> dict:
+    tg_client = tg_client or r_tg
+    payloads, tg_payloads = [], []
+    for tx, rules_triggered, criticality, reason in alerts:
+        try:
+            payload = build_alert_payload(tx, rules_triggered, criticality)
+        except (TypeError, ValueError) as e:
+            logger.error({"event": "alert_payload_failed", "tx": tx.get("transaction_id"), "error": str(e)})
+            continue
+        payloads.append(payload)
+        tg_payloads.append({
+            "txid": tx.get("transaction_id"),
+            "amount": tx.get("amount"),
+            "sender": tx.get("sender_account"),
+            "receiver": tx.get("receiver_account"),
+            "criticality": criticality,
+            "reason": reason,
+        })
+
+    enqueued = 0
+    for i in range(0, len(payloads), BULK_CHUNK):
+        chunk = payloads[i:i + BULK_CHUNK]
+        try:
+            done = _enqueue_bulk_script(
+                keys=[ALERTS_QUEUE] + [f"alert:sent:{_payload_hash(p)}" for p in chunk],
+                args=[DEDUP_TTL_SEC] + [json.dumps(p) for p in chunk],
+            )
+            enqueued += len(done)
+        except redis.RedisError as e:
+            logger.error({"event": "alert_enqueue_failed", "count": len(chunk), "error": str(e)})
+
+    tg_sent = 0
+    if tg_payloads:
+        try:
+            pipe = tg_client.pipeline(transaction=False)
+            for p in tg_payloads:
+                pipe.xadd(TG_QUEUE, {"payload": json.dumps(p)}, maxlen=TG_MAXLEN)
+            tg_sent = len(pipe.execute())
+        except redis.RedisError as e:
+            logger.warning({"event": "tg_enqueue_failed", "count": len(tg_payloads), "error": str(e)})
+
+    stats = {
+        "alerts": len(payloads),
+        "enqueued": enqueued,
+        "dedup_skipped": len(payloads) - enqueued,
+        "tg_enqueued": tg_sent,
+    }
+    if payloads:
+        logger.info({"event": "alerts_enqueued", "queue": ALERTS_QUEUE, **stats})
+    return stats
@@ -0,0 +1,660 @@
+import os
+import json
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+from django.db import connection
+from django.db import transaction as db_tx
+from .models import Transaction
+from .rules import pattern, pattern_verdict, window_seconds_of
+
+
+WINDOWS_ON      = os.getenv("TX_PATTERN_WINDOWS", "1") == "1"
+WINDOW_BACKEND  = os.getenv("TX_WINDOW_BACKEND", "memory")
+WINDOW_PREFIX   = os.getenv("TX_WINDOW_PREFIX", "txwin")
+WINDOW_TIME     = os.getenv("TX_WINDOW_TIME", "event")
+LATENESS_SEC    = float(os.getenv("TX_WINDOW_LATENESS_SEC", "300"))
+BUCKET_SEC      = max(1, int(os.getenv("TX_WINDOW_BUCKET_SEC", "5")))
+EVICT_EVERY_SEC = float(os.getenv("TX_WINDOW_EVICT_SEC", "60"))
+SEED_LOCK_MS    = int(os.getenv("TX_WINDOW_SEED_LOCK_MS", "120000"))
+FLUSH_CHUNK     = int(os.getenv("TX_WINDOW_FLUSH_CHUNK", "2000"))
+JOURNAL_SEC     = float(os.getenv("TX_WINDOW_JOURNAL_SEC", "600"))
+
+GROUP_MODES = ("sender", "receiver", "pair")
+
+_SEED_SQL = {
+    "sender": ("sender_account", "sender_account IS NOT NULL AND sender_account <> ''"),
+    "receiver": ("receiver_account", "receiver_account IS NOT NULL AND receiver_account <> ''"),
+    "pair": (
+        "sender_account, receiver_account",
+        "sender_account IS NOT NULL AND sender_account <> '' "
+        "AND receiver_account IS NOT NULL AND receiver_account <> ''",
+    ),
+}
+
+
+# KEYS[1] - признак захвата заливкой, KEYS[2] - журнал приращений на время захвата,
+# KEYS[3] - отметки сброшенных сообщений (zset), KEYS[4] - приращения сообщений, KEYS[5] - meta,
+# дальше ключи окон. Сообщение, уже отмеченное в KEYS[3], повторно не применяется: пересчёт
+# батча после сбоя не удваивает окна. Пока идёт захват, приращения дублируются в журнал;
+# перезапись поля из БД добавляет журнальное значение этого поля.
+WINDOW_MERGE_LUA = """
+local ttl = tonumber(ARGV[1])
+local lo = tonumber(ARGV[2])
+local max_fields = tonumber(ARGV[3])
+local overwrite = ARGV[4] == '1'
+local journal_ttl = tonumber(ARGV[5])
+local keep = tonumber(ARGV[6])
+local now = tonumber(ARGV[7])
+local capture = not overwrite and redis.call('EXISTS', KEYS[1]) == 1
+
+local function merge(key, field, c, s, m)
+    local cur = redis.call('HGET', key, field)
+    if cur then
+        local pc, ps, pm = string.match(cur, '([^:]+):([^:]+):([^:]+)')
+        c = c + tonumber(pc)
+        s = s + tonumber(ps)
+        if tonumber(pm) > m then
+            m = tonumber(pm)
+        end
+    end
+    return c, s, m
+end
+
+local function put(k, b, c, s, m)
+    local jf = KEYS[k] .. '|' .. b
+    if overwrite then
+        c, s, m = merge(KEYS[2], jf, c, s, m)
+        redis.call('HDEL', KEYS[2], jf)
+    else
+        if capture then
+            local jc, js, jm = merge(KEYS[2], jf, c, s, m)
+            redis.call('HSET', KEYS[2], jf, string.format('%d:%.17g:%.17g', jc, js, jm))
+        end
+        c, s, m = merge(KEYS[k], b, c, s, m)
+    end
+    redis.call('HSET', KEYS[k], b, string.format('%d:%.17g:%.17g', c, s, m))
+end
+
+local i = 8
+if overwrite then
+    for k = 6, #KEYS do
+        local n = tonumber(ARGV[i])
+        i = i + 1
+        for _ = 1, n do
+            put(k, ARGV[i], tonumber(ARGV[i + 1]), tonumber(ARGV[i + 2]), tonumber(ARGV[i + 3]))
+            i = i + 4
+        end
+    end
+else
+    while i <= #ARGV do
+        local tag, payload, n = ARGV[i], ARGV[i + 1], tonumber(ARGV[i + 2])
+        i = i + 3
+        local fresh = redis.call('ZADD', KEYS[3], 'NX', now, tag) == 1
+        if fresh then
+            redis.call('HSET', KEYS[4], tag, payload)
+        end
+        for _ = 1, n do
+            if fresh then
+                local a = tonumber(ARGV[i + 2])
+                put(tonumber(ARGV[i]), ARGV[i + 1], 1, a, a)
+            end
+            i = i + 3
+        end
+    end
+    local old = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now - keep, 'LIMIT', 0, 1000)
+    if #old > 0 then
+        redis.call('HDEL', KEYS[4], unpack(old))
+        redis.call('ZREM', KEYS[3], unpack(old))
+    end
+    redis.call('PEXPIRE', KEYS[3], keep)
+    redis.call('PEXPIRE', KEYS[4], keep)
+    if capture then
+        redis.call('PEXPIRE', KEYS[2], journal_ttl)
+    end
+end
+for k = 6, #KEYS do
+    if redis.call('HLEN', KEYS[k]) > max_fields then
+        for _, f in ipairs(redis.call('HKEYS', KEYS[k])) do
+            if tonumber(f) < lo then
+                redis.call('HDEL', KEYS[k], f)
+            end
+        end
+    end
+    redis.call('PEXPIRE', KEYS[k], ttl)
+end
+-- meta живёт, пока в окна пишут: после простоя дольше горизонта заливка повторится
+redis.call('PEXPIRE', KEYS[5], ttl)
+return #KEYS - 5
+"""
+
+SEED_BEGIN_LUA = """
+return redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) and 1 or 0
+"""
+
+# захват начинается после снимка БД: журнал прошлого захвата выбрасывается, а приращения
+# сообщений, сброшенных до этого момента, отдаются заливке целиком
+SEED_CAPTURE_LUA = """
+redis.call('SET', KEYS[1], '1', 'PX', ARGV[1])
+redis.call('DEL', KEYS[2])
+return redis.call('HGETALL', KEYS[3])
+"""
+
+
+def group_key(tx: dict, mode: str):
+    if mode == "sender":
+        return tx.get("sender_account") or None
+    if mode == "receiver":
+        return tx.get("receiver_account") or None
+    if mode == "pair":
+        s, rcv = tx.get("sender_account"), tx.get("receiver_account")
+        return (s, rcv) if s and rcv else None
+    return None
+
+
+class _Running:
+    # count/sum окна [lo, hi] ведутся инкрементально, max - монотонной очередью (bucket, max):
+    # при сдвиге окна добавляются только вошедшие бакеты и вычитаются вышедшие
+    __slots__ = ("lo", "hi", "cnt", "total", "peaks")
+
+    def __init__(self, buckets: dict, lo: int, hi):
+        self.lo, self.hi = lo, hi
+        self.cnt, self.total = 0, 0.0
+        self.peaks = deque()
+        for b in sorted(b for b in buckets if lo <= b <= hi):
+            c, t, m = buckets[b]
+            self.cnt += c
+            self.total += t
+            self._peak(b, m)
+
+    def _peak(self, b: int, m: float):
+        peaks = self.peaks
+        while peaks and peaks[-1][1] <= m:
+            peaks.pop()
+        peaks.append((b, m))
+
+    def slide(self, buckets: dict, lo: int, hi) -> bool:
+        if lo < self.lo or hi < self.hi:
+            return False
+        grow = hi - self.hi if hi != self.hi else 0
+        if (lo - self.lo) + grow > len(buckets):
+            return False
+        for b in range(self.hi + 1, hi + 1) if grow else ():
+            slot = buckets.get(b)
+            if slot is not None:
+                self.cnt += slot[0]
+                self.total += slot[1]
+                self._peak(b, slot[2])
+        for b in range(self.lo, lo):
+            slot = buckets.get(b)
+            if slot is not None:
+                self.cnt -= slot[0]
+                self.total -= slot[1]
+        if not self.cnt:
+            self.total = 0.0
+        peaks = self.peaks
+        while peaks and peaks[0][0] < lo:
+            peaks.popleft()
+        self.lo, self.hi = lo, hi
+        return True
+
+    def add(self, buckets: dict, b: int, amount: float, m: float):
+        if not self.lo <= b <= self.hi:
+            return
+        self.cnt += 1
+        self.total += amount
+        if not self.peaks or b >= self.peaks[-1][0]:
+            self._peak(b, m)
+            return
+        # поздняя запись в середину окна: очередь максимумов пересобирается по бакетам окна
+        self.peaks.clear()
+        for k in sorted(k for k in buckets if self.lo <= k <= self.hi):
+            self._peak(k, buckets[k][2])
+
+    def result(self) -> tuple:
+        mx = self.peaks[0][1] if self.peaks else 0.0
+        return self.cnt, self.total, mx if mx > 0.0 else 0.0
+
+
+def tx_epoch(tx: dict, default: float) -> float:
+    ts = tx.get("timestamp")
+    if hasattr(ts, "timestamp"):
+        return ts.timestamp()
+    return default
+
+
+class WindowStore:
+    def __init__(self, bucket_sec: int = BUCKET_SEC, evict_every_sec: float = EVICT_EVERY_SEC,
+                 event_time: bool = WINDOW_TIME == "event", lateness: float = LATENESS_SEC):
+        self.bucket_sec = bucket_sec
+        self.evict_every_sec = evict_every_sec
+        self.event_time = event_time
+        self.lateness = lateness
+        self.keys = {m: {} for m in GROUP_MODES}
+        self.runs = {}
+        self.modes = frozenset()
+        self.horizon = 0
+        self.since = float("inf")
+        self.now = time.time()
+        self.max_event = None
+        self.late = 0
+        self.stale = True
+        self.last_evict = time.monotonic()
+
+    def invalidate(self):
+        self.stale = True
+
+    def _bucket(self, ts: float) -> int:
+        return int(ts // self.bucket_sec)
+
+    def watermark(self):
+        if not self.event_time:
+            return self.now
+        if self.max_event is None:
+            return None
+        return self.max_event - self.lateness
+
+    def _floor_bucket(self):
+        wm = self.watermark()
+        return None if wm is None else self._bucket(wm - self.horizon)
+
+    def anchor(self, tx: dict) -> float:
+        return tx_epoch(tx, self.now) if self.event_time else self.now
+
+    def _add(self, mode: str, key, b: int, amount: float):
+        buckets = self.keys[mode].get(key)
+        if buckets is None:
+            buckets = self.keys[mode][key] = {}
+        slot = buckets.get(b)
+        if slot is None:
+            slot = buckets[b] = [1, amount, amount]
+        else:
+            slot[0] += 1
+            slot[1] += amount
+            if amount > slot[2]:
+                slot[2] = amount
+        runs = self.runs.get((mode, key))
+        if runs:
+            for run in runs.values():
+                run.add(buckets, b, amount, slot[2])
+
+    def covers(self, tx: dict, window_seconds: int) -> bool:
+        if not self.event_time:
+            return True
+        ts = tx_epoch(tx, self.now)
+        lo = self.since
+        floor = self._floor_bucket()
+        if floor is not None:
+            lo = max(lo, floor * self.bucket_sec)
+        return lo + window_seconds <= ts <= self.now + self.lateness
+
+    def add_tx(self, tx: dict, tag: str = None):
+        ts = tx_epoch(tx, self.now)
+        if self.event_time:
+            wm = self.watermark()
+            if wm is not None and ts < wm:
+                self.late += 1
+            # метка из будущего не должна сдвигать watermark и выталкивать окна
+            if (self.max_event is None or ts > self.max_event) and ts <= self.now + self.lateness:
+                self.max_event = ts
+        b = self._bucket(ts)
+        floor = self._floor_bucket()
+        if floor is not None and b < floor:
+            return
+        amount = float(tx.get("amount") or 0.0)
+        for mode in self.modes:
+            key = group_key(tx, mode)
+            if key is not None:
+                self._add(mode, key, b, amount)
+
+    def stats(self, mode: str, key, window_seconds: int, at: float) -> tuple:
+        buckets = self.keys[mode].get(key)
+        if not buckets:
+            return 0, 0.0, 0.0
+        lo = self._bucket(at - window_seconds)
+        hi = self._bucket(at) if self.event_time else float("inf")
+        runs = self.runs.setdefault((mode, key), {})
+        run = runs.get(window_seconds)
+        if run is None or not run.slide(buckets, lo, hi):
+            fresh = _Running(buckets, lo, hi)
+            # запрос из прошлого (поздняя запись) считается заново, но не сбивает окно текущего времени
+            if run is None or lo >= run.lo:
+                runs[window_seconds] = fresh
+            return fresh.result()
+        return run.result()
+
+    def evict(self):
+        self.last_evict = time.monotonic()
+        lo = self._floor_bucket()
+        if lo is None:
+            return
+        for mode in GROUP_MODES:
+            table = self.keys[mode]
+            for key in list(table):
+                buckets = table[key]
+                old = [b for b in buckets if b < lo]
+                if not old:
+                    continue
+                for b in old:
+                    del buckets[b]
+                # вычесть вытесненные бакеты при сдвиге уже нельзя - окна ключа пересоберутся
+                self.runs.pop((mode, key), None)
+                if not buckets:
+                    del table[key]
+
+    def _seed_rows(self, mode: str, since: float, until: float):
+        since = datetime.fromtimestamp(since, tz=dt_timezone.utc)
+        until = datetime.fromtimestamp(until, tz=dt_timezone.utc)
+        table = connection.ops.quote_name(Transaction._meta.db_table)
+        cols, cond = _SEED_SQL[mode]
+        with connection.cursor() as c:
+            c.execute(
+                f"SELECT {cols}, floor(extract(epoch from timestamp) / %s)::bigint AS b, "
+                f"count(*), sum(amount), max(amount) FROM {table} "
+                f"WHERE timestamp >= %s AND timestamp < %s AND {cond} GROUP BY {cols}, b",
+                [self.bucket_sec, since, until],
+            )
+            for row in c.fetchall():
+                key = row[0] if mode != "pair" else (row[0], row[1])
+                b, cnt, total, mx = row[-4:]
+                yield key, int(b), [int(cnt), float(total or 0.0), float(mx or 0.0)]
+
+    def seed(self, modes, horizon: int, since: float, until: float):
+        self.keys = {m: {} for m in GROUP_MODES}
+        self.runs = {}
+        self.modes = frozenset(modes)
+        self.horizon = horizon
+        self.since = since
+        self.max_event = None
+        for mode in self.modes:
+            out = self.keys[mode]
+            for key, b, slot in self._seed_rows(mode, since, until):
+                out.setdefault(key, {})[b] = slot
+        self.stale = False
+        self.last_evict = time.monotonic()
+
+    def _required(self, pattern_rules, rows):
+        modes = {r.group_mode for r in pattern_rules if r.group_mode in GROUP_MODES}
+        horizon = max((window_seconds_of(r) for r in pattern_rules), default=0) + self.bucket_sec
+        start = self.now
+        if self.event_time:
+            wm = self.watermark()
+            # заливка не глубже watermark (или now) - horizon - lateness: запись со старой или мусорной
+            # меткой не должна тянуть в память всю таблицу, такие записи считает pattern() по БД
+            floor = (self.now if wm is None else wm) - self.lateness
+            times = [tx_epoch(tx, self.now) for tx in rows]
+            start = max(min(times, default=floor), floor)
+        return modes, horizon, start - horizon, self.now + self.lateness + self.bucket_sec
+
+    def _needs_seed(self, modes, horizon) -> bool:
+        # запись раньше залитого since не перематывает окна, а уходит в pattern()
+        return self.stale or not modes <= self.modes or horizon > self.horizon
+
+    def prepare(self, pattern_rules, rows=(), now: float = None) -> bool:
+        self.now = time.time() if now is None else now
+        modes, horizon, since, until = self._required(pattern_rules, rows)
+        if self._needs_seed(modes, horizon):
+            self.seed(modes | self.modes, max(horizon, self.horizon), since, until)
+            return True
+        if time.monotonic() - self.last_evict >= self.evict_every_sec:
+            self.evict()
+        return False
+
+    def begin(self, rows, tags=()):
+        pass
+
+    def flush(self):
+        pass
+
+    def size(self) -> int:
+        return sum(len(t) for t in self.keys.values())
+
+
+class RedisWindowStore(WindowStore):
+    def __init__(self, client, prefix: str = WINDOW_PREFIX, bucket_sec: int = BUCKET_SEC, owner: str = ""):
+        super().__init__(bucket_sec)
+        self.client = client
+        self.prefix = prefix
+        self.owner = owner or f"{os.getpid()}"
+        self.meta_key = f"{prefix}:meta"
+        self.lock_key = f"{prefix}:seed_lock"
+        self.capture_key = f"{prefix}:seed_capture"
+        self.journal_key = f"{prefix}:seed_journal"
+        self.marks_key = f"{prefix}:flushed"
+        self.log_key = f"{prefix}:flush_log"
+        self.pending = []
+        self.replayed = set()
+        self._incs = None
+        self.seeded_keys = 0
+        self._merge = client.register_script(WINDOW_MERGE_LUA)
+        self._seed_begin = client.register_script(SEED_BEGIN_LUA)
+        self._seed_capture = client.register_script(SEED_CAPTURE_LUA)
+
+    def _rkey(self, mode: str, key) -> str:
+        if mode == "pair":
+            key = f"{key[0]}|{key[1]}"
+        return f"{self.prefix}:{mode}:{key}"
+
+    def _header(self, overwrite: bool) -> tuple:
+        lo = self._floor_bucket()
+        lo = -1 if lo is None else lo
+        max_fields = 2 * (self.horizon // self.bucket_sec + 1)
+        ttl_ms = int((self.horizon + (self.lateness if self.event_time else 0)) * 1000)
+        keys = [self.capture_key, self.journal_key, self.marks_key, self.log_key, self.meta_key]
+        args = [ttl_ms, lo, max_fields, "1" if overwrite else "0", SEED_LOCK_MS,
+                int(JOURNAL_SEC * 1000), int(time.time() * 1000)]
+        return keys, args
+
+    def _write(self, items):
+        for i in range(0, len(items), FLUSH_CHUNK):
+            keys, args = self._header(overwrite=True)
+            for (mode, key), buckets in items[i:i + FLUSH_CHUNK]:
+                keys.append(self._rkey(mode, key))
+                args.append(len(buckets))
+                for b, (c, t, m) in buckets.items():
+                    args.extend((b, c, repr(float(t)), repr(float(m))))
+            self._merge(keys=keys, args=args)
+
+    def _present(self, txids) -> set:
+        found, txids = set(), list(txids)
+        for i in range(0, len(txids), 5000):
+            found.update(Transaction.objects.filter(
+                transaction_id__in=txids[i:i + 5000]
+            ).values_list("transaction_id", flat=True))
+        return found
+
+    def _unsaved(self, rows: dict, missing, since: float, until: float):
+        # приращения сообщений, сброшенных в окна до захвата, чьих транзакций ещё нет в снимке:
+        # перезапись из БД иначе потеряла бы их
+        logged = [json.loads(v) for v in self._seed_capture(
+            keys=[self.capture_key, self.journal_key, self.log_key], args=[SEED_LOCK_MS]
+        )[1::2]]
+        present = self._present({e["tx"] for e in logged if e.get("tx")})
+        for e in logged:
+            if e.get("tx") in present or not since <= e["ts"] < until:
+                continue
+            amount = e["a"]
+            for mode, key, b in e["e"]:
+                if mode not in missing:
+                    continue
+                key = tuple(key) if mode == "pair" else key
+                buckets = rows.setdefault((mode, key), {})
+                slot = buckets.get(b)
+                if slot is None:
+                    buckets[b] = [1, amount, amount]
+                else:
+                    slot[0] += 1
+                    slot[1] += amount
+                    if amount > slot[2]:
+                        slot[2] = amount
+
+    def seed(self, modes, horizon: int, since: float, until: float):
+        meta = self.client.hgetall(self.meta_key)
+        missing = [
+            m for m in modes
+            if int(meta.get(m) or 0) < horizon or float(meta.get(f"{m}:since") or "inf") > since
+        ]
+        if missing:
+            if not self._seed_begin(keys=[self.lock_key], args=[self.owner, SEED_LOCK_MS]):
+                # заливку ведёт другой воркер: приращения пишем (они попадут в журнал),
+                # но считать по неполной истории нельзя, пока stale
+                self.modes = frozenset(modes)
+                self.horizon = horizon
+                self.since = since
+                self.stale = True
+                return False
+            try:
+                self.horizon = horizon
+                self.max_event = None
+                rows = {}
+                # один снимок БД на все режимы; журнал сброшенных сообщений читается после снимка
+                # и сверяется с ним же, а всё сброшенное позже копится в журнале захвата
+                with db_tx.atomic():
+                    with connection.cursor() as c:
+                        c.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                    for mode in missing:
+                        for key, b, slot in self._seed_rows(mode, since, until):
+                            rows.setdefault((mode, key), {})[b] = slot
+                    self._unsaved(rows, missing, since, until)
+                self._write(list(rows.items()))
+                ttl_ms = int((self.horizon + (self.lateness if self.event_time else 0)) * 1000)
+                meta = {}
+                for mode in missing:
+                    meta.update({mode: horizon, f"{mode}:since": since})
+                pipe = self.client.pipeline(transaction=True)
+                pipe.hset(self.meta_key, mapping=meta)
+                pipe.pexpire(self.meta_key, ttl_ms)
+                pipe.execute()
+                self.seeded_keys += len(rows)
+            finally:
+                pipe = self.client.pipeline(transaction=True)
+                pipe.delete(self.capture_key, self.journal_key)
+                pipe.delete(self.lock_key)
+                pipe.execute()
+        self.modes = frozenset(modes)
+        self.horizon = horizon
+        self.since = since
+        self.stale = False
+        return bool(missing)
+
+    def prepare(self, pattern_rules, rows=(), now: float = None) -> bool:
+        self.now = time.time() if now is None else now
+        modes, horizon, since, until = self._required(pattern_rules, rows)
+        if self._needs_seed(modes, horizon):
+            return self.seed(modes | self.modes, max(horizon, self.horizon), since, until)
+        return False
+
+    def begin(self, rows, tags=()):
+        self.keys = {m: {} for m in GROUP_MODES}
+        self.runs = {}
+        self.pending = []
+        self.replayed = set()
+        if tags:
+            # сообщения, уже сброшенные до сбоя, в окнах есть - повторно их не добавляем
+            pipe = self.client.pipeline(transaction=False)
+            for tag in tags:
+                pipe.zscore(self.marks_key, tag)
+            self.replayed = {tag for tag, score in zip(tags, pipe.execute()) if score is not None}
+        wanted = []
+        for mode in self.modes:
+            seen = set()
+            for tx in rows:
+                key = group_key(tx, mode)
+                if key is not None and key not in seen:
+                    seen.add(key)
+                    wanted.append((mode, key))
+        if not wanted:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for mode, key in wanted:
+            pipe.hgetall(self._rkey(mode, key))
+        lo = self._bucket(self.since)
+        floor = self._floor_bucket()
+        if floor is not None:
+            lo = max(lo, floor)
+        for (mode, key), fields in zip(wanted, pipe.execute()):
+            buckets = {}
+            for b, v in fields.items():
+                b = int(b)
+                if b >= lo:
+                    c, t, m = v.split(":")
+                    buckets[b] = [int(c), float(t), float(m)]
+            if buckets:
+                self.keys[mode][key] = buckets
+
+    def add_tx(self, tx: dict, tag: str = None):
+        if tag is not None and tag in self.replayed:
+            return
+        self._incs = []
+        try:
+            super().add_tx(tx)
+            if self._incs:
+                self.pending.append((tag or uuid.uuid4().hex, tx, self._incs))
+        finally:
+            self._incs = None
+
+    def _add(self, mode: str, key, b: int, amount: float):
+        super()._add(mode, key, b, amount)
+        if self._incs is not None:
+            self._incs.append((mode, key, b, amount))
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        for i in range(0, len(pending), FLUSH_CHUNK):
+            keys, args = self._header(overwrite=False)
+            index = {}
+            for tag, tx, incs in pending[i:i + FLUSH_CHUNK]:
+                payload = {
+                    "tx": tx.get("transaction_id"), "ts": tx_epoch(tx, self.now), "a": incs[0][3],
+                    "e": [[mode, key, b] for mode, key, b, _a in incs],
+                }
+                args.extend((tag, json.dumps(payload), len(incs)))
+                for mode, key, b, amount in incs:
+                    k = index.get((mode, key))
+                    if k is None:
+                        keys.append(self._rkey(mode, key))
+                        k = index[(mode, key)] = len(keys)
+                    args.extend((k, b, repr(float(amount))))
+            self._merge(keys=keys, args=args)
+
+    def evict(self):
+        self.last_evict = time.monotonic()
+
+    def size(self) -> int:
+        return self.seeded_keys
+
+
+def make_window_store(client, owner: str = ""):
+    if not WINDOWS_ON:
+        return None
+    if WINDOW_BACKEND == "redis":
+        return RedisWindowStore(client, owner=owner)
+    return WindowStore()
+
+
+def pattern_windowed(tx: dict, rule, store: WindowStore):
+    mode = rule.group_mode
+    key = group_key(tx, mode)
+    if mode == "sender":
+        if key is None:
+            return False, "Нет sender_account"
+        group_label = f"sender={key}"
+    elif mode == "receiver":
+        if key is None:
+            return False, "Нет receiver_account"
+        group_label = f"receiver={key}"
+    elif mode == "pair":
+        if key is None:
+            return False, "Нет sender_account или receiver_account"
+        group_label = f"pair={key[0]}->{key[1]}"
+    else:
+        return False, f"Неизвестный group_mode={mode}"
+
+    window_seconds = window_seconds_of(rule)
+    if not store.covers(tx, window_seconds):
+        return pattern(tx, rule)
+    cnt, total, mx = store.stats(mode, key, window_seconds, store.anchor(tx))
+    return pattern_verdict(
+        rule, window_seconds, cnt, total, mx, float(tx.get("amount") or 0.0), group_label
+    )